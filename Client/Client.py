@@ -5,24 +5,17 @@
     Python Version: 3.7
 '''
 
-import hashlib
 import json
 import logging
-import os
 from tkinter import *
 from tkinter import scrolledtext
 
-from twisted.internet import reactor, protocol, tksupport
+from twisted.internet import protocol, tksupport
 
-import Networking
-from Client.DHTRegistration import DHTRegistration
-from Client.DHTSearch import DHTSearch
-from Client.MessageFactory import MessageFactory
-from Encryption.AsymmetricEncryption import AsymmetricEncryption
-from Models.User import User
-from Networking.DHT import DHT
-from Networking.OR import OR
-from Utils import StateChecks, Globals, Utils
+from Networking.NodeContext import defaultNode
+from Networking.RoutingState import routingState
+from Utils import EventBus, StateChecks
+from Utils.EventBus import eventBus
 
 # Instanitate a useful logger. The handler also allows us to log information to file which will appear in client.log
 logging.basicConfig(
@@ -65,10 +58,6 @@ class Client(protocol.Protocol, logging.Handler):
     # GUI text box that indicates to the user when the searched recipitent has been found in the DHT and is available for messaging
     stateOfRecipient = None
 
-    # Instantiate a local copy of asymmetric encryption
-    encryption = AsymmetricEncryption()
-    # Instantiate a local copy of the utility class allowing us to use useful functions
-    Utils = Utils.Utils()
 
     # Initialization method for the client class
     # Determine whether or not this node is already a member of a network. Launch the correct UI depending on the result
@@ -79,9 +68,7 @@ class Client(protocol.Protocol, logging.Handler):
             # If network data exists then we will read our DHT data into memory
             logging.info("Network data loaded, booting main GUI")
 
-            with open("DHT.json", "r") as f:
-                contents = f.read()
-            self.peers = json.loads(contents)
+            self.peers = routingState.table().toDict()
 
             # Load our user credentials into memory, this is used by a number of methods
             with open("User.json", "r") as f:
@@ -94,12 +81,6 @@ class Client(protocol.Protocol, logging.Handler):
             logging.info("No network data, launching initital UI")
             self.initialGUI()
 
-        # Attempt to remove the previous messaging partner on application startup. If one does not exist exception is thrown and application continues to boot
-        try:
-            os.remove("messagingPartner.json")
-        except:
-            logging.debug("No previous partner!")
-
         logging.info("Client has been initialized!")
 
     # This method contains all the tkinter logic for displaying the initial UI.
@@ -175,7 +156,7 @@ class Client(protocol.Protocol, logging.Handler):
     # Contains all the tkinter logic for displaying the main UI.
     def mainGUI(self):
         # Declare these variables as global so it is clear to the reader these are used elsewhere
-        # These variables need to be global so they can be accessed within updateGUI
+        # These variables need to be global so they can be accessed by the event bus subscribers
         global root
         global predecessor
         global successor
@@ -325,8 +306,14 @@ class Client(protocol.Protocol, logging.Handler):
         # Disable the message entry field by default. Prevent message sending without a recipitent or onion route
         messageEntry.config(state=DISABLED)
 
-        # Begin the recursive method of updating our UI
-        self.updateGUI()
+        # The UI is updated the moment the DHT, onion router or server publish a change, nothing is polled
+        eventBus.subscribe(EventBus.ROUTING_CHANGED, self.routingChanged)
+        eventBus.subscribe(EventBus.SESSION_SELECTED, self.sessionSelected)
+        eventBus.subscribe(EventBus.CIRCUIT_CHANGED, self.circuitStateChanged)
+        eventBus.subscribe(EventBus.MESSAGE_RECEIVED, self.messageReceived)
+
+        # Show the routing information we already have
+        self.routingChanged(routingState.table())
 
     """
     
@@ -339,37 +326,25 @@ class Client(protocol.Protocol, logging.Handler):
     
     """
     def searchDHT(self, username):
-        # Convert the username into a hash value that we can use to search the network
-        usernameHash = hashlib.sha256(username.get().encode('utf-8')).hexdigest()
-
-        DHTUserRequest = {}
-        DHTUserRequest['username'] = usernameHash
-        DHTUserRequest['ip'] = self.peers['nodeid']['ip']
-        DHTUserRequest['port'] = self.peers['nodeid']['port']
-
-        reactor.connectTCP(self.peers['successor']['ip'], int(self.peers['successor']['port']),
-                           DHTSearch(DHTUserRequest))
-
-        logging.info("SEARCH START")
+        try:
+            defaultNode.controller.search(username.get())
+        except ValueError as error:
+            logging.error("Search not sent, " + str(error))
 
     """
 
-    updateGUI is a method that fires every 2s. Using global variables it accesses tkinter UI componetns and updates them with fresh data being recieved by the server module
-    This method is also responsble for form validation. It will enable and disable UI components depending on the applications state
-    Firing every two seconds is handled by calling itself at the end of each update with root.after.
+    The methods below are subscribed to the event bus by mainGUI. Using global variables they access tkinter UI components and update them as soon as
+    the server module changes the applications state. They are also responsible for form validation, enabling and disabling UI components as the state changes
 
     """
 
-    def updateGUI(self):
+    # Called whenever our successor, predecessor or fingers change
+    def routingChanged(self, fingerTable):
         global nodeID
         global predecessor
         global successor
-        global stateOfRecipient
-        global messageEntry
 
-        with open("DHT.json", "r") as f:
-            contents = f.read()
-        self.peers = json.loads(contents)
+        self.peers = fingerTable.toDict()
 
         predecessorstr = self.peers['predecessor']['user']
         successorstr = self.peers['successor']['user']
@@ -379,13 +354,31 @@ class Client(protocol.Protocol, logging.Handler):
         successor.set("Successor: " + successorstr)
         nodeID.set("Node ID: " + nodeidstr)
 
-        sessionCreated = StateChecks.checkSessionExists()
-
-        if (sessionCreated == True):
+    # Called when we switch to a messaging partner, a partner we already have a live circuit to can be messaged straight away
+    def sessionSelected(self, session):
+        if session.isReady():
+            stateOfRecipient.set("CIRCUIT CREATED TO " + session.partner['user'])
+            messageEntry.config(state=NORMAL)
+        else:
+            stateOfRecipient.set("BUILDING CIRCUIT TO " + session.partner['user'])
+            messageEntry.config(state=DISABLED)
+
+    # Called by the session manager when a circuit to a messaging partner is established or fails to build. Only the
+    # circuit of the partner we are currently talking to changes the UI
+    def circuitStateChanged(self, session, established):
+        if session is not defaultNode.sessionManager.get():
+            return
+        if established:
             stateOfRecipient.set("CIRCUIT CREATED!")
             messageEntry.config(state=NORMAL)
+        else:
+            stateOfRecipient.set("CIRCUIT FAILED")
+            messageEntry.config(state=DISABLED)
 
-        root.after(2000, self.updateGUI)
+    # Writes an incoming message to the chat window using a global logger
+    def messageReceived(self, message):
+        chatA = logging.getLogger("2")
+        chatA.info(message)
 
     """
 
@@ -405,41 +398,18 @@ class Client(protocol.Protocol, logging.Handler):
     """
 
     def createNewNetwork(self, localip, localport, username):
-        logging.info("Creating a new network")
         localip = str(localip.get())
         localport = str(localport.get())
         username = str(username.get())
-        localport = str(localport)
-
-        """Initialize DHT"""
-        initialization = DHT()
 
-        self.encryption.generate_keys()
-
-        # Create a user object, set all user variables to the data gathered in the form
-        user = User()
-        user.ip = localip
-        user.port = localport
-        user.username = username
-        user.publicKey = self.encryption.getPublicKey().decode("utf-8")
-        user.nodeid = self.Utils.generateID(user.username)
-
-        # Convert our user to json format so we can save it to file
-        userAsJSON = json.dumps(user.toDict())
-        # Register username in a local file so we know who we are
-        file = open("User.json", "w+")
-        file.write(str(userAsJSON))
-        file.close()
-
-        initialization = DHT()
-        initialization.fingerTable.nodeid = user.toDict()
-        initialization.writeDHTInformation()
+        # RSA key generation runs on the crypto pool, the network is created once our keys exist
+        defaultNode.controller.createNetwork(localip, localport, username).addErrback(self.keyGenerationFailed)
 
     """
 
     This method is called by an event listener in the initial UI. The method takes several paramaters about the local and remote node
-    Tkinter variables will be taken and parsed into regular primitives. Asymmetric keys will be generated and the request to join the network
-    to the specified bootstrapping node will be sent using the Registration Factory.
+    Tkinter variables will be taken and parsed into regular primitives. The controller generates our asymmetric keys and sends the request to join the network
+    to the specified bootstrapping node using the Registration Factory.
     
     Arguments 
     bootstrapIP (string): Takes the ip address of a node in the network the user wishes to join
@@ -451,7 +421,6 @@ class Client(protocol.Protocol, logging.Handler):
     """
 
     def connectToExistingNetwork(self, bootstrapIP, bootstrapPort, localIP, localPort, username):
-        global listbox
         bootstrapIP = str(bootstrapIP.get())
         bootstrapPort = str(bootstrapPort.get())
         localIP = str(localIP.get())
@@ -463,43 +432,17 @@ class Client(protocol.Protocol, logging.Handler):
         """
         bootstrapPort = int(bootstrapPort)
 
-        """Create our encryption keys"""
-        self.encryption.generate_keys()
-        logger.info("public key")
-        logger.info(self.encryption.public_key)
-        logger.info("Encryption public key")
-        logger.info(self.encryption.getPublicKey())
-        logger.info("Encryption private key")
-        logger.info(self.encryption.getPrivateKey())
-
-        """Initialize DHT"""
-        initialization = DHT()
-
-        user = User()
-        user.ip = localIP
-        user.port = localPort
-        user.username = username
-        user.publicKey = self.encryption.getPublicKey().decode("utf-8")
-        user.nodeid = self.Utils.generateID(user.username)
-        initialization.fingerTable.nodeid = user.toDict()
-        initialization.writeDHTInformation()
-
-        user.publicKey = self.encryption.getPublicKey().decode("utf-8")
-        """Register username in a local file so we know who we are"""
-        file = open("User.json", "w+")
-        userstr = json.dumps(user.toDict())
-        file.write(str(userstr))
-        logger.info("Models Dict" + userstr)
-
-        logging.info("BOOTSTRAP TIME START")
-
-        reactor.connectTCP(bootstrapIP, bootstrapPort, DHTRegistration(userstr))
+        """Create our encryption keys on the crypto pool, the join request is sent once they exist"""
+        defaultNode.controller.join(bootstrapIP, bootstrapPort, localIP, localPort, username).addErrback(self.keyGenerationFailed)
+
+    def keyGenerationFailed(self, failure):
+        logger.error("Could not generate our asymmetric keys " + str(failure.getErrorMessage()))
 
     """
 
     This method is called by an event listener in the main UI. It will takes the ip port of the destination node as well as a message in plaintext.
     A route is created by the onion routing module and encryption will be applied to the message
-    The result will be returned from the onion routing module and then sent to the first hop of the circuit using connectTCP    
+    The result will be returned from the onion routing module and then sent to the first hop of the circuit over the connection pool    
 
     Arguments 
     ip (string): Takes the ip address of a node in the network the user wishes to join
@@ -509,38 +452,13 @@ class Client(protocol.Protocol, logging.Handler):
     """
 
     def sendMsg(self, msg):
-        msgCMD = "==MSG=="
-
-        logging.info("SEND TEXT START BEFORE ONION ROUTING")
-
-        # Open and read from the file messagingPartner, this will read in the credentials of your messaging partner
-        with open("messagingPartner.json", "r") as f:
-            contents = f.read()
-        self.recipitent = json.loads(contents)
-
-        """Assign protocol command"""
-        msg = msgCMD + self.getCurrentUser().upper() + ":" + " " + msg.get()
-        OR.loadInRecipitent()
-        OR.encryptMsgForOnionRouting(msg)
-
-        onionMessage = OR.encryptedMessage
-        logging.info("Sending Message" + str(onionMessage))
-        onionMessage = str(onionMessage)
-        onionMessage = bytes(onionMessage, 'utf-8')
-        logging.info("SEND TEXT START AFTER ONION ROUTING")
-
-        # Use the reactor to establish TCP connection to the first hop of the route
-        reactor.connectTCP(Networking.OR.route.hop1['ip'], int(Networking.OR.route.hop1['port']),
-                           MessageFactory(onionMessage))
-
-
-        Globals.circuitTracker = 0
-        Globals.circuitEstablished = False
-
-        sanitisedData = msg.replace('==MSG==', '')
+        try:
+            sanitisedData = defaultNode.controller.send(msg.get())
+        except ValueError as error:
+            logging.error("Message not sent, " + str(error))
+            return
         chatA = logging.getLogger("2")
         chatA.info(sanitisedData)
-        print(onionMessage.decode('utf-8'))
 
     # Getter method for the current user
     def getCurrentUser(self):
@@ -0,0 +1,198 @@
+'''
+    File name: Controller.py
+    Author: Jamie Clarke
+    Date last modified: 21/04/2019
+    Python Version: 3.7
+'''
+
+import hashlib
+import json
+import logging
+from collections import deque
+from pathlib import Path
+
+from Client.DHTRegistration import DHTRegistration
+from Client.DHTSearch import DHTSearch
+from Encryption.CryptoPool import cryptoPool
+from Models.User import User
+from Networking import RequestRoute
+from Networking.ConnectionPool import connectionPool
+from Networking.DHT import DHT
+from Networking.OR import CircuitBuildError
+from Utils import EventBus, Utils
+
+
+class Controller():
+    """
+
+    Controller carries out what a user asks of the node, creating or joining a network, searching for messaging
+    partners and sending messages to any of them. It holds no UI so the same operations serve the Tk client and the control socket of a
+    headless node, and importing it never pulls in tkinter. Each node context has its own controller
+
+    Attributes:
+        node -          The node context whose routing state, onion router and keys are used
+        user -          Our user record, read from User.json when first needed
+        inbox -         The most recent messages addressed to us, oldest first
+        inboxSize -     Number of messages kept in the inbox
+
+    """
+
+    inboxSize = 100
+    # Instantiate a local copy of the utility class allowing us to use useful functions
+    utils = Utils.Utils()
+
+    def __init__(self, node):
+        self.node = node
+        self.encryption = node.asymmetricEncryption
+        self.user = None
+        self.inbox = deque(maxlen=self.inboxSize)
+        node.eventBus.subscribe(EventBus.MESSAGE_RECEIVED, self.inbox.append)
+
+    def currentUser(self):
+        if self.user is None and Path(self.node.path("User.json")).is_file():
+            with open(self.node.path("User.json"), "r") as f:
+                self.user = json.loads(f.read())
+        return self.user
+
+    # Partners are known by username to the user and by node ID, the hash of their username, to the session manager
+    def partnerID(self, username):
+        return hashlib.sha256(username.encode('utf-8')).hexdigest() if username is not None else None
+
+    """
+    createNetwork() & join()
+
+    Generate our asymmetric keys on the crypto pool and then start a new network with this node as its only member,
+    or ask a node already in a network to position us in its ring. Both return a Deferred that fires with our user
+    record once the keys exist and our routing table has been written
+
+    Arguments
+    bootstrapIP (string): Takes the ip address of a node in the network the user wishes to join
+    bootstrapPort (int): Takes the port that the node in the network can be reached on over TCP
+    ip (string): Takes the local users ip address
+    port (string): Takes the port that the application will be reachable on
+    username (string): Takes the pseudonym that the user wishes to be known by
+
+    """
+
+    def createNetwork(self, ip, port, username):
+        logging.info("Creating a new network")
+        return cryptoPool.run(self.encryption.generate_keys).addCallback(self.keysGenerated, ip, port, username)
+
+    def join(self, bootstrapIP, bootstrapPort, ip, port, username):
+        joining = cryptoPool.run(self.encryption.generate_keys).addCallback(self.keysGenerated, ip, port, username)
+        return joining.addCallback(self.sendRegistration, bootstrapIP, int(bootstrapPort))
+
+    def keysGenerated(self, result, ip, port, username):
+        # Create a user object, set all user variables to the data given
+        user = User()
+        user.ip = ip
+        user.port = str(port)
+        user.username = username
+        user.publicKey = self.encryption.getPublicRecord().decode("utf-8")
+        user.nodeid = self.utils.generateID(user.username)
+
+        # Register username in a local file so we know who we are
+        with open(self.node.path("User.json"), "w+") as f:
+            f.write(json.dumps(user.toDict()))
+        self.user = user.toDict()
+
+        initialization = DHT(self.node.routingState, self.node.sessionManager, self.node.lookupCache)
+        initialization.fingerTable.nodeid = user.toDict()
+        initialization.writeDHTInformation()
+        return self.user
+
+    def sendRegistration(self, user, bootstrapIP, bootstrapPort):
+        logging.info("BOOTSTRAP TIME START")
+        connectionPool.send(bootstrapIP, bootstrapPort, DHTRegistration(dict(user, **RequestRoute.new())))
+        return user
+
+    """
+    search()
+
+    Sends a search for a username to our successor, the answer arrives as a PARTNER_FOUND event. A partner we already
+    have a session with is switched to straight away, keeping its circuit, and a user found by a recent search is
+    answered from the lookup cache. A ValueError is raised if a recent search for the user went unanswered
+
+    Arguments
+    username (string): Takes the username of the messaging partner
+
+    """
+
+    def search(self, username):
+        # Convert the username into a hash value that we can use to search the network
+        usernameHash = self.partnerID(username)
+        if self.node.sessionManager.get(usernameHash) is not None:
+            self.node.sessionManager.select(usernameHash).addErrback(lambda failure: failure.trap(CircuitBuildError))
+            return usernameHash
+
+        lookupCache = self.node.lookupCache
+        cached = lookupCache.get(usernameHash)
+        if cached is not None:
+            logging.info("Found " + username + " in the lookup cache")
+            self.node.eventBus.publish(EventBus.PARTNER_FOUND, cached)
+            self.node.sessionManager.open(cached).addErrback(lambda failure: failure.trap(CircuitBuildError))
+            return usernameHash
+        if lookupCache.isMissing(usernameHash):
+            raise ValueError(username + " was not found by a recent search, try again later")
+
+        fingerTable = self.node.routingState.table()
+        if fingerTable.successor['nodeid'] == '':
+            raise ValueError("No other node to search, join a network first")
+
+        DHTUserRequest = {'username': usernameHash, 'ip': fingerTable.nodeid['ip'], 'port': fingerTable.nodeid['port']}
+        # The search is sent to our successor as if we had forwarded it, so it can never be routed back to us
+        dhtAlgorithms = self.node.dhtAlgorithms
+        dhtAlgorithms.forwardRequest(dhtAlgorithms.acceptRequest(None), fingerTable.successor, DHTSearch, DHTUserRequest, usernameHash)
+        lookupCache.expect(usernameHash)
+        logging.info("SEARCH START")
+        return usernameHash
+
+    """
+    send()
+
+    Onion encrypts a message and sends it over the circuit of the session with a messaging partner. Returns the message
+    as it is shown in the chat window. A ValueError is raised if there is no session with the partner, a message waiting
+    on a new circuit is dropped if the circuit cannot be built
+
+    Arguments
+    message (string): Takes the message in plaintext
+    username (string): Takes the username of the messaging partner, None for the current partner
+
+    """
+
+    def send(self, message, username=None):
+        logging.info("SEND TEXT START BEFORE ONION ROUTING")
+        msg = "==MSG==" + self.currentUser()['user'].upper() + ":" + " " + message
+        self.node.sessionManager.send(msg, self.partnerID(username)).addErrback(lambda failure: failure.trap(CircuitBuildError))
+        return msg.replace('==MSG==', '')
+
+    # Sessions with every partner, most recently used last
+    def sessions(self):
+        return [session.toDict() for session in self.node.sessionManager.table().values()]
+
+    def close(self, username):
+        self.node.sessionManager.close(self.partnerID(username))
+
+    # Leave the ring gracefully, the node stops once its neighbours have acknowledged
+    def leave(self):
+        return self.node.leave()
+
+    def status(self):
+        fingerTable = self.node.routingState.table()
+        session = self.node.sessionManager.get()
+        return {"user": self.currentUser(),
+                "nodeid": fingerTable.nodeid['nodeid'],
+                "successor": fingerTable.successor['user'],
+                "predecessor": fingerTable.predecessor['user'],
+                "partner": session.partner['user'] if session is not None else None,
+                "circuitEstablished": session is not None and session.isReady(),
+                "inbox": list(self.inbox),
+                "routingState": self.node.routingState.statistics(),
+                "sessions": self.node.sessionManager.statistics(),
+                "lookupCache": self.node.lookupCache.statistics(),
+                "requests": self.node.dhtAlgorithms.statistics(),
+                "stabilizer": self.node.stabilizer.statistics(),
+                "failureDetector": self.node.failureDetector.statistics(),
+                "circuitPool": self.node.circuitPool.statistics(),
+                "cryptoPool": cryptoPool.statistics()}
+
@@ -10,22 +10,32 @@ import logging
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
-from cryptography.hazmat.primitives.serialization import load_pem_public_key
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+
+from Encryption.Keyring import keyring
 
 
 class AsymmetricEncryption:
     """
 
-    Asymmetric encryption handles the generation of keys as well as the encryption and decryption of RSA messages
+    Asymmetric encryption handles the generation of keys as well as the encryption and decryption of RSA messages.
+    Keys are held in the keyring so encrypting and decrypting never touch the disk
 
     Attributes:
         private_key -   Stores RSA 4096-bit private key
         public_key -   Stores RSA 4096-bit public key
+        keyring -       Holds our private key and the parsed public keys of our peers
 
     """
 
     private_key = None
     public_key = None
+    keyring = keyring
+
+    # Keys are kept in the default node's keyring unless the keyring of another node is given
+    def __init__(self, keyring=None):
+        if keyring is not None:
+            self.keyring = keyring
 
     # Generates a pair of RSA keys with a size of 4096bits. Generates the private key and then the matching public key. Both are then saved
 
@@ -38,7 +48,16 @@ class AsymmetricEncryption:
 
         self.public_key = private_key.public_key()
         self.private_key = private_key
+
+        # The X25519 identity key is published with our RSA key so circuits can use the cheaper handshake
+        identity_key = X25519PrivateKey.generate()
+        self.keyring.setPrivateKey(private_key, identity_key)
         self.save_key(private_key, "privatekey")
+        self.save_key(identity_key, "identitykey")
+
+        # The public key file is written once here rather than every time the key is read
+        with open(self.keyring.path("publickey"), 'wb') as pem_out:
+            pem_out.write(self.keyring.publicKeyPem())
 
     # Getter method for the private key
     def getPrivateKey(self):
@@ -48,20 +67,17 @@ class AsymmetricEncryption:
     # Getter method for the public key
     def getPublicKey(self):
         logging.info("Retreiving our asymmetric public key")
-        pem_public_key = self.public_key.public_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PublicFormat.SubjectPublicKeyInfo)
-
-        with open("publickey", 'wb') as pem_out:
-            pem_out.write(pem_public_key)
+        return self.keyring.publicKeyPem()
 
-        return pem_public_key
+    # Getter method for the record published in User.publickey, our RSA public key followed by our X25519 identity key
+    def getPublicRecord(self):
+        return self.keyring.publicRecord()
 
     """
     
      Save key takes two parameters, a key and the desired file name to save the key under
      Method converts the key into a bytes representation using PEM encoding. A file is then
-     created using the filename provided by. Key is then written out to the file
+     created using the filename provided in the data directory of the keyring. Key is then written out to the file
 
       :param key (bytes):       Takes a RSA key 
       :param filename (string): Takes a string representing the desired filename
@@ -70,13 +86,18 @@ class AsymmetricEncryption:
 
     def save_key(self, key, filename):
         logging.info("Saving our public/private key to file")
+        # X25519 keys have no traditional OpenSSL encoding and are saved as PKCS8
+        if isinstance(key, rsa.RSAPrivateKey):
+            key_format = serialization.PrivateFormat.TraditionalOpenSSL
+        else:
+            key_format = serialization.PrivateFormat.PKCS8
         pem = key.private_bytes(
             encoding=serialization.Encoding.PEM,
-            format=serialization.PrivateFormat.TraditionalOpenSSL,
+            format=key_format,
             encryption_algorithm=serialization.NoEncryption()
         )
 
-        with open(filename, 'wb') as pem_out:
+        with open(self.keyring.path(filename), 'wb') as pem_out:
             pem_out.write(pem)
 
     """
@@ -91,9 +112,7 @@ class AsymmetricEncryption:
 
     def encrypt(self, key, message):
         logging.info("Encrypting a message with asymmetric key")
-        key = key.encode("utf-8")
-
-        public_key = load_pem_public_key(key, default_backend())
+        public_key = self.keyring.publicKey(key.encode("utf-8"))
 
         ciphertext = public_key.encrypt(
             message,
@@ -105,10 +124,10 @@ class AsymmetricEncryption:
 
     """
 
-     Decrypt takes a key and a bytes representation of a ciphertext message. It will then apply the key to the message 
-     resulting in a decrypted plaintext message
+     Decrypt takes a key and a bytes representation of a ciphertext message. It will then apply our private key from
+     the keyring to the message resulting in a decrypted plaintext message
 
-      :param key (bytes):       Takes a RSA key 
+      :param key (bytes):       Unused, kept for callers that pass our public key
       :param message (bytes):   Takes a bytes representation of RSA cipher text
       :return message (string):       Returns a plaintext decrypted string
 
@@ -116,12 +135,7 @@ class AsymmetricEncryption:
 
     def decrypt(self, key, message):
         logging.info("Decrypting a message with asymmetric key")
-        with open("privatekey", "rb") as key_file:
-            private_key = serialization.load_pem_private_key(
-                key_file.read(),
-                password=None,
-                backend=default_backend())
-        message = private_key.decrypt(
+        message = self.keyring.privateKey().decrypt(
             message,
             padding.OAEP(
                 mgf=padding.MGF1(algorithm=hashes.SHA1()),
@@ -0,0 +1,71 @@
+'''
+    File name: CircuitHandshake.py
+    Author: Jamie Clarke
+    Date last modified: 21/04/2019
+    Python Version: 3.7
+'''
+
+import base64
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+
+class CircuitHandshake():
+    """
+
+    Circuit handshake derives the symmetric key for one hop of an onion circuit with X25519 and HKDF instead of
+    encrypting a Fernet key with RSA. Every node publishes a long term X25519 identity key next to its RSA key in its
+    User.publickey record
+
+    The sender sends an ephemeral public key X in CREATE2. The hop answers with its own ephemeral public key Y in
+    CREATED2 and both sides derive the Fernet key from HKDF(xY | xB) where B is the hop's identity key. Only the hop
+    holding the identity private key can compute xB, and the ephemeral keys give each circuit forward secrecy
+
+    Attributes:
+        info -          HKDF context string, the circuit ID is appended so every hop's key is bound to its circuit
+
+    """
+
+    info = b"onion circuit key x25519 v1 "
+
+    # Start a handshake. Returns the ephemeral private key to keep and the 32 byte public key to send in CREATE2
+    def clientStart(self):
+        ephemeral = X25519PrivateKey.generate()
+        return ephemeral, self.publicBytes(ephemeral.public_key())
+
+    """
+    server()
+
+    Run by the hop receiving CREATE2. Returns the 32 byte ephemeral public key to send back in CREATED2 and the
+    Fernet key for the circuit
+
+    Arguments
+    identityKey (X25519PrivateKey): Takes this node's identity private key
+    clientPublic (bytes): Takes the sender's ephemeral public key from CREATE2
+    circuitID (int): Takes the circuit ID from CREATE2
+
+    """
+
+    def server(self, identityKey, clientPublic, circuitID):
+        clientPublic = X25519PublicKey.from_public_bytes(clientPublic)
+        ephemeral = X25519PrivateKey.generate()
+        secret = ephemeral.exchange(clientPublic) + identityKey.exchange(clientPublic)
+        return self.publicBytes(ephemeral.public_key()), self.deriveKey(secret, circuitID)
+
+    # Finish a handshake with the hop's CREATED2 reply, returning the same Fernet key the hop derived
+    def clientFinish(self, ephemeral, identityPublic, serverPublic, circuitID):
+        serverPublic = X25519PublicKey.from_public_bytes(serverPublic)
+        secret = ephemeral.exchange(serverPublic) + ephemeral.exchange(identityPublic)
+        return self.deriveKey(secret, circuitID)
+
+    def deriveKey(self, secret, circuitID):
+        hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                    info=self.info + circuitID.to_bytes(8, 'big'), backend=default_backend())
+        return base64.urlsafe_b64encode(hkdf.derive(secret))
+
+    @staticmethod
+    def publicBytes(publicKey):
+        return publicKey.public_bytes(encoding=serialization.Encoding.Raw, format=serialization.PublicFormat.Raw)
@@ -0,0 +1,114 @@
+'''
+    File name: CryptoPool.py
+    Author: Jamie Clarke
+    Date last modified: 21/04/2019
+    Python Version: 3.7
+'''
+
+import logging
+import time
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, fail
+from twisted.python.failure import Failure
+from twisted.python.threadpool import ThreadPool
+
+
+class CryptoPoolFull(Exception):
+    """Raised when more RSA operations are waiting than the pool is allowed to queue"""
+
+
+class CryptoPool():
+    """
+
+    Crypto pool runs RSA key generation, encryption and decryption on a small pool of worker threads. A single
+    RSA-4096 operation takes long enough to stall every connection on the node, so none of them run on the reactor
+    thread. Each call returns a Deferred that fires on the reactor thread with the result
+
+    Attributes:
+        minThreads -      Worker threads kept alive
+        maxThreads -      Most RSA operations run at once
+        maxQueued -       Operations allowed to wait for a thread before new work is refused with CryptoPoolFull
+        queued -          Operations waiting for a worker thread
+        active -          Operations running on a worker thread
+        completed -       Operations finished since the pool started
+        rejected -        Operations refused because the queue was full
+        maxQueueDepth -   Deepest the queue has been
+        totalWait -       Seconds operations have spent queued, divide by completed for the mean
+
+    """
+
+    minThreads = 1
+    maxThreads = 2
+    maxQueued = 64
+
+    def __init__(self, reactor=reactor, threadpool=None):
+        self.reactor = reactor
+        self.threadpool = threadpool
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.rejected = 0
+        self.maxQueueDepth = 0
+        self.totalWait = 0
+
+    # Threads are only started the first time they are needed and are stopped when the reactor shuts down
+    def start(self):
+        if self.threadpool is None:
+            self.threadpool = ThreadPool(self.minThreads, self.maxThreads, "CryptoPool")
+            self.threadpool.start()
+            self.reactor.addSystemEventTrigger('during', 'shutdown', self.threadpool.stop)
+
+    """
+    run()
+
+    Queues function(*args, **kwargs) for a worker thread. Every counter is only touched on the reactor thread, workers
+    report back with callFromThread
+
+    Arguments
+    function (callable): Takes the blocking operation to run
+
+    """
+
+    def run(self, function, *args, **kwargs):
+        if self.queued >= self.maxQueued:
+            self.rejected += 1
+            logging.error("Refusing RSA operation, " + str(self.queued) + " are already queued")
+            return fail(CryptoPoolFull(str(self.queued) + " operations queued"))
+
+        self.start()
+        result = Deferred()
+        submitted = time.monotonic()
+        self.queued += 1
+        self.maxQueueDepth = max(self.maxQueueDepth, self.queued)
+
+        def work():
+            self.reactor.callFromThread(self.workStarted, time.monotonic() - submitted)
+            return function(*args, **kwargs)
+
+        def onResult(success, value):
+            self.reactor.callFromThread(self.workFinished, result, success, value)
+
+        self.threadpool.callInThreadWithCallback(onResult, work)
+        return result
+
+    def workStarted(self, wait):
+        self.queued -= 1
+        self.active += 1
+        self.totalWait += wait
+
+    def workFinished(self, result, success, value):
+        self.active -= 1
+        self.completed += 1
+        if success:
+            result.callback(value)
+        else:
+            result.errback(value if isinstance(value, Failure) else Failure(value))
+
+    def statistics(self):
+        return {"queued": self.queued, "active": self.active, "completed": self.completed, "rejected": self.rejected,
+                "maxQueueDepth": self.maxQueueDepth, "meanWait": self.totalWait / self.completed if self.completed else 0}
+
+
+# The pool shared by every module on this node
+cryptoPool = CryptoPool()
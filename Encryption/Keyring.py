@@ -0,0 +1,151 @@
+'''
+    File name: Keyring.py
+    Author: Jamie Clarke
+    Date last modified: 21/04/2019
+    Python Version: 3.7
+'''
+
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
+
+PEM_BLOCK = re.compile(rb"-----BEGIN PUBLIC KEY-----.*?-----END PUBLIC KEY-----\s*", re.DOTALL)
+
+
+class Keyring():
+    """
+
+    Keyring holds our RSA private key, our X25519 identity key and the parsed public keys of the peers we encrypt to,
+    so encrypting and decrypting never read or parse a PEM file. Our private keys are read from disk at most once, peer
+    public keys are cached by the SHA256 fingerprint of their PEM and the least recently used key is evicted when the
+    cache is full. Keys are used from the crypto pool's worker threads so every access holds a lock
+
+    A peer's public key record is its RSA PEM followed by its X25519 identity PEM. Records from nodes that only
+    publish an RSA key are still accepted, they simply have no identity key
+
+    Attributes:
+        maxPublicKeys -     Number of parsed peer public keys kept
+        privateKeyFile -    File our private key is loaded from if it was not generated by this process
+        identityKeyFile -   File our X25519 identity key is loaded from if it was not generated by this process
+        dataDir -           Directory of the node the keys belong to, key files are read from and written to it
+        publicKeys -        Maps fingerprint to parsed public key, least recently used first
+        hits -              Public key lookups answered from the cache
+        misses -            Public key lookups that had to parse a PEM
+
+    """
+
+    maxPublicKeys = 256
+    privateKeyFile = "privatekey"
+    identityKeyFile = "identitykey"
+
+    def __init__(self, dataDir="."):
+        self.dataDir = dataDir
+        self.lock = threading.Lock()
+        self.private = None
+        self.publicPem = None
+        self.identity = None
+        self.publicKeys = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, filename):
+        return os.path.join(self.dataDir, filename)
+
+    # Called when new keys are generated so they are never read back from disk
+    def setPrivateKey(self, privateKey, identityKey=None):
+        with self.lock:
+            self.private = privateKey
+            self.publicPem = None
+            self.identity = identityKey
+
+    def privateKey(self):
+        with self.lock:
+            if self.private is None:
+                logging.info("Loading our asymmetric private key into the keyring")
+                with open(self.path(self.privateKeyFile), "rb") as key_file:
+                    self.private = serialization.load_pem_private_key(
+                        key_file.read(),
+                        password=None,
+                        backend=default_backend())
+            return self.private
+
+    def identityKey(self):
+        with self.lock:
+            if self.identity is None:
+                logging.info("Loading our X25519 identity key into the keyring")
+                with open(self.path(self.identityKeyFile), "rb") as key_file:
+                    self.identity = serialization.load_pem_private_key(
+                        key_file.read(),
+                        password=None,
+                        backend=default_backend())
+            return self.identity
+
+    # Our RSA public key as PEM, serialized once per key pair
+    def publicKeyPem(self):
+        privateKey = self.privateKey()
+        with self.lock:
+            if self.publicPem is None:
+                self.publicPem = privateKey.public_key().public_bytes(
+                    encoding=serialization.Encoding.PEM,
+                    format=serialization.PublicFormat.SubjectPublicKeyInfo)
+            return self.publicPem
+
+    # The record we publish in User.publickey, our RSA key followed by our identity key
+    def publicRecord(self):
+        identityPem = self.identityKey().public_key().public_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo)
+        return self.publicKeyPem() + identityPem
+
+    @staticmethod
+    def fingerprint(pem):
+        return hashlib.sha256(pem).hexdigest()
+
+    """
+    publicKey()
+
+    Returns the parsed public key of the requested type from a PEM encoded key record, parsing each key in the record
+    only if it is not already cached. None is returned if the record holds no key of that type
+
+    Arguments
+    pem (bytes): Takes a PEM encoded public key record
+    keyType (class): Takes the public key class wanted, RSA by default
+
+    """
+
+    def publicKey(self, pem, keyType=rsa.RSAPublicKey):
+        for block in PEM_BLOCK.findall(pem) or [pem]:
+            publicKey = self.parsePublicKey(block)
+            if isinstance(publicKey, keyType):
+                return publicKey
+        return None
+
+    def parsePublicKey(self, pem):
+        fingerprint = self.fingerprint(pem)
+        with self.lock:
+            if fingerprint in self.publicKeys:
+                self.hits += 1
+                self.publicKeys.move_to_end(fingerprint)
+                return self.publicKeys[fingerprint]
+            self.misses += 1
+            publicKey = load_pem_public_key(pem, default_backend())
+            self.publicKeys[fingerprint] = publicKey
+            if len(self.publicKeys) > self.maxPublicKeys:
+                self.publicKeys.popitem(last=False)
+            return publicKey
+
+    def statistics(self):
+        with self.lock:
+            return {"publicKeys": len(self.publicKeys), "hits": self.hits, "misses": self.misses}
+
+
+# The keyring of the default node
+keyring = Keyring()
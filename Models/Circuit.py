@@ -0,0 +1,64 @@
+'''
+    File name: Circuit.py
+    Author: Jamie Clarke
+    Date last modified: 18/03/2019
+    Python Version: 3.7
+'''
+
+import time
+
+
+class Circuit():
+    """
+       Circuit class is a simple model that stores the state of an onion circuit this node has built. A circuit is
+       reused for many messages until it reaches its lifetime or message limit
+
+       Attributes:
+           hops -          The relays of the circuit followed by the recipient
+           keys -          Symmetric key shared with each hop, in the same order as hops
+           circuitIDs -    Circuit ID each hop knows this circuit by, in the same order as hops
+           sequence -      Sequence number of the last cell sent, every cell carries the next one
+           created -       Time the circuit was built
+           acknowledged -  Number of hops that have confirmed they hold their key
+           latencies -     Seconds each hop took to acknowledge its key, by position in hops
+           lifetime -      Seconds the circuit may be used for
+           maxMessages -   Number of messages the circuit may carry
+
+       """
+    lifetime = 600
+    maxMessages = 100
+
+    def __init__(self, hops, keys, circuitIDs):
+        self.hops = hops
+        self.keys = keys
+        self.circuitIDs = circuitIDs
+        self.sequence = 0
+        self.created = time.time()
+        self.acknowledged = 0
+        self.latencies = {}
+
+    # Extend the circuit by one hop. Used to attach the recipient to a circuit whose relays are already keyed
+    def addHop(self, hop, key, circuitID):
+        self.hops.append(hop)
+        self.keys.append(key)
+        self.circuitIDs.append(circuitID)
+
+    # The circuit can carry messages once every hop has acknowledged its key
+    def isEstablished(self):
+        return self.acknowledged == len(self.hops)
+
+    # Sequence number for the next cell. Relays drop a cell whose sequence number they have already seen
+    def nextSequence(self):
+        self.sequence += 1
+        return self.sequence
+
+    # A circuit is retired once it is too old or has carried its quota of messages
+    def isExpired(self, now=None):
+        if now is None:
+            now = time.time()
+        return now - self.created >= self.lifetime or self.sequence >= self.maxMessages
+
+    # Convert this object into type dictionary. Each attribute is assigned to key/value pairs
+    def toDict(self):
+        return {"hops": self.hops, "circuitIDs": self.circuitIDs, "sequence": self.sequence, "created": self.created,
+                "latencies": self.latencies}
@@ -15,28 +15,173 @@ class FingerTable():
 
     Attributes:
         successor -          Stores our successor in the DHT
+        successors -         Stores the nodes that follow our successor round the ring, closest first. When our successor
+                             fails the first of them takes over so lookups carry on while the ring repairs
         predecessor -        Stores our predecessor in the DHT
         nodeid -             Stores out nodeID generated from our username
-        finger1 -            NOT IMPLEMENTED
-        finger2 -            NOT IMPLEMENTED
+        fingers -            Stores fingerCount users. Finger i is the first node that succeeds nodeid + 2^(keySpaceBits - fingerCount + i)
+        nextFinger -         Index of the next finger to be refreshed by the fix-fingers pass
+        keySpaceBits -       Size of the identifier circle in bits. Node IDs are SHA256 so the ring has 2^256 positions
+        fingerCount -        Number of fingers kept. Lowering this keeps only the longest jumps around the ring
 
     """
 
+    keySpaceBits = 256
+    fingerCount = 256
+    successorListSize = 4
+
     successor = None
+    successors = None
     predecessor = None
     nodeid = None
-    finger1 = None
-    finger2 = None
+    fingers = None
+    nextFinger = 0
 
     # Convert this object into type dictionary. Each attribute is assigned to key/value pairs
     def toDict(self):
-        return {"successor": self.successor, "predecessor": self.predecessor, "nodeid": self.nodeid}
+        return {"successor": self.successor, "successors": self.successors, "predecessor": self.predecessor,
+                "nodeid": self.nodeid, "fingers": self.compactFingers()}
 
     # When a finger table is initalzied set each attribute to a blank user. This prevents undefined errors
     def __init__(self):
         user = User().toDict()
         self.successor = user
+        self.successors = []
         self.predecessor = user
         self.nodeid = user
-        self.finger1 = user
-        self.finger2 = user
+        self.fingers = [user] * self.fingerCount
+        self.nextFinger = 0
+
+    """
+    setSuccessor(), successorList() & removeNode()
+
+    setSuccessor makes a node our successor, followed by the nodes given as following it round the ring. successorList
+    returns our successor followed by the rest of the list, without blanks, duplicates or ourselves. removeNode forgets
+    a node that has failed. If it was our successor the next entry of the successor list takes over, or our predecessor
+    if the list has run out, and fingers that pointed at it point at our successor until fix-fingers replaces them.
+    removeNode returns True if the node was in the table
+
+    Arguments
+    user (user): Takes the user object of our successor
+    following (list): Takes the nodes that follow our successor, closest first
+    nodeid (string): Takes the node ID of the failed node
+
+    """
+
+    def setSuccessor(self, user, following=()):
+        self.successor = user
+        self.successors = list(following)
+        self.successors = [node for node in self.successorList() if node['nodeid'] != user['nodeid']]
+
+    def successorList(self):
+        successors = []
+        for node in [self.successor] + self.successors:
+            if node['nodeid'] in ('', self.nodeid['nodeid']) or node['nodeid'] in [s['nodeid'] for s in successors]:
+                continue
+            successors.append(node)
+        return successors[:self.successorListSize]
+
+    def removeNode(self, nodeid):
+        successors = self.successorList()
+        known = [node['nodeid'] for node in successors + self.fingers + [self.predecessor]]
+        if nodeid == '' or nodeid not in known:
+            return False
+
+        remaining = [node for node in successors if node['nodeid'] != nodeid]
+        if self.successor['nodeid'] == nodeid:
+            if remaining:
+                self.successor = remaining[0]
+            elif self.predecessor['nodeid'] != nodeid:
+                self.successor = self.predecessor
+            else:
+                self.successor = User().toDict()
+        self.successors = [node for node in remaining if node['nodeid'] != self.successor['nodeid']]
+        self.fingers = [self.successor if finger['nodeid'] == nodeid else finger for finger in self.fingers]
+        return True
+
+    """
+    idToInt() & between()
+
+    Helpers for arithmetic on the identifier circle. Node IDs travel as SHA256 hex digests and are
+    converted to integers so that positions wrap around the ring correctly
+
+    between() checks if x lies on the clockwise arc from start to end. The start is always excluded,
+    the end is only included when inclusiveEnd is set. When start equals end the arc is the whole ring
+
+    """
+
+    @staticmethod
+    def idToInt(nodeid):
+        return int(nodeid, 16)
+
+    @staticmethod
+    def between(x, start, end, inclusiveEnd=False):
+        if start == end:
+            return x != start or inclusiveEnd
+        if start < end:
+            return start < x < end or (inclusiveEnd and x == end)
+        return x > start or x < end or (inclusiveEnd and x == end)
+
+    # Position on the ring that finger i is responsible for, nodeid + 2^(keySpaceBits - fingerCount + i)
+    def fingerStart(self, index):
+        offset = 2 ** (self.keySpaceBits - self.fingerCount + index)
+        return (self.idToInt(self.nodeid['nodeid']) + offset) % (2 ** self.keySpaceBits)
+
+    # The same position formatted as a node ID so it can be sent in a lookup
+    def fingerStartID(self, index):
+        return format(self.fingerStart(index), '0' + str(self.keySpaceBits // 4) + 'x')
+
+    # Sets finger i. Every following finger whose start also falls before the new node must point at the same node
+    def setFinger(self, index, user):
+        self.fingers[index] = user
+        if user['nodeid'] == '':
+            return
+        nodeInt = self.idToInt(user['nodeid'])
+        start = self.fingerStart(index)
+        for following in range(index + 1, self.fingerCount):
+            if not self.between(self.fingerStart(following), start, nodeInt, True):
+                break
+            self.fingers[following] = user
+
+    # Point every finger at a single node. Used at join time when the successor is the only node we know
+    def resetFingers(self, user):
+        self.fingers = [user] * self.fingerCount
+        self.nextFinger = 0
+
+    """
+    closestPrecedingFinger()
+
+    Scans the finger table from the longest jump to the shortest and returns the first node that lies between
+    this node and the target. Forwarding a lookup to that node at least halves the remaining distance, which is
+    what gives Chord its logarithmic hop count. If no finger precedes the target this node is returned
+
+    Arguments
+    targetID (string): Takes a SHA256 hex digest to route towards
+
+    """
+
+    def closestPrecedingFinger(self, targetID):
+        ownInt = self.idToInt(self.nodeid['nodeid'])
+        targetInt = self.idToInt(targetID)
+        for finger in reversed(self.fingers + [self.successor]):
+            if not isinstance(finger, dict) or finger.get('nodeid', '') == '':
+                continue
+            if self.between(self.idToInt(finger['nodeid']), ownInt, targetInt):
+                return finger
+        return self.nodeid
+
+    # Fingers are stored as runs, each entry is the index where a new node starts. Keeps DHT.json to O(log N) entries
+    def compactFingers(self):
+        runs = []
+        for index, finger in enumerate(self.fingers):
+            if index == 0 or finger != self.fingers[index - 1]:
+                runs.append([index, finger])
+        return runs
+
+    # Expand runs written by compactFingers back into a full finger table
+    def loadFingers(self, runs):
+        self.fingers = [User().toDict()] * self.fingerCount
+        for position, (index, finger) in enumerate(runs):
+            end = runs[position + 1][0] if position + 1 < len(runs) else self.fingerCount
+            for i in range(index, min(end, self.fingerCount)):
+                self.fingers[i] = finger
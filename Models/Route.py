@@ -11,13 +11,13 @@ class Route():
        Route class is a simple model that stores routing information for the created path through the network
 
        Attributes:
-           hop1 -          Stores the first hop of the onion route
-           hop2 -          Stores the second hop of the onion route
+           hops -          Stores the relays of the onion route in the order a message passes through them
 
        """
-    hop1 = ''
-    hop2 = ''
+
+    def __init__(self, hops=None):
+        self.hops = hops if hops is not None else []
 
     # Convert this object into type dictionary. Each attribute is assigned to key/value pairs
     def toDict(self):
-        return {"hop1": self.hop1, "hop2": self.hop2}
+        return {"hops": self.hops}
@@ -0,0 +1,55 @@
+'''
+    File name: Session.py
+    Author: Jamie Clarke
+    Date last modified: 21/04/2019
+    Python Version: 3.7
+'''
+
+import time
+
+
+class Session():
+    """
+       Session class is a simple model that stores our conversation with one messaging partner. Every session has its
+       own circuit, so switching between partners never tears down the circuit to another one
+
+       Attributes:
+           partner -       The user record of the messaging partner
+           circuit -       The circuit to the partner, None until the first build starts
+           building -      Deferred of the circuit build in progress, None when no build is running
+           waiting -       Deferreds of the callers waiting on the circuit build in progress
+           created -       Time the session was opened
+           lastUsed -      Time the session was last opened, selected or sent on
+           sent -          Number of messages sent to the partner
+
+       """
+
+    def __init__(self, partner):
+        self.partner = partner
+        self.circuit = None
+        self.building = None
+        self.waiting = []
+        self.created = time.time()
+        self.lastUsed = self.created
+        self.sent = 0
+
+    # Sessions are indexed by the node ID of the partner
+    def partnerID(self):
+        return self.partner['nodeid']
+
+    # The partner is the last hop of every circuit the session builds
+    def partnerHop(self):
+        return {"ip": self.partner['ip'], "port": int(self.partner['port']), "publickey": self.partner['publickey']}
+
+    # Messages can be sent once the circuit has been established and until it expires
+    def isReady(self):
+        return self.circuit is not None and self.circuit.isEstablished() and not self.circuit.isExpired()
+
+    def touch(self):
+        self.lastUsed = time.time()
+
+    # Convert this object into type dictionary. Each attribute is assigned to key/value pairs
+    def toDict(self):
+        return {"partner": self.partner['user'], "nodeid": self.partnerID(), "ready": self.isReady(),
+                "building": self.building is not None, "created": self.created, "lastUsed": self.lastUsed,
+                "sent": self.sent}
@@ -0,0 +1,114 @@
+'''
+    File name: CircuitPool.py
+    Author: Jamie Clarke
+    Date last modified: 18/03/2019
+    Python Version: 3.7
+'''
+
+import logging
+import time
+from collections import deque
+
+from Encryption.SymmetricEncryption import SymmetricEncryption
+from Models.Circuit import Circuit
+from Networking.OR import OR, onionRouter
+from Networking.PathSelection import PathSelector, pathSelector
+from Networking.RoutingState import routingState
+
+
+class CircuitPool():
+    """
+
+    Circuit pool keeps a few circuits with their relay keys already exchanged. When a messaging partner is found only
+    the recipient is attached to a warm circuit, so the first message does not wait on the relays' key exchanges
+
+    Attributes:
+        size -               Number of warm circuits to keep
+        refreshInterval -    Seconds between refresh passes
+        maxAge -             Warm circuits older than this are dropped so a taken circuit has most of its lifetime left
+        ready -              Circuits whose relays have acknowledged their keys, oldest first
+        building -           Circuits still waiting on key exchange acknowledgements
+        hits -               Circuits handed out from the pool
+        misses -             Requests that found the pool empty and fell back to building a circuit
+
+    """
+
+    size = 2
+    refreshInterval = 30
+    maxAge = Circuit.lifetime / 2
+
+    def __init__(self, onionRouter=onionRouter, routingState=routingState, pathSelector=pathSelector):
+        self.onionRouter = onionRouter
+        self.routingState = routingState
+        self.pathSelector = pathSelector
+        self.ready = deque()
+        self.building = []
+        self.hits = 0
+        self.misses = 0
+
+    # Drop stale circuits and start building new ones until the pool is back to size
+    def refresh(self):
+        now = time.time()
+        self.ready = deque(circuit for circuit in self.ready if now - circuit.created < self.maxAge)
+
+        if not self.routingState.isInitialized():
+            return
+        peers = self.routingState.table().toDict()
+        relays = {peer['nodeid'] for peer in PathSelector.knownPeers(peers)}
+        if not relays:
+            return
+
+        # Circuits through nodes that have left our routing table or are suspected of failing are dropped
+        self.ready = deque(circuit for circuit in self.ready if circuit.hops and
+                           {hop['nodeid'] for hop in circuit.hops} <= relays and not self.throughSuspect(circuit))
+
+        while len(self.ready) + len(self.building) < self.size:
+            if not self.build(peers):
+                break
+
+    # Exchange keys with the relays of a new circuit. The circuit joins the pool once every relay has acknowledged
+    # Returns False without building anything when fewer than minRelays relays are unsuspected
+    def build(self, peers):
+        symmetricEncryption = SymmetricEncryption()
+        hops = self.pathSelector.choose(peers)
+        if len(hops) < max(self.pathSelector.minRelays, 1):
+            return False
+        circuit = Circuit(hops, [symmetricEncryption.createKeys() for hop in hops], [OR.newCircuitID() for hop in hops])
+        self.building.append(circuit)
+
+        self.onionRouter.establish(circuit, range(len(hops))).addCallbacks(self.circuitBuilt, self.circuitNotBuilt,
+                                                                           errbackArgs=(circuit,))
+        return True
+
+    def circuitBuilt(self, circuit):
+        self.building.remove(circuit)
+        self.ready.append(circuit)
+
+    def circuitNotBuilt(self, failure, circuit):
+        self.building.remove(circuit)
+        logging.warning("Pre-built circuit was not acknowledged by every relay, dropping it")
+
+    # Hand out the newest warm circuit that does not pass through an excluded node, or None if there is none
+    def take(self, exclude=()):
+        now = time.time()
+        self.ready = deque(circuit for circuit in self.ready if now - circuit.created < self.maxAge)
+        excluded = {PathSelector.peerKey(peer) for peer in exclude}
+        for circuit in reversed(self.ready):
+            # A circuit without relays would go straight to the recipient
+            if circuit.hops and not excluded & {PathSelector.peerKey(hop) for hop in circuit.hops} and not self.throughSuspect(circuit):
+                self.ready.remove(circuit)
+                self.hits += 1
+                return circuit
+        self.misses += 1
+        return None
+
+    # True if a relay of the circuit is suspected of having failed
+    def throughSuspect(self, circuit):
+        return any(self.pathSelector.failureDetector.suspects(hop) for hop in circuit.hops)
+
+    def statistics(self):
+        return {"ready": len(self.ready), "building": len(self.building), "hits": self.hits, "misses": self.misses}
+
+
+# The pool of the default node
+circuitPool = CircuitPool()
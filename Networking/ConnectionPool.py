@@ -0,0 +1,319 @@
+'''
+    File name: ConnectionPool.py
+    Author: Jamie Clarke
+    Date last modified: 18/03/2019
+    Python Version: 3.7
+'''
+
+import logging
+import random
+from collections import deque
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from twisted.internet.error import ConnectError
+from twisted.internet.protocol import ClientFactory
+
+from Networking import MessageCodec
+from Networking.FramedProtocol import FramedProtocol
+
+
+class PooledMessage():
+    """
+
+    Pooled message is the base class for everything this node sends to another node. Subclasses set their message
+    type and the pool takes care of finding a connection to write it over
+
+    Attributes:
+        msgType -         MessageCodec message type the payload is encoded as
+        data -            The message fields, encoded with MessageCodec before sending
+        expectsReply -    Set when the peer answers this message on the same connection
+        reply -           Deferred that fires with the peer's answer when expectsReply is set
+
+    """
+
+    msgType = None
+    expectsReply = False
+
+    # On initialize of the message class data passed is stored to a local variable
+    def __init__(self, data, expectsReply=None):
+        self.data = data
+        if expectsReply is not None:
+            self.expectsReply = expectsReply
+        self.reply = Deferred() if self.expectsReply else None
+
+    # Encode our message fields into the binary wire format
+    def toBytes(self):
+        return MessageCodec.encode(self.msgType, self.data)
+
+    # Called once the message has been written to a connection
+    def sent(self):
+        pass
+
+
+class PooledProtocol(FramedProtocol):
+    """
+
+    Pooled protocol is a persistent outbound connection to a peer. Requests are pipelined, the peer answers them in
+    the order they were sent so replies are matched to the oldest outstanding request
+
+    Attributes:
+        awaitingReply -   Requests written over this connection that have not been answered yet
+
+    """
+
+    idleCall = None
+
+    def connectionMade(self):
+        self.awaitingReply = deque()
+        self.factory.peer.connectionReady(self)
+
+    def connectionLost(self, reason):
+        if self.idleCall is not None and self.idleCall.active():
+            self.idleCall.cancel()
+        # Nothing more will arrive on this connection, fail every request still waiting
+        while self.awaitingReply:
+            self.awaitingReply.popleft().reply.errback(reason)
+        self.factory.peer.connectionClosed(self)
+
+    def stringReceived(self, data):
+        if not self.awaitingReply:
+            logging.warning("Unexpected reply received over pooled connection " + str(data))
+            return
+        # The peer is alive, tell the pool before the reply is handled
+        self.factory.peer.pool.contact(self.factory.peer.address)
+        self.awaitingReply.popleft().reply.callback(data)
+        self.touch()
+
+    # Write a message and push back the idle eviction timer
+    def sendMessage(self, message):
+        if message.expectsReply:
+            self.awaitingReply.append(message)
+        self.sendString(message.toBytes())
+        message.sent()
+        self.touch()
+
+    def touch(self):
+        timeout = self.factory.peer.pool.idleTimeout
+        if self.idleCall is not None and self.idleCall.active():
+            self.idleCall.reset(timeout)
+        else:
+            self.idleCall = self.factory.peer.pool.reactor.callLater(timeout, self.evict)
+
+    # Close a connection that has not been used for idleTimeout seconds
+    def evict(self):
+        logging.info("Closing idle connection to " + str(self.factory.peer.address))
+        self.transport.loseConnection()
+
+
+class PooledConnectionFactory(ClientFactory):
+    # Instantiate the protocol
+    protocol = PooledProtocol
+
+    # Each connection attempt belongs to one peer
+    def __init__(self, peer):
+        self.peer = peer
+
+    def clientConnectionFailed(self, connector, reason):
+        self.peer.connectFailed(reason)
+
+
+class PeerConnections():
+    """
+
+    Peer connections tracks every connection the pool holds to a single (ip, port) along with the messages waiting
+    for a connection to come up
+
+    Attributes:
+        address -         The (ip, port) this peer is reached on
+        connections -     Connections that are open and ready to write to
+        connecting -      Number of connection attempts still in progress
+        queue -           Messages waiting for a connection
+        retries -         Failed connection attempts since the last success
+        retryCall -       Pending reconnect, if one is scheduled
+
+    """
+
+    def __init__(self, pool, address):
+        self.pool = pool
+        self.address = address
+        self.connections = []
+        self.connecting = 0
+        self.queue = deque()
+        self.retries = 0
+        self.retryCall = None
+
+    # Write straight away if a connection is open, otherwise queue the message and make sure one is on the way
+    def send(self, message):
+        connection = self.pickConnection()
+        if connection is not None:
+            connection.sendMessage(message)
+            # Every connection is already deep in pipelined requests, open another while we are under the cap
+            if len(connection.awaitingReply) >= self.pool.pipelineDepth:
+                self.ensureConnection()
+            return
+        self.queue.append(message)
+        self.ensureConnection()
+
+    # Use the connection with the fewest requests waiting on a reply
+    def pickConnection(self):
+        if not self.connections:
+            return None
+        return min(self.connections, key=lambda connection: len(connection.awaitingReply))
+
+    def ensureConnection(self):
+        if self.connecting or self.retryCall is not None:
+            return
+        if len(self.connections) + self.connecting >= self.pool.maxConnectionsPerPeer:
+            return
+        self.connecting += 1
+        self.pool.reactor.connectTCP(self.address[0], self.address[1], PooledConnectionFactory(self),
+                                     timeout=self.pool.connectTimeout)
+
+    def connectionReady(self, connection):
+        self.connecting -= 1
+        self.retries = 0
+        self.connections.append(connection)
+        connection.touch()
+        # Flush everything that queued up while we were connecting
+        while self.queue:
+            connection.sendMessage(self.queue.popleft())
+
+    def connectionClosed(self, connection):
+        if connection in self.connections:
+            self.connections.remove(connection)
+        if self.queue:
+            self.ensureConnection()
+        elif not self.connections and not self.connecting:
+            self.pool.forgetPeer(self)
+
+    """
+    connectFailed()
+
+    Called when a connection attempt fails. The attempt is retried with exponential backoff and a little jitter so
+    that peers recovering from an outage are not hit by everyone at once. After maxRetries the queued messages are
+    dropped
+
+    Arguments
+    reason (Failure): Why the connection failed
+
+    """
+
+    def connectFailed(self, reason):
+        self.connecting -= 1
+        self.retries += 1
+        self.pool.connectionFailed(self.address)
+        if self.retries > self.pool.maxRetries:
+            logging.error("Giving up on " + str(self.address) + " dropping " + str(len(self.queue)) + " messages")
+            self.pool.peerUnreachable(self.address)
+            while self.queue:
+                message = self.queue.popleft()
+                if message.expectsReply:
+                    message.reply.errback(ConnectError(str(self.address)))
+            self.retries = 0
+            self.pool.forgetPeer(self)
+            return
+
+        delay = min(self.pool.initialDelay * (self.pool.backoffFactor ** (self.retries - 1)), self.pool.maxDelay)
+        delay = delay * random.uniform(0.8, 1.2)
+        logging.info("Connection to " + str(self.address) + " failed, retrying in " + str(round(delay, 2)) + "s")
+        self.retryCall = self.pool.reactor.callLater(delay, self.retry)
+
+    def retry(self):
+        self.retryCall = None
+        if self.queue:
+            self.ensureConnection()
+
+
+class ConnectionPool():
+    """
+
+    Connection pool keeps persistent connections to the peers this node talks to, keyed by (ip, port). Every outbound
+    message goes through send() rather than opening a connection of its own
+
+    Attributes:
+        maxConnectionsPerPeer -   Cap on open connections to a single peer
+        pipelineDepth -           Unanswered requests on a connection before another connection is opened
+        idleTimeout -             Seconds a connection may sit unused before it is closed
+        connectTimeout -          Seconds to wait for a connection attempt
+        initialDelay -            First reconnect delay in seconds
+        backoffFactor -           Multiplier applied to the delay after each failed attempt
+        maxDelay -                Upper bound on the reconnect delay
+        maxRetries -              Failed attempts before queued messages are dropped
+        peers -                   Maps (ip, port) to the PeerConnections for that peer
+        failureListeners -        Called with the (ip, port) of every failed connection attempt. The pool is shared by
+                                  every node in the process, each running node's lookup cache listens here
+        unreachableListeners -    Called with the (ip, port) of a peer once the pool gives up on it after maxRetries
+        contactListeners -        Called with the (ip, port) of a peer every time a reply arrives from it
+
+    """
+
+    maxConnectionsPerPeer = 4
+    pipelineDepth = 16
+    idleTimeout = 60
+    connectTimeout = 10
+    initialDelay = 0.5
+    backoffFactor = 2
+    maxDelay = 30
+    maxRetries = 5
+
+    def __init__(self, reactor=reactor):
+        self.reactor = reactor
+        self.peers = {}
+        self.failureListeners = []
+        self.unreachableListeners = []
+        self.contactListeners = []
+
+    # Send a PooledMessage to ip:port, opening a connection only if the pool has none to that peer
+    # Returns the Deferred reply for messages that expect one, otherwise None
+    def send(self, ip, port, message):
+        address = (ip, int(port))
+        if address not in self.peers:
+            self.peers[address] = PeerConnections(self, address)
+        self.peers[address].send(message)
+        return message.reply
+
+    def addFailureListener(self, listener):
+        self.failureListeners.append(listener)
+
+    def removeFailureListener(self, listener):
+        if listener in self.failureListeners:
+            self.failureListeners.remove(listener)
+
+    def connectionFailed(self, address):
+        for listener in self.failureListeners:
+            listener(address)
+
+    def addUnreachableListener(self, listener):
+        self.unreachableListeners.append(listener)
+
+    def removeUnreachableListener(self, listener):
+        if listener in self.unreachableListeners:
+            self.unreachableListeners.remove(listener)
+
+    def peerUnreachable(self, address):
+        for listener in self.unreachableListeners:
+            listener(address)
+
+    def addContactListener(self, listener):
+        self.contactListeners.append(listener)
+
+    def removeContactListener(self, listener):
+        if listener in self.contactListeners:
+            self.contactListeners.remove(listener)
+
+    def contact(self, address):
+        for listener in self.contactListeners:
+            listener(address)
+
+    def forgetPeer(self, peer):
+        if self.peers.get(peer.address) is peer:
+            del self.peers[peer.address]
+
+    # Number of open connections across every peer, useful for debugging
+    def openConnections(self):
+        return sum(len(peer.connections) for peer in self.peers.values())
+
+
+# The pool shared by every module on this node
+connectionPool = ConnectionPool()
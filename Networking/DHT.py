@@ -5,12 +5,15 @@
     Python Version: 3.7
 '''
 
-import json
 import logging
 
 from Models.FingerTable import FingerTable
-from Networking.OR import OR
-from Utils.Utils import Utils
+from Models.User import User
+from Networking.FailureDetector import failureDetector
+from Networking.LookupCache import lookupCache
+from Networking.OR import CircuitBuildError
+from Networking.RoutingState import routingState
+from Networking.SessionManager import sessionManager
 
 
 class DHT():
@@ -20,35 +23,36 @@ class DHT():
 
     Attributes:
         fingerTable -          Maintains this nodes ID along with network information for its successor and predecessor in the ring
+        routingState -         The routing state of the node this DHT belongs to
+        sessionManager -       The node's sessions with its messaging partners
+        lookupCache -          The node's recent search results, used to answer searches without walking the ring
+        failedTTL -            Seconds a node that failed is skipped for, unless it is heard from again sooner
+        failed -               Maps the node ID of a node that failed to answer us to its address and the time it expires
+        failureDetector -      Suspects nodes of the node's routing table that have stopped answering pings
     """
 
-    # LoadDHTInformation reads in the DHT.json file to memory. It will then update the finger table with the credentials saved in the file.
-    # Reading and writing to this file helps maintain state, this file is updated often
-    # DHT.json is considered the source of truth for local routing information and current DHT position
-    def loadDHTInformation(self):
-        # Read in the contents of DHT.json and convert to JSON format
-        with open ("DHT.json", "r") as f:
-            contents = f.read()
-        dhtfile = json.loads(contents)
+    failedTTL = 60
 
-        # update the finger table with the contents of DHT.json
-        self.fingerTable.successor = dhtfile['successor']
-        self.fingerTable.predecessor = dhtfile['predecessor']
-        self.fingerTable.nodeid = dhtfile['nodeid']
+    # LoadDHTInformation points this DHT at the node's routing state. DHT.json is only read the first time any module
+    # asks for it, from then on the routing state in memory is the source of truth for local routing information
+    def loadDHTInformation(self):
+        self.fingerTable = self.routingState.table()
 
-    # Write the finger table stored in memory to file.
+    # Make the finger table in memory the node's routing state and write it to DHT.json straight away
     def writeDHTInformation(self):
-        # Open DHT.JSON for writing, dump the finger table object to a JSON string, write result to file
-        with open("DHT.json", "w+") as f:
-            dhtinfo = json.dumps((self.fingerTable.toDict()))
-            f.write(dhtinfo)
+        self.routingState.replace(self.fingerTable)
+        self.routingState.flush()
+
+    # Record a change to the routing state, it reaches DHT.json with the next write-behind snapshot
+    def routingChanged(self):
+        self.routingState.replace(self.fingerTable)
 
     """
     updateSuccessor() & updatePredecessor()
     
     A collection of methods for updating attributes of the finger table
     Each method takes in the parameter data, this takes the form of a user object. 
-    A new DHT is initialized and populated with the information in the DHT.json file. The update is applied to the attribute and this is then written back to file
+    The update is applied to the routing state in memory and written to file by the next snapshot
     
     DHTPackageFromExternalNode()
     
@@ -60,44 +64,145 @@ class DHT():
 
     """
     def updateSuccessor(self, data):
-        dht = DHT()
-        dht.loadDHTInformation()
-        dht.fingerTable.successor = data
-        dht.writeDHTInformation()
+        fingerTable = self.routingState.table()
+        # The new successor joined in front of our old one, which now follows it in the successor list
+        fingerTable.successors = [fingerTable.successor] + fingerTable.successors[:fingerTable.successorListSize - 1]
+        fingerTable.successor = data
+        self.routingState.changed()
 
     def updatePredecessor(self, data):
-        dht = DHT()
-        dht.loadDHTInformation()
-        dht.fingerTable.predecessor = data
-        dht.writeDHTInformation()
+        self.routingState.table().predecessor = data
+        self.routingState.changed()
 
-        """
-        DHTPackageFromExternalNode()
+    """
+    successorsReturned(), nodeFailed(), connectionFailed(), nodeSuspected() & heardFrom()
+
+    successorsReturned takes our successor's answer to a stabilization request. If a node has joined between us and our
+    successor it becomes our successor, otherwise our successor list is rebuilt from our successor's list. nodeFailed
+    forgets a node whose stabilization request or ping timed out, the next node of the successor list takes over if it
+    was our successor, and skips it for failedTTL seconds. connectionFailed is called once the connection pool has given
+    up on an address after its retries and treats every node at that address as failed. nodeSuspected is called by the
+    failure detector and only drops the nodes at an address from our routing state, they are skipped for as long as the
+    detector suspects them rather than for failedTTL. heardFrom is called for every reply or request that reaches us
+    from an address, a node heard from is no longer treated as failed
+
+    Arguments
+    successor (user): Takes the successor the stabilization request was sent to
+    predecessor (user): Takes our successor's predecessor
+    successors (list): Takes our successor's successor list
+    node (user): Takes the user record of the failed node
+    address (tuple): Takes the (ip, port) that could not be reached, is suspected or was heard from
+
+    """
 
-        This method is invoked from the bootstrapping procedure and is only used when a node has no routing information at all. In this case it will get a complete copy
-        of its routing table created by the external node it bootstraps from
+    def successorsReturned(self, successor, predecessor, successors):
+        fingerTable = self.routingState.table()
+        self.failed.pop(successor['nodeid'], None)
+        # Our successor changed while the request was in flight, the next stabilization asks the new one
+        if fingerTable.successor['nodeid'] != successor['nodeid']:
+            return
+
+        before = fingerTable.successorList()
+        ownInt = fingerTable.idToInt(fingerTable.nodeid['nodeid'])
+        if (predecessor['nodeid'] not in ('', fingerTable.nodeid['nodeid']) and not self.hasFailed(predecessor) and
+                fingerTable.between(fingerTable.idToInt(predecessor['nodeid']), ownInt, fingerTable.idToInt(successor['nodeid']))):
+            logging.info("A node has joined between us and our successor, " + predecessor['user'] + " is our new successor")
+            fingerTable.setSuccessor(predecessor, [successor] + successors)
+        else:
+            fingerTable.setSuccessor(successor, successors)
+        if fingerTable.successorList() != before:
+            self.routingState.changed()
+
+    def nodeFailed(self, node):
+        self.failed[node['nodeid']] = (self.failureDetector.addressOf(node), self.routingState.reactor.seconds() + self.failedTTL)
+        self.dropNode(node['nodeid'], " failed")
+
+    def connectionFailed(self, address):
+        for node in self.nodesAt(address):
+            self.nodeFailed(node)
+
+    def nodeSuspected(self, address):
+        for node in self.nodesAt(address):
+            self.dropNode(node['nodeid'], " is suspected of having failed")
+
+    # Remove a node from our routing state, the next node of the successor list takes over if it was our successor
+    def dropNode(self, nodeid, reason):
+        fingerTable = self.routingState.table()
+        wasSuccessor = fingerTable.successor['nodeid'] == nodeid
+        if fingerTable.removeNode(nodeid):
+            logging.warning("Node " + nodeid + reason + (", " + fingerTable.successor['user'] + " is our new successor" if wasSuccessor else ""))
+            self.routingState.changed()
+
+    # Every other node in our routing state reached on an address
+    def nodesAt(self, address):
+        if not self.routingState.isInitialized():
+            return []
+        fingerTable = self.routingState.table()
+        return [node for node in fingerTable.successorList() + fingerTable.fingers + [fingerTable.predecessor]
+                if node['nodeid'] not in ('', fingerTable.nodeid['nodeid']) and (node['ip'], int(node['port'])) == address]
+
+    def heardFrom(self, address):
+        for nodeid, (failedAddress, expires) in list(self.failed.items()):
+            if failedAddress == address:
+                del self.failed[nodeid]
 
-        Arguments 
-        data (user): Takes a user object
+    """
+    nodeLeft()
 
-        """
+    Splices a neighbour that is leaving the ring out of it. If it was our successor its successor list is put behind it
+    before it is removed, so its successor becomes ours. If it was our predecessor its predecessor becomes ours. The
+    user records it cached are added to our lookup cache and sessions with a circuit through it get a new circuit
+
+    Arguments
+    node (user): Takes the user record of the node leaving
+    predecessor (user): Takes the predecessor of the node leaving
+    successors (list): Takes the successor list of the node leaving
+    records (list): Takes the user records the node leaving had cached
+
+    """
+
+    def nodeLeft(self, node, predecessor, successors, records):
+        fingerTable = self.routingState.table()
+        logging.info(node['user'] + " is leaving the ring")
+        if fingerTable.predecessor['nodeid'] == node['nodeid']:
+            fingerTable.predecessor = predecessor if predecessor['nodeid'] != fingerTable.nodeid['nodeid'] else User().toDict()
+        if fingerTable.successor['nodeid'] == node['nodeid']:
+            fingerTable.setSuccessor(node, successors)
+        fingerTable.removeNode(node['nodeid'])
+        self.routingState.changed()
+
+        for user in records:
+            self.lookupCache.put(user)
+        self.sessionManager.relayLeft(node)
+
+    # A node that failed to answer us within failedTTL, or that the failure detector suspects, is skipped by routing
+    def hasFailed(self, node):
+        failed = self.failed.get(node['nodeid'])
+        if failed is not None and failed[1] <= self.routingState.reactor.seconds():
+            del self.failed[node['nodeid']]
+            failed = None
+        return failed is not None or self.failureDetector.suspects(node)
 
     def DHTPackageFromExternalNode(self, data):
-        dht = DHT()
-        dht.loadDHTInformation()
-        dht.fingerTable.nodeid = data['nodeid']
-        dht.fingerTable.successor = data['successor']
-        dht.fingerTable.predecessor = data['predecessor']
-        dht.writeDHTInformation()
+        fingerTable = self.routingState.table()
+        fingerTable.nodeid = data['nodeid']
+        fingerTable.setSuccessor(data['successor'])
+        fingerTable.predecessor = data['predecessor']
+        # At join time the successor is the only node we know, every finger starts off pointing at it until fix-fingers runs
+        fingerTable.resetFingers(data['successor'])
+        # Joining is rare and the rest of the node checks DHT.json exists, so this snapshot is written immediately
+        self.routingState.changed()
+        self.routingState.flush()
 
         """
         DHTSearchReturn()
 
         This method is invoked when a response is recieved from the network with the messaging partner requested.
-        This user is then saved to file so we can retain this information and not have to re-search
-        
+        A session is opened for this user, or the session we already have is switched to, so we can retain this
+        information and not have to re-search
+
         Once a messaging partners routing information has been obtained an onion route is then created forming a circuit
-        to this partner.
+        to this partner, unless the session still has a live one.
 
         Arguments 
         data (user): Takes a user object
@@ -105,36 +210,20 @@ class DHT():
         """
 
     def DHTSearchReturn(self, data):
-        # Write the contact information of our user to a local file for use
-        utils = Utils()
-        messagingPartnerInfo = utils.writeRecipitent(data)
-        messagingPartnerInfo = json.loads(messagingPartnerInfo)
-
-        # Open file and write to it
-        with open("DHT.json", "r") as f:
-            contents = f.read()
-        self.recipitent = json.loads(contents)
-
-
-        logging.info("ONION ROUTING START")
-
-        # Instantiate our onion router
-        onionRouter = OR()
-
-        # Set the end node (reciever)
-        OR.recieverIP = messagingPartnerInfo['ip']
-        OR.recieverPort = int(messagingPartnerInfo['port'])
-        OR.recieverPublicKey = messagingPartnerInfo['publickey']
-
-        # Create our circuit
-        onionRouter.constructRoute(self.recipitent)
-        onionRouter.createOnionKeys()
-        OR.loadInRecipitent()
-        onionRouter.exchangeKeys()
-
-        logging.info("ONION ROUTING END")
+        self.lookupCache.put(data)
+        # The returned Deferred fires with the session once its circuit is established, a CIRCUIT_CHANGED event is
+        # published either way and the session manager has already logged a failed build
+        opening = self.sessionManager.open(data)
+        return opening.addErrback(lambda failure: failure.trap(CircuitBuildError))
 
 
 
-    def __init__(self):
+    # A DHT belongs to the default node unless the routing state, session manager, lookup cache and failure detector of another node are given
+    def __init__(self, routingState=routingState, sessionManager=sessionManager, lookupCache=lookupCache,
+                 failureDetector=failureDetector):
         self.fingerTable = FingerTable()
+        self.routingState = routingState
+        self.sessionManager = sessionManager
+        self.lookupCache = lookupCache
+        self.failureDetector = failureDetector
+        self.failed = {}
@@ -1,20 +1,98 @@
-import ast
-import json
 import logging
+from collections import OrderedDict
 
 from twisted.internet import reactor
+from twisted.internet.defer import DeferredList, succeed
 
 from Client.DHTRegistration import DHTRegistration
 from Client.DHTSearch import DHTSearch
+from Networking.ConnectionPool import connectionPool
 from Networking.DHT import DHT
 from Networking.DHTSearchReturn import DHTSearchReturn
+from Networking.FailureDetector import FailureDetector
+from Networking import MessageCodec, RequestRoute
+from Server.DHTNotFound import DHTNotFound
+from Server.DHTFingerReturn import DHTFingerReturn
+from Server.DHTFingerSearch import DHTFingerSearch
+from Server.DHTLeave import DHTLeave
+from Server.DHTPing import DHTPing
 from Server.DHTPredecessorUpdate import DHTPredecessorUpdate
 from Server.DHTReturn import DHTReturn
+from Server.DHTStabilize import DHTStabilize
 from Server.DHTSuccessorUpdate import DHTSuccessorUpdate
 
 
 class DHTAlgoirthm():
-    dht = DHT()
+    # How often (seconds) the fix-fingers pass runs and how many fingers it refreshes each time
+    fixFingersInterval = 30
+    fixFingersBatch = 8
+    # How often (seconds) we ask our successor for its successor list and how long it has to answer
+    stabilizeInterval = 10
+    stabilizeTimeout = 5
+    # How often (seconds) we check that our predecessor is alive
+    checkPredecessorInterval = 15
+    # Number of recent request IDs remembered to drop requests that reach this node a second time
+    recentRequestsSize = 4096
+    reactor = reactor
+
+    # The algorithms run on the default node's DHT and send over the shared connection pool unless others are given
+    def __init__(self, dht=None, connectionPool=connectionPool):
+        self.dht = dht if dht is not None else DHT()
+        self.connectionPool = connectionPool
+        self.recentRequests = OrderedDict()
+        self.duplicatesDropped = 0
+        self.notFoundSent = 0
+
+    """
+    acceptRequest() & forwardRequest()
+
+    Every REGISTER, SEARCH and FINDFINGER carries a RequestRoute. acceptRequest gives a request this node starts a new
+    route and drops a request whose ID this node has already handled. forwardRequest passes a request on to its next
+    hop, unless the request has used its hop budget or the next hop has already forwarded it, in which case NOTFOUND is
+    sent back to the node that started the request
+
+    Arguments
+    route (dict): Takes the route the request arrived with, None for a request this node starts
+    nextHop (user): Takes the node the request should be forwarded to
+    message (PooledMessage): Takes the message class the request is forwarded as
+    request (dict): Takes the request fields, holding the ip and port of the node that started the request
+    target (string): Takes the node ID or SHA256 value the request is looking for
+
+    """
+
+    def acceptRequest(self, route):
+        if route is None:
+            route = RequestRoute.new()
+        elif route['rid'] in self.recentRequests:
+            logging.info("Dropping duplicate request " + str(route['rid']))
+            self.duplicatesDropped += 1
+            return None
+        self.recentRequests[route['rid']] = True
+        if len(self.recentRequests) > self.recentRequestsSize:
+            self.recentRequests.popitem(last=False)
+        return route
+
+    def forwardRequest(self, route, nextHop, message, request, target):
+        # Never hand a request to a node that has stopped answering us, our successor list always has a live successor
+        if self.dht.hasFailed(nextHop):
+            nextHop = self.dht.fingerTable.successor
+        forwarded = RequestRoute.forwarded(route, self.dht.fingerTable.nodeid['nodeid'], nextHop['nodeid'])
+        if forwarded is None:
+            logging.warning("Request " + str(route['rid']) + " used its hops or looped back, answering NOTFOUND")
+            self.notFoundSent += 1
+            self.connectionPool.send(request['ip'], int(request['port']), DHTNotFound({'rid': route['rid'], 'target': target}))
+            return
+        self.connectionPool.send(nextHop['ip'], int(nextHop['port']), message(dict(request, **forwarded)))
+
+    # A request we started could not be answered. A search is remembered as a miss, the rest are only logged
+    def requestNotFound(self, notFound):
+        logging.warning("Request " + str(notFound['rid']) + " for " + notFound['target'] + " could not be answered")
+        if notFound['target'] in self.dht.lookupCache.pending:
+            self.dht.lookupCache.putMissing(notFound['target'])
+
+    def statistics(self):
+        return {"recentRequests": len(self.recentRequests), "duplicatesDropped": self.duplicatesDropped,
+                "notFoundSent": self.notFoundSent}
 
     """
     DHTPositionSearch()
@@ -25,23 +103,21 @@ class DHTAlgoirthm():
     
     Arguments 
     incomingNode (user): Takes a user object
+    route (dict): Takes the RequestRoute the request arrived with
 
     """
 
-    def DHTPositionSearch(self, incomingNode):
+    def DHTPositionSearch(self, incomingNode, route=None):
         logging.info("DHT position search ")
+        route = self.acceptRequest(route)
+        if route is None:
+            return
+        # The node that started a request is alive
+        self.dht.heardFrom((incomingNode['ip'], int(incomingNode['port'])))
 
-        # Remove the network command from the message
-        incomingNode = incomingNode.replace('==REGISTER==', '')
-        incomingNode = json.loads(incomingNode)
-
-        # Read in the current users information
-        with open("User.json", "r") as f:
-            contents = f.read()
-        currentUser = json.loads(contents)
-
-        # Load the current DHT information from file
+        # Use the routing state held in memory, our own entry in it is the current users information
         self.dht.loadDHTInformation()
+        currentUser = self.dht.fingerTable.nodeid
         logging.info("Loaded DHT information")
 
         # Determine how the bootstrapping request should be satisfied
@@ -62,13 +138,13 @@ class DHTAlgoirthm():
         elif (self.dht.fingerTable.nodeid['nodeid'] < self.dht.fingerTable.predecessor['nodeid']):
             logging.info("Edge case start of DHT")
 
-            self.startOfDHTEdgeCase(currentUser, incomingNode)
+            self.startOfDHTEdgeCase(incomingNode, route)
 
 
         # Determines whether the local node resides at the end of the DHT
         elif (self.dht.fingerTable.nodeid['nodeid'] > self.dht.fingerTable.successor['nodeid']):
             logging.info("Edge case end of DHT")
-            self.endOfDHTEdgeCase(currentUser, incomingNode)
+            self.endOfDHTEdgeCase(incomingNode, route)
 
             """Check for edge case when we are at the start of our DHT"""
 
@@ -84,11 +160,11 @@ class DHTAlgoirthm():
 
         # Cannot satisfy this request, forwarded to the local nodes successor
         elif (incomingNode['nodeid'] > self.dht.fingerTable.successor['nodeid']):
-            self.fowardRequestToSuccessor(incomingNode)
+            self.fowardRequestToSuccessor(incomingNode, route)
 
         # Cannot satisfy this request, forwarded to the local nodes predecessor
         elif (incomingNode['nodeid'] < self.dht.fingerTable.predecessor['nodeid']):
-            self.fowardRequestToPredecessor(incomingNode)
+            self.fowardRequestToPredecessor(incomingNode, route)
 
         # Error - Possibly corrupted data in transit
         else:
@@ -126,10 +202,10 @@ class DHTAlgoirthm():
     def secondNodeJoins(self, currentUser, incomingNode):
         # Sets the local finger tables predecessor and successor to the new incoming node
         self.dht.fingerTable.predecessor = incomingNode
-        self.dht.fingerTable.successor = incomingNode
+        self.dht.fingerTable.setSuccessor(incomingNode)
         self.dht.fingerTable.nodeid = currentUser
-        # Writes this updated DHT information to file
-        self.dht.writeDHTInformation()
+        # Record the updated DHT information, it is written to file by the next snapshot
+        self.dht.routingChanged()
 
         # Send back the inverse of our finger table to the new node. E.g.the local node is the bootstrapping nodes successor and predecessor
         dhtForNewNode = DHT()
@@ -138,8 +214,8 @@ class DHTAlgoirthm():
         dhtForNewNode.fingerTable.nodeid = incomingNode
 
         # Establish a TCP connection and return the calculated finger table
-        reactor.connectTCP(incomingNode['ip'], int(incomingNode['port']),
-                           DHTReturn(dhtForNewNode.fingerTable.toDict()))
+        self.connectionPool.send(incomingNode['ip'], int(incomingNode['port']),
+                                 DHTReturn(dhtForNewNode.fingerTable.toDict()))
 
     """
     startOfDHTEdgeCase()
@@ -148,10 +224,11 @@ class DHTAlgoirthm():
 
     Arguments 
     incomingNode (user): Takes a user object
+    route (dict): Takes the RequestRoute of the request
 
     """
 
-    def startOfDHTEdgeCase(self, incomingNode):
+    def startOfDHTEdgeCase(self, incomingNode, route):
         logging.info("Edge case start of DHT")
 
         if (incomingNode['nodeid'] < self.dht.fingerTable.nodeid['nodeid'] and incomingNode['nodeid'] < self.dht.fingerTable.predecessor['nodeid']):
@@ -161,7 +238,7 @@ class DHTAlgoirthm():
             self.newSuccessor(incomingNode)
 
         elif (incomingNode['nodeid'] > self.dht.fingerTable.successor['nodeid']):
-            self.fowardRequestToSuccessor(incomingNode)
+            self.fowardRequestToSuccessor(incomingNode, route)
 
 
         elif (incomingNode['nodeid'] < self.dht.fingerTable.predecessor['nodeid']):
@@ -177,10 +254,11 @@ class DHTAlgoirthm():
 
     Arguments 
     incomingNode (user): Takes a user object
+    route (dict): Takes the RequestRoute of the request
 
     """
 
-    def endOfDHTEdgeCase(self, incomingNode):
+    def endOfDHTEdgeCase(self, incomingNode, route):
 
         # Check that the incoming node is both greater than the local node id and greater than the local nodes successor
         if(incomingNode['nodeid'] > self.dht.fingerTable.nodeid['nodeid'] and incomingNode['nodeid'] > self.dht.fingerTable.successor['nodeid']):
@@ -192,7 +270,7 @@ class DHTAlgoirthm():
 
         # Check that the incoming node is greater than the local nodes successor, if so the request cannot be satisied locally so is forwarded to the successor
         elif(incomingNode['nodeid'] > self.dht.fingerTable.successor['nodeid']):
-            self.fowardRequestToSuccessor(incomingNode)
+            self.fowardRequestToSuccessor(incomingNode, route)
 
         # Check if the incoming node is less than the local nodes predecessor, if so this node now belongs at the start of the DHT and is the local nodes new successpr
         elif (incomingNode['nodeid'] < self.dht.fingerTable.predecessor['nodeid']):
@@ -213,6 +291,7 @@ class DHTAlgoirthm():
     
     Arguments 
     incomingNode (user): Takes a user object
+    route (dict): Takes the RequestRoute of the request, forwarded requests use one of its hops
 
     """
 
@@ -225,18 +304,18 @@ class DHTAlgoirthm():
         dhtForNewNode.fingerTable.predecessor = self.dht.fingerTable.predecessor
 
         # Stabilise the network by updating old predecessor with its new successor
-        reactor.connectTCP(self.dht.fingerTable.predecessor['ip'],
-                           int(self.dht.fingerTable.predecessor['port']), DHTSuccessorUpdate(incomingNode))
+        self.connectionPool.send(self.dht.fingerTable.predecessor['ip'],
+                                 int(self.dht.fingerTable.predecessor['port']), DHTSuccessorUpdate(incomingNode))
 
         # Provide the node being bootstrapped with network information allowing it to position itself in the network
 
-        reactor.connectTCP(incomingNode['ip'], int(incomingNode['port']),
-                           DHTReturn(dhtForNewNode.fingerTable.toDict()))
+        self.connectionPool.send(incomingNode['ip'], int(incomingNode['port']),
+                                 DHTReturn(dhtForNewNode.fingerTable.toDict()))
 
         # Update the local node with its new predecessor
         self.dht.fingerTable.predecessor = incomingNode
-        # Write this new information to file
-        self.dht.writeDHTInformation()
+        # Record this new information, it is written to file by the next snapshot
+        self.dht.routingChanged()
 
     def newSuccessor(self, incomingNode):
 
@@ -248,89 +327,289 @@ class DHTAlgoirthm():
 
         # Stabilise the network by updating old successor with its new predecessor
 
-        reactor.connectTCP(self.dht.fingerTable.successor['ip'],
-                           int(self.dht.fingerTable.successor['port']), DHTPredecessorUpdate(incomingNode))
+        self.connectionPool.send(self.dht.fingerTable.successor['ip'],
+                                 int(self.dht.fingerTable.successor['port']), DHTPredecessorUpdate(incomingNode))
 
         # Provide the node being bootstrapped with network information allowing it to position itself in the network
 
-        reactor.connectTCP(incomingNode['ip'], int(incomingNode['port']),
-                           DHTReturn(dhtForNewNode.fingerTable.toDict()))
+        self.connectionPool.send(incomingNode['ip'], int(incomingNode['port']),
+                                 DHTReturn(dhtForNewNode.fingerTable.toDict()))
 
-        # Update the local node with its new successor
-        self.dht.fingerTable.successor = incomingNode
-        # Write this new information to file
-        self.dht.writeDHTInformation()
+        # Update the local node with its new successor, our old successor now follows it
+        self.dht.fingerTable.setSuccessor(incomingNode, self.dht.fingerTable.successorList())
+        # Record this new information, it is written to file by the next snapshot
+        self.dht.routingChanged()
 
-    def fowardRequestToPredecessor(self, incomingNode):
+    def fowardRequestToPredecessor(self, incomingNode, route):
         logging.info("DHT position request. Can't satisfy sending to the previous node")
-        incomingNode = json.dumps(incomingNode)
-        reactor.connectTCP(self.dht.fingerTable.predecessor['ip'],
-                           int(self.dht.fingerTable.predecessor['port']), DHTRegistration(incomingNode))
+        self.forwardRequest(route, self.dht.fingerTable.predecessor, DHTRegistration, incomingNode, incomingNode['nodeid'])
 
-    def fowardRequestToSuccessor(self, incomingNode):
+    def fowardRequestToSuccessor(self, incomingNode, route):
         logging.info("DHT position request. Can't satisfy sending to the next node")
-        incomingNode = json.dumps(incomingNode)
-        reactor.connectTCP(self.dht.fingerTable.successor['ip'],
-                           int(self.dht.fingerTable.successor['port']), DHTRegistration(incomingNode))
+        # Jump as far around the ring as our fingers allow rather than walking one successor at a time
+        nextHop = self.nextHopTowards(incomingNode['nodeid'])
+        self.forwardRequest(route, nextHop, DHTRegistration, incomingNode, incomingNode['nodeid'])
+
+    # The closest finger preceding the target, falls back to the successor when no finger is closer
+    def nextHopTowards(self, targetID):
+        nextHop = self.dht.fingerTable.closestPrecedingFinger(targetID)
+        if nextHop['nodeid'] == self.dht.fingerTable.nodeid['nodeid']:
+            return self.dht.fingerTable.successor
+        return nextHop
 
     """
     DHTInformationSearch
     
     This method encapsulates all the logic required to search the DHT for data
     Attempts to match a SHA256 value to those in its local stoage
-    If the request can not be satisifed it will determine which direction the request
-    should be fowarded in
+    If the request can not be satisifed from local storage or from a fresh search result in
+    our lookup cache it will determine which direction the request should be fowarded in
 
     Arguments 
     userSearchRequest (dict): Takes a dict containing the return address of the search
     and a SHA256 encoding of a users pseudonym which is used in the search
+    route (dict): Takes the RequestRoute the search arrived with
     
     """
 
-    def DHTInformationSearch(self, userSearchRequest):
+    def DHTInformationSearch(self, userSearchRequest, route=None):
         logging.info("DHT information search")
+        route = self.acceptRequest(route)
+        if route is None:
+            return
+        self.dht.heardFrom((userSearchRequest['ip'], int(userSearchRequest['port'])))
 
-        # Remove the network command from the message
-        userSearchRequest = userSearchRequest.replace("==DHTSEARCH==", "")
         self.dht.loadDHTInformation()
-        # Convert the request into a dictionary object
-        userSearchRequest = ast.literal_eval(userSearchRequest)
 
         logging.info("Incoming DHT Search Data" + str(userSearchRequest))
+        closestFinger = self.dht.fingerTable.closestPrecedingFinger(userSearchRequest['username'])
+        cached = self.dht.lookupCache.get(userSearchRequest['username'])
 
         # Check to see if the hash value is equivalent to our successors ID
         if (self.dht.fingerTable.successor['nodeid'] == userSearchRequest['username']):
             logging.info("Found user returning object successor")
             userfound = self.dht.fingerTable.successor
-            reactor.connectTCP(userSearchRequest['ip'],
-                               int(userSearchRequest['port']), DHTSearchReturn(userfound))
+            self.connectionPool.send(userSearchRequest['ip'],
+                                     int(userSearchRequest['port']), DHTSearchReturn(userfound))
 
         # Check to see if the hash value is equivalent to our predecessors ID
         elif (self.dht.fingerTable.predecessor['nodeid'] == userSearchRequest['username']):
             logging.info("Found user returning object predecessor")
             userfound = self.dht.fingerTable.predecessor
-            reactor.connectTCP(userSearchRequest['ip'],
-                               int(userSearchRequest['port']), DHTSearchReturn(userfound))
+            self.connectionPool.send(userSearchRequest['ip'],
+                                     int(userSearchRequest['port']), DHTSearchReturn(userfound))
 
         # Check to see if the hash value is equivalent to our own ID
         elif (self.dht.fingerTable.nodeid['nodeid'] == userSearchRequest['username']):
             logging.info("Found user is my NODEID!")
             userfound = self.dht.fingerTable.nodeid
-            reactor.connectTCP(userSearchRequest['ip'],
-                               int(userSearchRequest['port']), DHTSearchReturn(userfound))
+            self.connectionPool.send(userSearchRequest['ip'],
+                                     int(userSearchRequest['port']), DHTSearchReturn(userfound))
+
+        # We found this user recently ourselves, answer from the lookup cache instead of walking the rest of the ring
+        elif (cached is not None):
+            logging.info("Found user in our lookup cache")
+            userfound = cached
+            self.connectionPool.send(userSearchRequest['ip'],
+                                     int(userSearchRequest['port']), DHTSearchReturn(userfound))
+
+        # A finger further round the ring than our successor sits before the hash value, jump straight to it
+        elif (closestFinger['nodeid'] not in (self.dht.fingerTable.nodeid['nodeid'], self.dht.fingerTable.successor['nodeid'])):
+            logging.info("Sending information request to the closest preceding finger " + closestFinger['nodeid'])
+            self.forwardRequest(route, closestFinger, DHTSearch, userSearchRequest, userSearchRequest['username'])
 
         # Check if the hash value is greater than our ID, if so send to our successor
         elif (userSearchRequest['username'] > self.dht.fingerTable.nodeid['nodeid']):
             logging.info("Sending information request to our successor cannot satisfy request")
-            reactor.connectTCP(self.dht.fingerTable.successor['ip'], int(self.dht.fingerTable.successor['port']),
-                               DHTSearch(userSearchRequest))
+            self.forwardRequest(route, self.dht.fingerTable.successor, DHTSearch, userSearchRequest, userSearchRequest['username'])
 
         # Check if the hash value is greater than our ID, if so send to our successor
         elif (userSearchRequest['username'] < self.dht.fingerTable.nodeid['nodeid']):
             logging.info("Sending information request to our predecessor cannot satisfy request")
-            reactor.connectTCP(self.dht.fingerTable.predecessor['ip'], int(self.dht.fingerTable.predecessor['port']),
-                               DHTSearch(userSearchRequest))
+            self.forwardRequest(route, self.dht.fingerTable.predecessor, DHTSearch, userSearchRequest, userSearchRequest['username'])
 
         # Should not be possible to reach this position
         else:
             logging.error("ERROR! Should never reach this location")
+
+    """
+    fixFingers(), DHTFingerSearch() & DHTFingerReturn()
+
+    The fix-fingers pass keeps the finger table fresh. Each run refreshes a batch of fingers in turn by looking up
+    the successor of each finger's start position. Lookups that fall between this node and its successor are answered
+    locally, the rest are routed through the closest preceding finger and answered with a FINGERRETURN
+
+    Arguments
+    count (int): Number of fingers to refresh, defaults to fixFingersBatch
+    fingerRequest (dict): Takes the target position, the finger index and the return address of the node fixing its fingers
+    fingerResult (dict): Takes the finger index and the user responsible for it
+    route (dict): Takes the RequestRoute the lookup arrived with, None for our own fix-fingers pass
+
+    """
+
+    def fixFingers(self, count=None):
+        # Nothing to fix until this node has joined a network with at least one other node
+        if not self.dht.routingState.isInitialized():
+            return
+        self.dht.loadDHTInformation()
+        if (self.dht.fingerTable.successor['nodeid'] == ''):
+            return
+
+        if count is None:
+            count = self.fixFingersBatch
+
+        for _ in range(min(count, self.dht.fingerTable.fingerCount)):
+            index = self.dht.fingerTable.nextFinger
+            self.dht.fingerTable.nextFinger = (index + 1) % self.dht.fingerTable.fingerCount
+            self.DHTFingerSearch({'target': self.dht.fingerTable.fingerStartID(index), 'index': index,
+                                  'ip': self.dht.fingerTable.nodeid['ip'], 'port': self.dht.fingerTable.nodeid['port']})
+
+    def DHTFingerSearch(self, fingerRequest, route=None):
+        route = self.acceptRequest(route)
+        if route is None:
+            return
+        self.dht.heardFrom((fingerRequest['ip'], int(fingerRequest['port'])))
+        self.dht.loadDHTInformation()
+        fingerTable = self.dht.fingerTable
+        ownInt = fingerTable.idToInt(fingerTable.nodeid['nodeid'])
+        successorInt = fingerTable.idToInt(fingerTable.successor['nodeid'])
+
+        # The target lies between us and our successor, our successor is responsible for it
+        if (fingerTable.between(fingerTable.idToInt(fingerRequest['target']), ownInt, successorInt, True)):
+            fingerResult = {'index': fingerRequest['index'], 'node': fingerTable.successor}
+
+            # Our own fix-fingers pass is answered without touching the network
+            if (fingerRequest['ip'] == fingerTable.nodeid['ip'] and str(fingerRequest['port']) == str(fingerTable.nodeid['port'])):
+                self.DHTFingerReturn(fingerResult)
+            else:
+                self.connectionPool.send(fingerRequest['ip'], int(fingerRequest['port']), DHTFingerReturn(fingerResult))
+
+        # Otherwise route the lookup on through our fingers
+        else:
+            nextHop = self.nextHopTowards(fingerRequest['target'])
+            self.forwardRequest(route, nextHop, DHTFingerSearch, fingerRequest, fingerRequest['target'])
+
+    def DHTFingerReturn(self, fingerResult):
+        logging.info("Finger " + str(fingerResult['index']) + " now points at " + str(fingerResult['node']['user']))
+        self.dht.loadDHTInformation()
+        self.dht.fingerTable.setFinger(int(fingerResult['index']), fingerResult['node'])
+        self.dht.routingChanged()
+
+    """
+    stabilize(), stabilizeReceived()
+
+    The stabilization pass keeps our successor list correct as nodes join and fail. We send our user record to our
+    successor, which takes us as its predecessor if we are closer than the one it has, and answers with its predecessor
+    and its own successor list. If our successor does not answer within stabilizeTimeout seconds it is treated as
+    failed, the next node of our successor list takes over and is asked straight away
+
+    Arguments
+    node (user): Takes the user record of the node stabilizing with us
+    reply (bytes): Takes the SUCCESSORS message our successor answered with
+    successor (user): Takes the successor the stabilization request was sent to
+
+    """
+
+    def stabilize(self):
+        if not self.dht.routingState.isInitialized():
+            return None
+        self.dht.loadDHTInformation()
+        successor = self.dht.fingerTable.successor
+        if successor['nodeid'] in ('', self.dht.fingerTable.nodeid['nodeid']):
+            return None
+
+        reply = self.connectionPool.send(successor['ip'], int(successor['port']), DHTStabilize(self.dht.fingerTable.nodeid))
+        reply.addTimeout(self.stabilizeTimeout, self.reactor)
+        reply.addCallbacks(self.successorsReturned, self.successorFailed, callbackArgs=(successor,), errbackArgs=(successor,))
+        return reply
+
+    def successorsReturned(self, reply, successor):
+        successors = MessageCodec.decode(reply)[1]
+        self.dht.successorsReturned(successor, successors['predecessor'], successors['successors'])
+
+    def successorFailed(self, failure, successor):
+        logging.warning("Our successor " + successor['user'] + " did not answer " + failure.getErrorMessage())
+        self.dht.nodeFailed(successor)
+        if self.dht.fingerTable.successor['nodeid'] != successor['nodeid']:
+            return self.stabilize()
+        return None
+
+    def stabilizeReceived(self, node):
+        self.dht.loadDHTInformation()
+        fingerTable = self.dht.fingerTable
+        predecessor = fingerTable.predecessor
+        ownInt = fingerTable.idToInt(fingerTable.nodeid['nodeid'])
+
+        # The node asking is closer to us than our predecessor, or our predecessor has failed
+        if (predecessor['nodeid'] == '' or self.dht.hasFailed(predecessor) or
+                (node['nodeid'] != predecessor['nodeid'] and
+                 fingerTable.between(fingerTable.idToInt(node['nodeid']), fingerTable.idToInt(predecessor['nodeid']), ownInt))):
+            logging.info(node['user'] + " is our new predecessor")
+            self.dht.updatePredecessor(node)
+        self.dht.heardFrom(FailureDetector.addressOf(node))
+        return {'predecessor': fingerTable.predecessor, 'successors': fingerTable.successorList()}
+
+    """
+    checkPredecessor()
+
+    Pings our predecessor. If it does not answer within stabilizeTimeout seconds it is treated as failed, so the next
+    node that stabilizes with us is taken as our predecessor
+
+    """
+
+    def checkPredecessor(self):
+        if not self.dht.routingState.isInitialized():
+            return None
+        self.dht.loadDHTInformation()
+        predecessor = self.dht.fingerTable.predecessor
+        if predecessor['nodeid'] in ('', self.dht.fingerTable.nodeid['nodeid']) or self.dht.hasFailed(predecessor):
+            return None
+
+        reply = self.connectionPool.send(predecessor['ip'], int(predecessor['port']), DHTPing({}))
+        reply.addTimeout(self.stabilizeTimeout, self.reactor)
+        reply.addCallbacks(self.predecessorAnswered, self.predecessorFailed, callbackArgs=(predecessor,),
+                           errbackArgs=(predecessor,))
+        return reply
+
+    def predecessorAnswered(self, reply, predecessor):
+        self.dht.heardFrom(FailureDetector.addressOf(predecessor))
+        return reply
+
+    def predecessorFailed(self, failure, predecessor):
+        logging.warning("Our predecessor " + predecessor['user'] + " did not answer " + failure.getErrorMessage())
+        self.dht.nodeFailed(predecessor)
+
+    """
+    leave() & leaveReceived()
+
+    leave tells our predecessor and successor that we are leaving the ring, each with our predecessor and successor
+    list so they can be spliced together directly. Our successor takes over our part of the ring and is also handed the
+    user records we have cached. Returns a Deferred that fires with the number of neighbours that acknowledged, once
+    both have answered or stabilizeTimeout seconds have passed. leaveReceived splices the leaving neighbour out
+
+    Arguments
+    leaving (dict): Takes the LEAVE message of the neighbour leaving
+
+    """
+
+    def leave(self):
+        if not self.dht.routingState.isInitialized():
+            return succeed(0)
+        self.dht.loadDHTInformation()
+        fingerTable = self.dht.fingerTable
+        own = fingerTable.nodeid
+        leaving = {'node': own, 'predecessor': fingerTable.predecessor, 'successors': fingerTable.successorList()}
+
+        replies = []
+        for neighbour, records in ((fingerTable.successor, self.dht.lookupCache.records()), (fingerTable.predecessor, [])):
+            if neighbour['nodeid'] in ('', own['nodeid']) or neighbour['nodeid'] in [sent['nodeid'] for sent, reply in replies]:
+                continue
+            reply = self.connectionPool.send(neighbour['ip'], int(neighbour['port']), DHTLeave(dict(leaving, records=records)))
+            reply.addTimeout(self.stabilizeTimeout, self.reactor)
+            replies.append((neighbour, reply))
+
+        acknowledged = DeferredList([reply for neighbour, reply in replies], consumeErrors=True)
+        return acknowledged.addCallback(lambda results: sum(success for success, result in results))
+
+    def leaveReceived(self, leaving):
+        self.dht.nodeLeft(leaving['node'], leaving['predecessor'], leaving['successors'], leaving['records'])
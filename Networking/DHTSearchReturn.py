@@ -7,33 +7,14 @@
 
 import logging
 
-from twisted.internet.protocol import ClientFactory, Protocol
+from Networking import MessageCodec
+from Networking.ConnectionPool import PooledMessage
 
 
-class DHTSearchReturnProtocol(Protocol):
+class DHTSearchReturn(PooledMessage):
+    # Message type the payload is encoded as
+    msgType = MessageCodec.SEARCHRETURN
 
-    def connectionMade(self):
-        # Grab the message that is being stored in the factory class
-        data = self.factory.data
-
-        # Append our network command to the message
-        msgCMD = "==SEARCHRETURN=="
-
-        # Convert our message to string and then convert the string to bytes
-        msg = msgCMD + str(data)
-        messageToSend = bytes(msg, 'utf-8')
-
-        # Send this message across the established TCP connection
-        self.transport.write(messageToSend)
-
-        logging.info("Found data requested from the DHT search sending" + str(data))
-
-    def dataReceived(self, data):
-        logging.info("DHT has been updated")
-
-
-class DHTSearchReturn(ClientFactory):
-    protocol = DHTSearchReturnProtocol
-
-    def __init__(self, data):
-        self.data = data
\ No newline at end of file
+    # Called by the connection pool once the message has been written
+    def sent(self):
+        logging.info("Found data requested from the DHT search sending" + str(self.data))
@@ -0,0 +1,221 @@
+'''
+    File name: FailureDetector.py
+    Author: Jamie Clarke
+    Date last modified: 21/04/2019
+    Python Version: 3.7
+'''
+
+import logging
+import math
+from collections import deque
+
+from twisted.internet import reactor
+
+from Networking.ConnectionPool import connectionPool
+from Networking.RoutingState import routingState
+from Server.DHTPing import DHTPing
+
+
+class FailureDetector():
+    """
+
+    Failure detector pings every node in our routing table, our ring neighbours and the fingers circuits are built
+    through, every heartbeatInterval seconds and measures how long each one takes to answer. Suspicion of a peer is
+    the phi accrual value of the time since its last answer, phi grows the longer a peer stays silent compared to the
+    gaps between its answers so far. A peer is suspected once phi reaches phiThreshold, or once it has been silent for
+    maxSilence seconds, which bounds how long a dead peer goes unnoticed. Each ping waits for an adaptive timeout worked
+    out from the smoothed round trip and its variance.
+
+    Routing skips suspected peers, path selection leaves them out of circuits and weights the rest down by their phi, and
+    suspicion listeners are told the moment a peer becomes suspected
+
+    Attributes:
+        heartbeatInterval - Seconds between two pings of a peer
+        phiThreshold -      Phi at which a peer is suspected
+        maxSilence -        Seconds without an answer after which a peer is suspected whatever its phi
+        windowSize -        Number of gaps between answers kept for each peer
+        minTimeout -        Shortest time in seconds a ping waits for its answer
+        maxTimeout -        Longest time in seconds a ping waits for its answer, used until a round trip is measured
+        rttSmoothing -      Weight of a new round trip in the smoothed round trip
+        rttVarSmoothing -   Weight of a new deviation in the round trip variance
+        routingState -      The routing state of the node, the nodes in it are the peers that are pinged
+        peers -             Maps (ip, port) to the answer history, round trip and outstanding ping of a peer
+        suspected -         Addresses of the peers currently suspected
+        listeners -         Callables told the address of a peer when it becomes suspected
+
+    """
+
+    heartbeatInterval = 2
+    phiThreshold = 4.0
+    maxSilence = 30
+    windowSize = 100
+    minTimeout = 0.5
+    maxTimeout = 5
+    rttSmoothing = 0.125
+    rttVarSmoothing = 0.25
+
+    def __init__(self, routingState=routingState, reactor=reactor, connectionPool=connectionPool):
+        self.routingState = routingState
+        self.reactor = reactor
+        self.connectionPool = connectionPool
+        self.peers = {}
+        self.suspected = set()
+        self.listeners = []
+        self.pingsSent = 0
+        self.pongsReceived = 0
+        self.timeouts = 0
+        self.suspicions = 0
+
+    def addSuspicionListener(self, listener):
+        self.listeners.append(listener)
+
+    # Blank users have no address and are never suspected
+    @staticmethod
+    def addressOf(node):
+        if node.get('nodeid') == '' or node.get('port', '') == '':
+            return None
+        return (node['ip'], int(node['port']))
+
+    def peer(self, address):
+        if address not in self.peers:
+            self.peers[address] = {"intervals": deque(maxlen=self.windowSize), "last": None,
+                                   "since": self.reactor.seconds(), "srtt": None, "rttvar": 0.0, "pending": False}
+        return self.peers[address]
+
+    # The addresses of every other node in our routing table
+    def monitored(self):
+        if not self.routingState.isInitialized():
+            return []
+        fingerTable = self.routingState.table()
+        addresses = []
+        for node in fingerTable.successorList() + [fingerTable.predecessor] + fingerTable.fingers:
+            if node['nodeid'] in ('', fingerTable.nodeid['nodeid']):
+                continue
+            address = self.addressOf(node)
+            if address not in addresses:
+                addresses.append(address)
+        return addresses
+
+    """
+    heartbeat()
+
+    Pings every monitored peer that has no ping outstanding and checks whether any of them should now be suspected.
+    Peers that have left our routing table are forgotten
+
+    """
+
+    def heartbeat(self):
+        addresses = self.monitored()
+        for address in list(self.peers):
+            if address not in addresses:
+                del self.peers[address]
+                self.suspected.discard(address)
+        for address in addresses:
+            if not self.peer(address)['pending']:
+                self.ping(address)
+            self.check(address)
+
+    def ping(self, address):
+        state = self.peer(address)
+        state['pending'] = True
+        self.pingsSent += 1
+        reply = self.connectionPool.send(address[0], address[1], DHTPing({}))
+        reply.addTimeout(self.timeout(address), self.reactor)
+        reply.addCallbacks(self.pongReceived, self.pingTimedOut, callbackArgs=(address, self.reactor.seconds()),
+                           errbackArgs=(address,))
+        return reply
+
+    def pongReceived(self, reply, address, sent):
+        self.pongsReceived += 1
+        now = self.reactor.seconds()
+        state = self.peer(address)
+        state['pending'] = False
+
+        # Smoothed round trip and its variance, as TCP works out its retransmission timeout
+        rtt = now - sent
+        if state['srtt'] is None:
+            state['srtt'] = rtt
+            state['rttvar'] = rtt / 2
+        else:
+            state['rttvar'] = (1 - self.rttVarSmoothing) * state['rttvar'] + self.rttVarSmoothing * abs(state['srtt'] - rtt)
+            state['srtt'] = (1 - self.rttSmoothing) * state['srtt'] + self.rttSmoothing * rtt
+
+        if state['last'] is not None:
+            state['intervals'].append(now - state['last'])
+        state['last'] = now
+        if address in self.suspected:
+            logging.info("Peer " + str(address) + " is answering again")
+            self.suspected.discard(address)
+
+    def pingTimedOut(self, failure, address):
+        self.timeouts += 1
+        if address in self.peers:
+            self.peers[address]['pending'] = False
+            self.check(address)
+
+    # How long a ping to a peer waits for its answer
+    def timeout(self, address):
+        state = self.peer(address)
+        if state['srtt'] is None:
+            return self.maxTimeout
+        return min(self.maxTimeout, max(self.minTimeout, state['srtt'] + 4 * state['rttvar']))
+
+    """
+    phi(), silence() & check()
+
+    phi is the suspicion of a peer, -log10 of the probability that a peer answering with its usual gaps would still be
+    silent by now, assuming the gaps are exponentially distributed. A phi of 4 means that is a 1 in 10,000 chance.
+    silence is the time since the peer last answered, or since it was first pinged if it never has. check suspects a
+    peer once either reaches its limit and tells the suspicion listeners
+
+    Arguments
+    address (tuple): Takes the (ip, port) of the peer
+
+    """
+
+    def phi(self, address):
+        state = self.peers.get(address)
+        if state is None or state['last'] is None:
+            return 0.0
+        intervals = state['intervals']
+        mean = sum(intervals) / len(intervals) if intervals else self.heartbeatInterval
+        return (self.reactor.seconds() - state['last']) / max(mean, 0.001) * math.log10(math.e)
+
+    def silence(self, address):
+        state = self.peers.get(address)
+        if state is None:
+            return 0.0
+        return self.reactor.seconds() - (state['last'] if state['last'] is not None else state['since'])
+
+    def check(self, address):
+        if address in self.suspected:
+            return
+        if self.phi(address) < self.phiThreshold and self.silence(address) < self.maxSilence:
+            return
+        logging.warning("Suspecting peer " + str(address) + " has failed, phi " + str(round(self.phi(address), 2)))
+        self.suspected.add(address)
+        self.suspicions += 1
+        for listener in list(self.listeners):
+            listener(address)
+
+    def isSuspected(self, address):
+        return address in self.suspected
+
+    # Suspicion of a user record, blank users are never suspected
+    def suspects(self, node):
+        address = self.addressOf(node)
+        return address is not None and address in self.suspected
+
+    def suspicion(self, node):
+        address = self.addressOf(node)
+        return self.phi(address) if address is not None else 0.0
+
+    def statistics(self):
+        return {"peers": len(self.peers), "suspected": [list(address) for address in self.suspected],
+                "pingsSent": self.pingsSent, "pongsReceived": self.pongsReceived, "timeouts": self.timeouts,
+                "suspicions": self.suspicions,
+                "phi": {address[0] + ":" + str(address[1]): round(self.phi(address), 2) for address in self.peers}}
+
+
+# The failure detector of the default node
+failureDetector = FailureDetector()
@@ -0,0 +1,31 @@
+'''
+    File name: FramedProtocol.py
+    Author: Jamie Clarke
+    Date last modified: 18/03/2019
+    Python Version: 3.7
+'''
+
+import logging
+
+from twisted.protocols.basic import Int32StringReceiver
+
+
+class FramedProtocol(Int32StringReceiver):
+    """
+
+    Framed protocol is the wire format shared by the server and every outbound connection. Each message is sent as a
+    4 byte big endian length followed by the message itself. Partial reads are reassembled before stringReceived is
+    called and many messages can be pipelined over one connection
+
+    Attributes:
+        MAX_LENGTH -      Largest message accepted. A bigger length prefix drops the connection, so a peer can never
+                          make us buffer more than one frame
+
+    """
+
+    MAX_LENGTH = 1024 * 1024
+
+    # Called instead of buffering when a peer announces a frame bigger than MAX_LENGTH
+    def lengthLimitExceeded(self, length):
+        logging.error("Dropping connection, frame of " + str(length) + " bytes is over the " + str(self.MAX_LENGTH) + " byte limit")
+        self.transport.loseConnection()
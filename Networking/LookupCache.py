@@ -0,0 +1,148 @@
+'''
+    File name: LookupCache.py
+    Author: Jamie Clarke
+    Date last modified: 21/04/2019
+    Python Version: 3.7
+'''
+
+import logging
+from collections import OrderedDict
+
+from twisted.internet import reactor
+
+
+class LookupCache():
+    """
+
+    Lookup cache remembers the answers to recent DHT searches, mapping a username hash to the user record found for it,
+    so searching for the same user again does not walk the ring. Searches that went unanswered are remembered for a
+    shorter time so a missing user is not searched for over and over. An entry is dropped as soon as a connection to
+    the address it holds fails, as the user has most likely left or moved. The node listens for failed connections on
+    the connection pool while it runs and hands them to connectionFailed
+
+    Attributes:
+        ttl -               Seconds a user record found by a search is used for
+        negativeTTL -       Seconds a search that went unanswered is remembered for
+        searchTimeout -     Seconds a search may go unanswered before it is remembered as a miss
+        maxEntries -        Number of entries kept, the least recently used are dropped first
+        entries -           Maps a username hash to its user record, None for a miss, and the time it expires
+        pending -           Searches sent by this node that have not been answered, by username hash
+        hits -              Lookups answered with a user record
+        negativeHits -      Lookups answered with a remembered miss
+        misses -            Lookups the cache could not answer
+        evictions -         Entries dropped to stay within maxEntries
+        invalidations -     Entries dropped because a connection to their address failed
+
+    """
+
+    ttl = 300
+    negativeTTL = 30
+    searchTimeout = 10
+    maxEntries = 1024
+
+    def __init__(self, reactor=reactor):
+        self.reactor = reactor
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.hits = 0
+        self.negativeHits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    # Fresh entry for a username hash, or None. Expired entries are dropped as they are found
+    def entry(self, usernameHash):
+        entry = self.entries.get(usernameHash)
+        if entry is None:
+            return None
+        if entry[1] <= self.reactor.seconds():
+            del self.entries[usernameHash]
+            return None
+        self.entries.move_to_end(usernameHash)
+        return entry
+
+    # The user record cached for a username hash, or None if there is no fresh one
+    def get(self, usernameHash):
+        entry = self.entry(usernameHash)
+        if entry is None or entry[0] is None:
+            if entry is None:
+                self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    # True if a search for the username hash went unanswered within the last negativeTTL seconds
+    def isMissing(self, usernameHash):
+        entry = self.entry(usernameHash)
+        if entry is not None and entry[0] is None:
+            self.negativeHits += 1
+            return True
+        return False
+
+    # Remember a user record returned by a search
+    def put(self, user):
+        self.answered(user['nodeid'])
+        self.store(user['nodeid'], user, self.ttl)
+
+    # Remember that a username hash could not be found
+    def putMissing(self, usernameHash):
+        self.answered(usernameHash)
+        self.store(usernameHash, None, self.negativeTTL)
+
+    def store(self, usernameHash, user, ttl):
+        self.entries[usernameHash] = (user, self.reactor.seconds() + ttl)
+        self.entries.move_to_end(usernameHash)
+        while len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    """
+    expect()
+
+    Called when this node sends a search. If no answer has arrived after searchTimeout seconds the username hash is
+    remembered as a miss
+
+    Arguments
+    usernameHash (string): Takes the SHA256 value being searched for
+
+    """
+
+    def expect(self, usernameHash):
+        if usernameHash not in self.pending:
+            self.pending[usernameHash] = self.reactor.callLater(self.searchTimeout, self.searchTimedOut, usernameHash)
+
+    def answered(self, usernameHash):
+        call = self.pending.pop(usernameHash, None)
+        if call is not None and call.active():
+            call.cancel()
+
+    def searchTimedOut(self, usernameHash):
+        del self.pending[usernameHash]
+        logging.info("Search for " + usernameHash + " went unanswered, remembering it as missing")
+        self.store(usernameHash, None, self.negativeTTL)
+
+    def invalidate(self, usernameHash):
+        if self.entries.pop(usernameHash, None) is not None:
+            self.invalidations += 1
+
+    # Drop every user record held for an address the connection pool could not reach
+    def connectionFailed(self, address):
+        for usernameHash, (user, expires) in list(self.entries.items()):
+            if user is not None and (user['ip'], int(user['port'])) == address:
+                logging.info("Dropping cached lookup for " + user['user'] + ", " + str(address) + " is unreachable")
+                self.invalidate(usernameHash)
+
+    # The fresh user records held, most recently used last, handed to our successor when we leave the ring
+    def records(self, limit=255):
+        now = self.reactor.seconds()
+        users = [user for user, expires in self.entries.values() if user is not None and expires > now]
+        return users[-limit:]
+
+    def statistics(self):
+        return {"entries": len(self.entries), "pending": len(self.pending), "hits": self.hits,
+                "negativeHits": self.negativeHits, "misses": self.misses, "evictions": self.evictions,
+                "invalidations": self.invalidations}
+
+
+# The lookup cache of the default node
+lookupCache = LookupCache()
@@ -0,0 +1,217 @@
+'''
+    File name: MessageCodec.py
+    Author: Jamie Clarke
+    Date last modified: 18/03/2019
+    Python Version: 3.7
+'''
+
+import struct
+
+"""
+
+Message codec converts network messages to and from a compact binary format. Every message starts with a two byte
+header, the codec version followed by the message type. The fields of each message type are written in the order
+given by its schema so no field names travel over the wire. Messages that carry a single user use the user record
+itself as their schema
+
+Field types:
+    str -       UTF-8 string prefixed with a 2 byte length
+    text -      UTF-8 string prefixed with a 4 byte length, used for PEM keys
+    bytes -     Raw bytes prefixed with a 4 byte length
+    u8 -        Unsigned 1 byte integer, used for the hop budget of a forwarded request
+    u16 -       Unsigned 2 byte integer
+    u32 -       Unsigned 4 byte integer, used for onion cell sequence numbers
+    u64 -       Unsigned 8 byte integer, used for circuit IDs
+    nodeid -    SHA256 hex digest packed into 32 raw bytes, or empty for a blank user
+    user -      A User().toDict() record
+    users -     A list of up to 255 user records prefixed with a 1 byte count
+
+Requests that are forwarded around the ring end with the fields of their RequestRoute
+
+"""
+
+VERSION = 2
+
+# Message types
+REGISTER = 1
+REGISTERRETURN = 2
+SEARCH = 3
+SEARCHRETURN = 4
+UPDATESUCCESSOR = 5
+UPDATEPREDECESSOR = 6
+CREATE = 7
+KEYRECIEVED = 8
+ONION = 9
+FINDFINGER = 11
+FINGERRETURN = 12
+CREATE2 = 13
+CREATED2 = 14
+NOTFOUND = 15
+STABILIZE = 16
+SUCCESSORS = 17
+PING = 18
+PONG = 19
+LEAVE = 20
+LEFT = 21
+
+# Readable names for logging and statistics
+NAMES = {REGISTER: "REGISTER", REGISTERRETURN: "REGISTERRETURN", SEARCH: "SEARCH", SEARCHRETURN: "SEARCHRETURN",
+         UPDATESUCCESSOR: "UPDATESUCCESSOR", UPDATEPREDECESSOR: "UPDATEPREDECESSOR", CREATE: "CREATE",
+         KEYRECIEVED: "KEYRECIEVED", ONION: "ONION", FINDFINGER: "FINDFINGER",
+         FINGERRETURN: "FINGERRETURN", CREATE2: "CREATE2", CREATED2: "CREATED2", NOTFOUND: "NOTFOUND",
+         STABILIZE: "STABILIZE", SUCCESSORS: "SUCCESSORS", PING: "PING", PONG: "PONG",
+         LEAVE: "LEAVE", LEFT: "LEFT"}
+
+USER = (('ip', 'str'), ('port', 'str'), ('user', 'str'), ('nodeid', 'nodeid'), ('publickey', 'text'))
+ROUTE = (('rid', 'u64'), ('hops', 'u8'), ('seen', 'bytes'))
+
+SCHEMAS = {
+    REGISTER: USER + ROUTE,
+    REGISTERRETURN: (('nodeid', 'user'), ('successor', 'user'), ('predecessor', 'user')),
+    SEARCH: (('username', 'nodeid'), ('ip', 'str'), ('port', 'str')) + ROUTE,
+    SEARCHRETURN: USER,
+    UPDATESUCCESSOR: USER,
+    UPDATEPREDECESSOR: USER,
+    CREATE: (('circid', 'u64'), ('key', 'bytes')),
+    KEYRECIEVED: (('capacity', 'u32'),),
+    ONION: (('circid', 'u64'), ('seq', 'u32'), ('cell', 'bytes')),
+    FINDFINGER: (('target', 'nodeid'), ('index', 'u16'), ('ip', 'str'), ('port', 'str')) + ROUTE,
+    FINGERRETURN: (('index', 'u16'), ('node', 'user')),
+    CREATE2: (('circid', 'u64'), ('handshake', 'bytes')),
+    CREATED2: (('handshake', 'bytes'), ('capacity', 'u32')),
+    NOTFOUND: (('rid', 'u64'), ('target', 'nodeid')),
+    STABILIZE: USER,
+    SUCCESSORS: (('predecessor', 'user'), ('successors', 'users')),
+    PING: (),
+    PONG: (),
+    LEAVE: (('node', 'user'), ('predecessor', 'user'), ('successors', 'users'), ('records', 'users')),
+    LEFT: (),
+}
+
+HEADER = struct.Struct('!BB')
+U8 = struct.Struct('!B')
+U16 = struct.Struct('!H')
+U32 = struct.Struct('!I')
+U64 = struct.Struct('!Q')
+LENGTHS = {'str': U16, 'text': U32, 'bytes': U32, 'nodeid': U8}
+
+
+"""
+encode() & decode()
+
+encode takes a message type and a dictionary holding the fields named in its schema and returns the message as bytes.
+Keys that are not part of the schema are ignored. decode reverses this and returns the message type along with a
+dictionary of its fields. A ValueError is raised for a message from another codec version, an unknown message type
+or a truncated message
+
+Arguments
+msgType (int): One of the message type constants above
+fields (dict): Takes the message fields
+data (bytes): Takes an encoded message
+
+"""
+
+
+def encode(msgType, fields):
+    out = bytearray(HEADER.pack(VERSION, msgType))
+    for name, fieldType in SCHEMAS[msgType]:
+        writeField(out, fieldType, fields[name])
+    return bytes(out)
+
+
+def decode(data):
+    data = memoryview(data)
+    if len(data) < HEADER.size:
+        raise ValueError("Message is too short to hold a header")
+    version, msgType = HEADER.unpack_from(data, 0)
+    if version != VERSION:
+        raise ValueError("Unsupported codec version " + str(version))
+    if msgType not in SCHEMAS:
+        raise ValueError("Unknown message type " + str(msgType))
+
+    fields = {}
+    offset = HEADER.size
+    try:
+        for name, fieldType in SCHEMAS[msgType]:
+            fields[name], offset = readField(data, offset, fieldType)
+    except struct.error:
+        raise ValueError("Truncated message of type " + str(msgType))
+    return msgType, fields
+
+
+# Peek at the message type without decoding the fields
+def messageType(data):
+    return HEADER.unpack_from(data, 0)[1]
+
+
+def writeField(out, fieldType, value):
+    if fieldType == 'str':
+        value = value.encode('utf-8')
+        out += U16.pack(len(value))
+        out += value
+    elif fieldType == 'text':
+        value = value.encode('utf-8')
+        out += U32.pack(len(value))
+        out += value
+    elif fieldType == 'bytes':
+        out += U32.pack(len(value))
+        out += value
+    elif fieldType == 'u8':
+        out += U8.pack(value)
+    elif fieldType == 'u16':
+        out += U16.pack(int(value))
+    elif fieldType == 'u32':
+        out += U32.pack(value)
+    elif fieldType == 'u64':
+        out += U64.pack(value)
+    elif fieldType == 'nodeid':
+        value = bytes.fromhex(value)
+        out += U8.pack(len(value))
+        out += value
+    elif fieldType == 'user':
+        for name, userFieldType in USER:
+            writeField(out, userFieldType, value[name])
+    elif fieldType == 'users':
+        out += U8.pack(len(value))
+        for user in value:
+            writeField(out, 'user', user)
+    else:
+        raise ValueError("Unknown field type " + fieldType)
+
+
+def readField(data, offset, fieldType):
+    if fieldType in LENGTHS:
+        length = LENGTHS[fieldType]
+        size = length.unpack_from(data, offset)[0]
+        offset += length.size
+        if offset + size > len(data):
+            raise struct.error("field runs past the end of the message")
+        value = data[offset:offset + size]
+        offset += size
+        if fieldType == 'bytes':
+            return bytes(value), offset
+        if fieldType == 'nodeid':
+            return value.hex(), offset
+        return str(value, 'utf-8'), offset
+    if fieldType == 'u8':
+        return U8.unpack_from(data, offset)[0], offset + U8.size
+    if fieldType == 'u16':
+        return U16.unpack_from(data, offset)[0], offset + U16.size
+    if fieldType == 'u32':
+        return U32.unpack_from(data, offset)[0], offset + U32.size
+    if fieldType == 'u64':
+        return U64.unpack_from(data, offset)[0], offset + U64.size
+    if fieldType == 'user':
+        user = {}
+        for name, userFieldType in USER:
+            user[name], offset = readField(data, offset, userFieldType)
+        return user, offset
+    if fieldType == 'users':
+        count = U8.unpack_from(data, offset)[0]
+        offset += U8.size
+        users = []
+        for _ in range(count):
+            user, offset = readField(data, offset, 'user')
+            users.append(user)
+        return users, offset
+    raise ValueError("Unknown field type " + fieldType)
@@ -0,0 +1,193 @@
+'''
+    File name: NodeContext.py
+    Author: Jamie Clarke
+    Date last modified: 21/04/2019
+    Python Version: 3.7
+'''
+
+import logging
+import os
+
+from twisted.internet import reactor
+from twisted.internet.defer import succeed
+from twisted.internet.task import LoopingCall
+
+from Client.Controller import Controller
+from Encryption.AsymmetricEncryption import AsymmetricEncryption
+from Encryption.Keyring import Keyring, keyring
+from Networking.CircuitPool import CircuitPool, circuitPool
+from Networking.ConnectionPool import connectionPool
+from Networking.DHT import DHT
+from Networking.DHTAlgorithm import DHTAlgoirthm
+from Networking.FailureDetector import FailureDetector, failureDetector
+from Networking.LookupCache import LookupCache, lookupCache
+from Networking.OR import OR, onionRouter
+from Networking.PathSelection import PathSelector, pathSelector
+from Networking.RoutingState import RoutingState, routingState
+from Networking.SessionManager import SessionManager, sessionManager
+from Networking.Stabilizer import Stabilizer
+from Server.ControlServer import ControlFactory
+from Server.Server import ServerFactory
+from Utils.EventBus import EventBus, eventBus
+
+
+class NodeContext():
+    """
+
+    Node context holds everything that makes up one node, its keys, routing state, onion router, circuit pool, sessions,
+    event bus and files. A node keeps its files in its own data directory, so one reactor can host many nodes listening on
+    different ports without any of them sharing state. Only the connection pool, crypto pool and command dispatcher are
+    shared by every node in the process, a node only listens to the connection pool between start and stop so a
+    stopped node is not kept alive or told about peers by it
+
+    The default node, created without a data directory, keeps its files in the working directory and is made of the
+    module level instances the Tk client uses
+
+    Attributes:
+        dataDir -           Directory the node's DHT.json, User.json, keys and sessions are kept in
+        eventBus -          Tells the node's UI or control socket about state changes
+        keyring -           The node's private keys and the public keys of its peers
+        routingState -      The node's finger table
+        failureDetector -   Pings the nodes of the node's finger table and suspects those that stop answering
+        pathSelector -      Latency and capacity of the peers the node has built circuits through
+        onionRouter -       The node's own circuit and the relay keys of circuits passing through it
+        circuitPool -       The node's pre-built circuits
+        sessionManager -    The node's sessions with its messaging partners
+        lookupCache -       The node's recent search results
+        dht -               Reads and updates the node's routing state
+        dhtAlgorithms -     Answers the DHT requests sent to the node
+        stabilizer -        Runs the node's stabilization, fix-fingers and predecessor check
+        controller -        Carries out the node's create, join, search and send requests
+        listeners -         Ports the node is listening on while it runs
+        loops -             Maintenance the node runs while it runs
+        running -           Set from start until the node stops or starts leaving the ring
+        shutdownTrigger -   ID of the reactor shutdown trigger that makes the node leave, None while the node is stopped
+
+    """
+
+    def __init__(self, dataDir=None, reactor=reactor):
+        self.reactor = reactor
+        if dataDir is None:
+            self.dataDir = "."
+            self.eventBus = eventBus
+            self.keyring = keyring
+            self.routingState = routingState
+            self.failureDetector = failureDetector
+            self.pathSelector = pathSelector
+            self.onionRouter = onionRouter
+            self.circuitPool = circuitPool
+            self.sessionManager = sessionManager
+            self.lookupCache = lookupCache
+        else:
+            os.makedirs(dataDir, exist_ok=True)
+            self.dataDir = dataDir
+            self.eventBus = EventBus()
+            self.keyring = Keyring(dataDir)
+            self.routingState = RoutingState(reactor, self.path(RoutingState.path), self.eventBus)
+            self.failureDetector = FailureDetector(self.routingState, reactor)
+            self.pathSelector = PathSelector(self.failureDetector)
+            self.onionRouter = OR(AsymmetricEncryption(self.keyring), self.pathSelector, self.eventBus)
+            self.circuitPool = CircuitPool(self.onionRouter, self.routingState, self.pathSelector)
+            self.sessionManager = SessionManager(self.onionRouter, self.routingState, self.circuitPool, self.eventBus, dataDir)
+            self.lookupCache = LookupCache(reactor)
+
+        self.asymmetricEncryption = self.onionRouter.asymmetricEncryption
+        self.dht = DHT(self.routingState, self.sessionManager, self.lookupCache, self.failureDetector)
+        self.dhtAlgorithms = DHTAlgoirthm(self.dht)
+        self.failureDetector.addSuspicionListener(self.dht.nodeSuspected)
+        self.stabilizer = Stabilizer(self.dhtAlgorithms, self.eventBus, reactor)
+        self.controller = Controller(self)
+        self.listeners = []
+        self.loops = []
+        self.running = False
+        self.shutdownTrigger = None
+
+    def path(self, filename):
+        return os.path.join(self.dataDir, filename)
+
+    """
+    start()
+
+    Starts the node's server, its ring and circuit pool maintenance and, if a path is given, its control socket. The
+    node leaves the ring gracefully when the reactor shuts down
+
+    Arguments
+    port (int): Takes the TCP port the node's server listens on
+    control (string): Takes the path of the unix socket the node's control API listens on, None for no control socket
+
+    """
+
+    def start(self, port, control=None):
+        self.listeners.append(self.reactor.listenTCP(port, ServerFactory(self)))
+        if control is not None:
+            # Only this user may drive the node, a stale socket left by a crashed node is replaced
+            self.listeners.append(self.reactor.listenUNIX(control, ControlFactory(self.controller), mode=0o600, wantPID=True))
+
+        # Keep the ring and finger table correct as nodes join and fail
+        self.stabilizer.start()
+        # Ping the nodes of the finger table so a dead peer is noticed within a bounded time
+        # Keep warm circuits ready so a new conversation only has to exchange a key with the recipient
+        for function, interval in ((self.failureDetector.heartbeat, self.failureDetector.heartbeatInterval),
+                                   (self.circuitPool.refresh, self.circuitPool.refreshInterval)):
+            loop = LoopingCall(function)
+            loop.clock = self.reactor
+            loop.start(interval, now=False)
+            self.loops.append(loop)
+        if not self.running:
+            self.shutdownTrigger = self.reactor.addSystemEventTrigger('before', 'shutdown', self.shutdown)
+            # Nodes the connection pool gives up on are dropped from the routing state, nodes that answer are trusted again
+            connectionPool.addUnreachableListener(self.dht.connectionFailed)
+            connectionPool.addContactListener(self.dht.heardFrom)
+            # Cached search results for an address we cannot connect to are dropped
+            connectionPool.addFailureListener(self.lookupCache.connectionFailed)
+        self.running = True
+        logging.info("Node in " + self.dataDir + " listening on " + str(port))
+
+    """
+    leave() & left()
+
+    Leaves the ring gracefully. Our neighbours are spliced together and our successor is handed our cached user
+    records, then the node stops. Relay keys of circuits passing through us are dropped rather than handed over, a
+    neighbour holding them would see two layers of the same circuit, so the neighbours rebuild their circuits through us
+    instead. Returns a Deferred that fires with the number of neighbours that acknowledged
+
+    """
+
+    def leave(self):
+        if not self.running:
+            return succeed(0)
+        self.running = False
+        return self.dhtAlgorithms.leave().addCallback(self.left)
+
+    def left(self, acknowledged):
+        logging.info("Left the ring, " + str(acknowledged) + " neighbours acknowledged")
+        self.onionRouter.circuits.clear()
+        self.stop()
+        return acknowledged
+
+    # Called by the reactor as it shuts down, the trigger has fired so stop has nothing left to remove
+    def shutdown(self):
+        self.shutdownTrigger = None
+        return self.leave()
+
+    # Stop listening and maintaining the node, any routing change not yet on disk is written first
+    def stop(self):
+        self.running = False
+        if self.shutdownTrigger is not None:
+            self.reactor.removeSystemEventTrigger(self.shutdownTrigger)
+            self.shutdownTrigger = None
+        connectionPool.removeUnreachableListener(self.dht.connectionFailed)
+        connectionPool.removeContactListener(self.dht.heardFrom)
+        connectionPool.removeFailureListener(self.lookupCache.connectionFailed)
+        self.stabilizer.stop()
+        for loop in self.loops:
+            loop.stop()
+        for listener in self.listeners:
+            listener.stopListening()
+        self.loops = []
+        self.listeners = []
+        self.routingState.flush()
+
+
+# The default node, the one the Tk client drives
+defaultNode = NodeContext()
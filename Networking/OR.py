@@ -5,259 +5,449 @@
     Python Version: 3.7
 '''
 
-import ast
-import json
 import logging
-import random
+import os
 import time
-import uuid
-from pickle import dumps
-from pickle import loads
 
-from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PublicKey
+
 from twisted.internet import reactor
-from twisted.internet.protocol import ClientFactory, Protocol
+from twisted.internet.defer import CancelledError, DeferredList, FirstError, TimeoutError
 
-import Networking
-import Networking
 from Client.MessageFactory import MessageFactory
+from Networking import MessageCodec, OnionCell
+from Networking.ConnectionPool import connectionPool
+from Networking.PathSelection import pathSelector
 from Encryption.AsymmetricEncryption import AsymmetricEncryption
+from Encryption.CircuitHandshake import CircuitHandshake
+from Encryption.CryptoPool import cryptoPool
 from Encryption.SymmetricEncryption import SymmetricEncryption
+from Models.Circuit import Circuit
 from Models.Route import Route
+from Utils import EventBus
+from Utils.EventBus import eventBus
+
+
+class CircuitBuildError(Exception):
+    """Raised when too few relays are available for a circuit or a hop does not acknowledge its key in time"""
 
-key1 = None
-key2 = None
-key3 = None
-circuits = []
-route = Route()
-recieverIP = None
-recieverPort = None
-recieverPublicKey = None
 
 class OR():
     """
-    User class maintains information about the user and is also used by other nodes to contact eachother
+    OR class builds the circuits this node sends messages over and relays the onion cells of circuits passing through it.
+    The circuits we build belong to the sessions of the session manager, so the onion router keeps no state about who
+    we are talking to
     Attributes:
-        recieverIP -          Stores the IP that this computer is operating on
-        recieverPort -        Stores the port that the user has selected to open for listening by the server class
-        encryptedMessage -    The resulting message after applying three layers of encryption
-        key1 -                Symmetric key generated for hop1
-        key2 -                Symmetric key generated for hop2
-        key3 -                Symmetric key generated for recipient of the message
+        circuits -            Relay keys for every circuit passing through this node, indexed by circuit ID
+        circuitLifetime -     Seconds a relay keeps the key for a circuit
+        circuitMaxMessages -  Number of cells a relay will carry on one circuit
+        circuitBuildTimeout - Seconds every hop of a circuit has to acknowledge its key
+        maxRelayCircuits -    Number of circuits this node is prepared to relay, spare capacity is advertised to senders
+        replayWindow -        Number of sequence numbers behind the highest seen on a circuit that may still arrive. The
+                              pool spreads a circuit's cells over several connections so they can arrive out of order
+        handshake -           Preferred circuit handshake. x25519 is used with every hop that publishes an identity key,
+                              rsa always encrypts the circuit key with the hop's RSA key
     """
 
 
 
 
-    encryptedMessage = None
     symmetricEncryption = SymmetricEncryption()
     asymmetricEncryption = AsymmetricEncryption()
-    """Before we create our onion route we need to know who we are sending our message to"""
-    # This maintains the current circuits our node is involved in, allowing symmetric onion keys to be retained for more than one route.
-    # We may want to conduct many chat sessions at once. By maintaining an array of reciever keys assigned to circuit IDs this will be possible.
-    receiverKeys = []
+    circuitLifetime = Circuit.lifetime
+    circuitMaxMessages = Circuit.maxMessages
+    circuitBuildTimeout = 15
+    reactor = reactor
+    maxRelayCircuits = 1000
+    replayWindow = 64
+    handshake = "x25519"
+    circuitHandshake = CircuitHandshake()
 
     # Instantiate logger for the GUI debugging window
     debuggingWindow = logging.getLogger("1")
-    routeID = None
 
-    def constructRoute(self, peerList):
+    # Each node has its own onion router, nothing about a circuit is shared with other nodes in the same process
+    def __init__(self, asymmetricEncryption=None, pathSelector=pathSelector, eventBus=eventBus):
+        if asymmetricEncryption is not None:
+            self.asymmetricEncryption = asymmetricEncryption
+        self.pathSelector = pathSelector
+        self.eventBus = eventBus
+        # Relay keys for every circuit passing through this node, indexed by the circuit ID carried in each onion cell
+        self.circuits = {}
 
-        randroute = random.randint(1,2)
-        logging.info("Random route used random seed: " + str(randroute))
-        if(randroute == 1):
-            Networking.OR.route.hop1 = peerList['successor']
-            Networking.OR.route.hop2 = peerList['predecessor']
-        else:
-            Networking.OR.route.hop1 = peerList['predecessor']
-            Networking.OR.route.hop2 = peerList['successor']
+    """
+    constructRoute()
 
-        self.routeID = uuid.uuid4()
+    Picks the relays of a new circuit from the nodes in our routing table, never routing through the reciever, and
+    creates a key and a circuit ID for each relay and for the reciever. The reciever is the last hop of the circuit.
+    Raises CircuitBuildError if fewer than the path selector's minRelays relays are available
 
-    def createOnionKeys(self):
-        symmetricEncryption = SymmetricEncryption()
-        Networking.OR.key1 = symmetricEncryption.createKeys()
-        Networking.OR.key2 = symmetricEncryption.createKeys()
-        Networking.OR.key3 = symmetricEncryption.createKeys()
+    Arguments
+    peerList (dict): Takes our routing table
+    reciever (dict): Takes the ip, port and publickey of the reciever
+
+    """
 
-    def exchangeKeys(self):
-        # Generate keys using symmetric key class
+    def constructRoute(self, peerList, reciever):
+        route = Route(self.pathSelector.choose(peerList, exclude=[reciever]))
+        if len(route.hops) < self.pathSelector.minRelays:
+            raise CircuitBuildError("Only " + str(len(route.hops)) + " relays available, at least " +
+                                    str(self.pathSelector.minRelays) + " needed")
+        logging.info("Route built through " + str(len(route.hops)) + " relays")
 
+        symmetricEncryption = SymmetricEncryption()
+        hops = route.hops + [reciever]
+        keys = [symmetricEncryption.createKeys() for hop in hops]
+        circuitIDs = [OR.newCircuitID() for hop in hops]
+        return Circuit(hops, keys, circuitIDs)
+
+    # Circuit IDs are random 64 bit numbers so circuits built by different nodes do not collide at a relay
+    @staticmethod
+    def newCircuitID():
+        return int.from_bytes(os.urandom(8), 'big')
+
+    # Exchange keys with every hop of a circuit. Returns a Deferred that fires with the circuit once it is established
+    def exchangeKeys(self, circuit):
         # Send the user some debugging information
         userInfo = logging.getLogger("1")
         userInfo.info("Exchanging Keys")
 
-        # The protocol command that adds a node to an onion route
-        CMD = b"==CREATE=="
-        
-        keyExchangeHop1 = {}
-        # keyExchangeHop1['CIRCID'] = str(self.routeID)
-        keyExchangeHop1['CMD'] = self.asymmetricEncryption.encrypt(route.hop1['publickey'],  CMD)
-        keyExchangeHop1['KEY'] = self.asymmetricEncryption.encrypt(route.hop1['publickey'],  Networking.OR.key1)
+        # AES symmetric keys are sent to the circuit in anticpation for a message being sent
+        return self.establish(circuit, range(len(circuit.hops)))
 
+    """
+    attachRecipient()
 
-        keyExchangeHop2 = {}
-        # keyExchangeHop2['CIRCID'] = str(self.routeID)
-        keyExchangeHop2['CMD'] = self.asymmetricEncryption.encrypt(route.hop2['publickey'],  CMD)
-        keyExchangeHop2['KEY'] = self.asymmetricEncryption.encrypt(route.hop2['publickey'],  Networking.OR.key2)
+    Turns a pre-built circuit, whose relays already hold their keys, into a circuit to a reciever. Only the
+    recipient's key has to be exchanged so the first message is not held up by the relays' key exchanges. Returns a
+    Deferred that fires with the circuit once the recipient has acknowledged
 
+    Arguments
+    circuit (Circuit): Takes a circuit from the circuit pool
+    reciever (dict): Takes the ip, port and publickey of the reciever
 
-        keyExchangeHop3 = {}
-        # keyExchangeHop3['CIRCID'] = str(self.routeID)
-        keyExchangeHop3['CMD'] = self.asymmetricEncryption.encrypt(self.recieverPublicKey,  CMD)
-        keyExchangeHop3['KEY'] = self.asymmetricEncryption.encrypt(self.recieverPublicKey, Networking.OR.key3)
+    """
 
-        # Convert each exchange dictionary into a string, this should then be converted into bytes using utf-8
-        keyExchangePackage1 = bytes(str(keyExchangeHop1), 'utf-8')
-        keyExchangePackage2 = bytes(str(keyExchangeHop2), 'utf-8')
-        keyExchangePackage3 = bytes(str(keyExchangeHop3), 'utf-8')
+    def attachRecipient(self, circuit, reciever):
+        circuit.addHop(reciever, SymmetricEncryption().createKeys(), OR.newCircuitID())
+        return self.establish(circuit, [len(circuit.hops) - 1])
 
-        # Useful debugging information
-        logging.info("Key Exchange Hop 1")
-        logging.info(keyExchangeHop1)
-        logging.info("Key Exchange Hop 2")
-        logging.info(keyExchangeHop2)
-        logging.info("Key Exchange for Reciever")
+    """
+    establish()
 
-        logging.info(keyExchangeHop3)
-        userInfo.info("First OR" + str(route.hop1["ip"]))
+    Runs the key exchanges with the given hops of a circuit in parallel. The returned Deferred fires with the circuit
+    once every hop of the circuit has acknowledged, or fails with CircuitBuildError as soon as one exchange fails or
+    when circuitBuildTimeout passes. The time each hop took to acknowledge is kept in circuit.latencies
 
-        # AES symmetric keys are sent to the circuit in anticpation for a message being sent
-        reactor.connectTCP(route.hop1["ip"], int(route.hop1["port"]), MessageFactory(keyExchangePackage1))
-        userInfo.info("Second OR" + str(route.hop2["ip"]))
-        reactor.connectTCP(route.hop2["ip"], int(route.hop2["port"]), MessageFactory(keyExchangePackage2))
-        userInfo.info("Receiver Exchange" + str(self.recieverPort) + str(self.recieverIP))
-        reactor.connectTCP(self.recieverIP, int(self.recieverPort), MessageFactory(keyExchangePackage3))
-
-    def encryptMsgForOnionRouting(msg):
-        # Encrpytion is preformed First In Last Out
-        # Reciever will be encrypted first working way back from OR3 TO OR1
-
-        # This message is intended for the last hop/recipitent
-        d3 = {"CIRCID": str(OR.routeID), "cmd": "MSG", "msg": msg}
-        key3 = Fernet(Networking.OR.key3)
-        token3 = key3.encrypt(dumps(d3))
-        logging.info("VERIFY ENCRYPTION IS APPLIED PASS 1: " + str(d3))
-
-        # This message is intended for the second hop/onion node
-        d2 = {"CIRCID": str(OR.routeID), "cmd": "FWD", "ip": Networking.OR.recieverIP, "port": Networking.OR.recieverPort,
-              "msg": token3}
-        key2 = Fernet(Networking.OR.key2)
-        token2 = key2.encrypt(dumps(d2))
-        logging.info("VERIFY ENCRYPTION IS APPLIED PASS 2: " + str(d2))
-
-        # This message is intended for the first hop/onion node
-        d1 = {"CIRCID": str(OR.routeID), "cmd": "FWD", "ip": route.hop2['ip'], "port": route.hop2['port'],
-              "msg": token2}
-        key1 = Fernet(Networking.OR.key1)
-        token1 = key1.encrypt(dumps(d1))
-        logging.info("VERIFY ENCRYPTION IS APPLIED PASS 3: " + str(d1))
-
-        OR.encryptedMessage = token1
-
-    # Preparation for messaging a user recieved from the DHT requires it to be read in from file
-    def loadInRecipitent():
-        logging.info("Recipitent read in")
-
-        # Open up the file and read the contents to memory. The WITH keyword will flush and close the file for us
-        with open("messagingPartner.json", "r") as f:
-            contents = f.read()
-
-        # Convert the contents of the file into JSON format
-        reciever = json.loads(contents)
-
-        # Set the global onion routing variables so it knows the reciever we would like to create a circuit to
-        Networking.OR.recieverIP = reciever['ip']
-        Networking.OR.recieverPort = reciever['port']
-
-
-    def router(self, data):
+    Arguments
+    circuit (Circuit): Takes the circuit being built
+    indices (list): Takes the positions of the hops that still need a key
+
+    """
+
+    def establish(self, circuit, indices):
+        started = time.time()
+        exchanges = [self.exchangeKey(circuit, index).addCallback(self.hopEstablished, circuit, index, started)
+                     for index in indices]
+        established = DeferredList(exchanges, fireOnOneErrback=True, consumeErrors=True)
+        established.addTimeout(self.circuitBuildTimeout, self.reactor)
+        established.addCallback(self.circuitEstablished, circuit)
+        established.addErrback(self.circuitFailed, circuit)
+        return established
+
+    def hopEstablished(self, reply, circuit, index, started):
+        circuit.latencies[index] = time.time() - started
+        return self.keyAcknowledged(reply, circuit)
+
+    def circuitEstablished(self, results, circuit):
+        if not circuit.isEstablished():
+            raise CircuitBuildError(str(circuit.acknowledged) + "/" + str(len(circuit.hops)) + " hops acknowledged")
+        logging.info("Circuit established, hop latencies " + str(circuit.latencies))
+        return circuit
+
+    def circuitFailed(self, failure, circuit):
+        if failure.check(FirstError):
+            failure = failure.value.subFailure
+        # Hitting the timeout cancels every exchange still waiting
+        if failure.check(CancelledError, TimeoutError):
+            reason = "timed out after " + str(self.circuitBuildTimeout) + "s"
+        else:
+            reason = failure.getErrorMessage()
+        logging.error("Circuit build failed, " + reason)
+        raise CircuitBuildError(reason)
+
+    """
+    exchangeKey()
+
+    Agrees the symmetric key for one hop. The handshake is negotiated from the hop's published key record, hops that
+    publish an X25519 identity key get a CREATE2 handshake and the rest get their Fernet key encrypted with RSA in a
+    CREATE message. Returns a Deferred that fires with the hop's acknowledgement
+
+    Arguments
+    circuit (Circuit): Takes the circuit being built
+    index (int): Takes the position of the hop in the circuit
+
+    """
+
+    def exchangeKey(self, circuit, index):
+        hop = circuit.hops[index]
+        if self.handshake == "x25519":
+            identity = self.asymmetricEncryption.keyring.publicKey(hop['publickey'].encode('utf-8'), X25519PublicKey)
+            if identity is not None:
+                return self.sendHandshake(circuit, index, identity)
+
+        # The hop answers with a KEYRECIEVED message on the same connection once it has stored its key
+        encrypting = cryptoPool.run(self.asymmetricEncryption.encrypt, hop['publickey'], circuit.keys[index])
+        return encrypting.addCallback(self.sendKey, hop, circuit.circuitIDs[index])
+
+    def sendKey(self, encryptedKey, hop, circuitID):
+        keyExchange = {}
+        keyExchange['circid'] = circuitID
+        keyExchange['key'] = encryptedKey
+        keyExchangePackage = MessageCodec.encode(MessageCodec.CREATE, keyExchange)
+
+        self.debuggingWindow.info("Key exchange with " + str(hop["ip"]) + ":" + str(hop["port"]))
+        replied = connectionPool.send(hop["ip"], int(hop["port"]), MessageFactory(keyExchangePackage, expectsReply=True))
+        return replied.addCallback(self.hopReplied, hop, time.time())
+
+    # Start an X25519 handshake with one hop, the hop's key is only known once its CREATED2 reply arrives
+    def sendHandshake(self, circuit, index, identity):
+        hop = circuit.hops[index]
+        ephemeral, clientPublic = self.circuitHandshake.clientStart()
+        handshakePackage = MessageCodec.encode(MessageCodec.CREATE2, {'circid': circuit.circuitIDs[index], 'handshake': clientPublic})
+
+        self.debuggingWindow.info("Handshake with " + str(hop["ip"]) + ":" + str(hop["port"]))
+        replied = connectionPool.send(hop["ip"], int(hop["port"]), MessageFactory(handshakePackage, expectsReply=True))
+        replied.addCallback(self.hopReplied, hop, time.time())
+        return replied.addCallback(self.handshakeReplied, circuit, index, ephemeral, identity)
+
+    # Feed the round trip of a key exchange and the capacity the hop advertised into path selection
+    def hopReplied(self, reply, hop, sent):
+        if MessageCodec.messageType(reply) in (MessageCodec.KEYRECIEVED, MessageCodec.CREATED2):
+            self.pathSelector.recordLatency(hop, time.time() - sent)
+            self.pathSelector.recordCapacity(hop, MessageCodec.decode(reply)[1]['capacity'])
+        return reply
+
+    def handshakeReplied(self, reply, circuit, index, ephemeral, identity):
+        if MessageCodec.messageType(reply) == MessageCodec.CREATED2:
+            serverPublic = MessageCodec.decode(reply)[1]['handshake']
+            circuit.keys[index] = self.circuitHandshake.clientFinish(ephemeral, identity, serverPublic, circuit.circuitIDs[index])
+        return reply
+
+    # Count the key exchange acknowledgements, the circuit is established once every hop has replied
+    def keyAcknowledged(self, reply, circuit):
+        if MessageCodec.messageType(reply) in (MessageCodec.KEYRECIEVED, MessageCodec.CREATED2):
+            circuit.acknowledged += 1
+            logging.info("Key exchange acknowledged " + str(circuit.acknowledged) + "/" + str(len(circuit.hops)))
+        return reply
+
+    """
+    encryptMsgForOnionRouting()
+
+    Splits a message into fragments that fit in one fixed size cell and wraps each in a layer of encryption per hop
+    of the circuit. Every cell takes the next sequence number of the circuit so relays can reject replayed cells while
+    the circuit is reused. Returns the encoded ONION messages, one per fragment
+
+    Arguments
+    circuit (Circuit): Takes the established circuit to the reciever
+    msg (string): Takes the plain text message
+
+    """
+
+    def encryptMsgForOnionRouting(self, circuit, msg):
+        message = msg.encode('utf-8')
+        size = OnionCell.capacity(len(circuit.hops))
+        fragments = [message[start:start + size] for start in range(0, len(message), size)] or [b""]
+
+        encryptedMessages = []
+        for position, fragment in enumerate(fragments):
+            sequence = circuit.nextSequence()
+            cell = OnionCell.build(circuit.hops, circuit.keys, circuit.circuitIDs, sequence, fragment,
+                                   more=position < len(fragments) - 1)
+            encryptedMessages.append(MessageCodec.encode(MessageCodec.ONION, {'circid': circuit.circuitIDs[0], 'seq': sequence, 'cell': cell}))
+        return encryptedMessages
+
+    """
+    router()
+
+    Peels one layer off an onion cell. The circuit ID in the cell header picks the relay key in one dictionary lookup,
+    so the cost of relaying does not grow with the number of circuits passing through this node. Circuits are reused
+    for many cells, so a cell is only accepted once per sequence number. Cells may arrive out of order, so a sliding
+    window remembers which of the last replayWindow sequence numbers have been seen, anything older is dropped. The
+    layer digest covers the sequence number, which stops a recorded cell being replayed through us with a new one
+
+    Arguments
+    circuitID (int): Takes the circuit ID from the cell header
+    sequence (int): Takes the sequence number from the cell header
+    data (bytes): Takes the encrypted onion cell
+
+    """
+
+    def router(self, circuitID, sequence, data):
         logging.info("SEND TEXT START BEFORE DECRYPTON  START")
 
-        reencoded = ast.literal_eval(data)
-        peeledLayer = None
-        # self.circuits = json.loads(self.circuits)
-        # Loop through all the onion circuits that this node is a part of
-        for circuit in circuits:
-            # Attempt to decrypt the incoming data with each of our stored AES keys
-            try:
-                key = Fernet(circuit['key'])
-                logging.debug("ATTMEPTING TO DECODE WITH ONION KEY" + str(key))
-                peeledLayer = loads(key.decrypt(reencoded))
-                # Delete the onion circuit after decryption. Each onion circuit is only used once for security!
-                circuits.remove(circuit)
-                # If decryption is successful then we no longer need to continue the loop
-                break
-            # Print out an error if key is wrong
-            except:
-                logging.error("Wrong key. CANNOT DECODE WITH KEY FROM OUR ONION CIRCUIT")
-
-
-
-        logging.info("Incoming decoded data" + str(peeledLayer))
-
-        # If after decoding the message the CMD is equal to forward then it means that we are an OR node and not the destination. Forward this onto the next hop
-        if (peeledLayer['cmd'] == 'FWD'):
+        circuit = self.circuits.get(circuitID)
+        if circuit is None:
+            logging.error("Dropping onion cell for unknown circuit " + str(circuitID))
+            return
+        if self.circuitExpired(circuit):
+            logging.info("Dropping onion cell for expired circuit " + str(circuitID))
+            del self.circuits[circuitID]
+            return
+        if self.isReplay(circuit, sequence):
+            logging.error("Dropping replayed onion cell " + str(sequence) + " on circuit " + str(circuitID))
+            return
+
+        try:
+            cmd, peeledLayer, forward = OnionCell.peel(circuit['key'], sequence, data)
+        except ValueError as error:
+            logging.error("CANNOT DECODE WITH KEY FROM OUR ONION CIRCUIT " + str(circuitID) + " " + str(error))
+            return
+        self.recordSequence(circuit, sequence)
+        circuit['messages'] += 1
+
+        # If after peeling the CMD is equal to forward then it means that we are an OR node and not the destination. Forward the peeled cell onto the next hop
+        if (cmd == OnionCell.FWD):
             logging.info("Fowarding Message")
-            peeledLayerToSend = bytes(str(peeledLayer['msg']), 'utf-8')
-            reactor.connectTCP(peeledLayer['ip'], int(peeledLayer['port']),
+            peeledLayerToSend = MessageCodec.encode(MessageCodec.ONION, {'circid': peeledLayer['circid'], 'seq': sequence, 'cell': forward})
+            connectionPool.send(peeledLayer['ip'], peeledLayer['port'],
                                MessageFactory(peeledLayerToSend))
             self.debuggingWindow.info(peeledLayer)
             self.debuggingWindow.info("Fowarding message to the next OR!")
             logging.info("Fowarding message to the next OR")
 
-        # If after decoding the message the CMD is equal to MSG then the contents are inteded for us! Use the messageRecieved method to display this in plaintext in the UI
-
-        elif (peeledLayer['cmd'] == 'MSG'):
+        # If after peeling the CMD is MSG or MSGPART then the contents are inteded for us! Fragments are held on the circuit until every cell of the message has arrived
+        elif (cmd in (OnionCell.MSG, OnionCell.MSGPART)):
             logging.info("Recieving Message")
-            self.messageRecieved(peeledLayer['msg'])
+            self.reassemble(circuit, sequence, cmd == OnionCell.MSG, peeledLayer)
             logging.info("SEND TEXT AFTER DECRYPTION END")
 
+    """
+    isReplay() & recordSequence()
+
+    The replay window of a circuit is a bitmask, bit n is set once the cell n sequence numbers behind the highest seen
+    has been accepted. A cell is a replay if its bit is already set or it is too far behind to have a bit. A cell is
+    only recorded once its layer digest has checked out
 
+    Arguments
+    circuit (dict): Takes the relay state of the circuit
+    sequence (int): Takes the sequence number from the cell header
 
+    """
 
+    def isReplay(self, circuit, sequence):
+        behind = circuit['sequence'] - sequence
+        if behind < 0:
+            return False
+        return behind >= self.replayWindow or bool(circuit['window'] >> behind & 1)
+
+    def recordSequence(self, circuit, sequence):
+        ahead = sequence - circuit['sequence']
+        if ahead > 0:
+            circuit['window'] = (circuit['window'] << ahead | 1) & ((1 << self.replayWindow) - 1)
+            circuit['sequence'] = sequence
         else:
-            logging.error("Should never end up here")
+            circuit['window'] |= 1 << -ahead
+
+    """
+    reassemble()
+
+    Holds the fragments of the messages sent to us over a circuit by sequence number and hands every message whose
+    cells have all arrived to messageRecieved, in the order they were sent. A cell that has fallen out of the replay
+    window can no longer arrive, so the message it belonged to is dropped rather than holding up the ones after it
 
-    # Recieve an AES key for onion circuit
+    Arguments
+    circuit (dict): Takes the relay state of the circuit
+    sequence (int): Takes the sequence number of the cell
+    last (bool): Set when the cell holds the last fragment of its message
+    fragment (bytes): Takes the peeled fragment
+
+    """
+
+    def reassemble(self, circuit, sequence, last, fragment):
+        fragments = circuit['fragments']
+        fragments[sequence] = (last, fragment)
+        while True:
+            start = end = circuit['delivered'] + 1
+            while end in fragments and not fragments[end][0]:
+                end += 1
+            if end not in fragments:
+                if circuit['sequence'] - end < self.replayWindow:
+                    return
+                # Cell end is lost, skip to the first message that starts after it
+                ends = [position for position, (final, part) in fragments.items() if final and position > end]
+                if not ends:
+                    return
+                end = min(ends)
+                logging.error("Dropping a message on a circuit, one of its cells never arrived")
+                for position in range(start, end + 1):
+                    fragments.pop(position, None)
+                circuit['delivered'] = end
+                continue
+            message = b"".join(fragments.pop(position)[1] for position in range(start, end + 1))
+            circuit['delivered'] = end
+            self.messageRecieved(message.decode('utf-8', 'replace'))
+
+    # Recieve an AES key for onion circuit. The RSA decrypt runs on the crypto pool, the returned Deferred fires once the key is stored
     def recieveORKey(self, data, transport):
         logging.info("Receiving a key for onion routing")
         logging.info(data)
 
-        # Load in our private RSA key so we can decrypt the symmetric AES key
-        with open("User.json", "r") as f:
-            contents = f.read()
-        currentUser = json.loads(contents)
+        # Our private RSA key comes from the keyring, nothing is read from disk to decrypt the symmetric AES key
+        decrypting = cryptoPool.run(self.asymmetricEncryption.decrypt, None, data['key'])
+        return decrypting.addCallback(self.storeORKey, data['circid'], transport)
 
+    # Answer an X25519 handshake. The key is derived and stored straight away, the reply goes back in CREATED2
+    def recieveHandshake(self, data, transport):
+        logging.info("Receiving a handshake for onion routing")
+        serverPublic, key = self.circuitHandshake.server(self.asymmetricEncryption.keyring.identityKey(), data['handshake'], data['circid'])
+        self.storeORKey(key, data['circid'], transport)
+        return serverPublic
+
+    def storeORKey(self, key, circuitID, transport):
         # Circuit dictionary is built from the incoming data
         circuit = {
-            # "CIRCID": data['CIRCID'],
             "ip": transport,
-            "key": self.asymmetricEncryption.decrypt(currentUser['publickey'], data['KEY']),
+            "key": key,
+            "created": time.time(),
+            "messages": 0,
+            "sequence": 0,
+            # Sequence number 0 is never sent, it starts out seen
+            "window": 1,
+            "delivered": 0,
+            "fragments": {},
         }
+        self.expireCircuits()
 
-        # Add the new circuit to the array
-        circuits.append(circuit)
-        logging.info(len(circuits))
+        # Index the new circuit by the ID the sender will put on its onion cells
+        if circuitID in self.circuits:
+            logging.warning("Replacing the key for circuit " + str(circuitID))
+        self.circuits[circuitID] = circuit
+        logging.info(len(self.circuits))
 
+    # Number of circuits this relay is still willing to carry, advertised in every key exchange acknowledgement
+    def spareCapacity(self):
+        return max(0, self.maxRelayCircuits - len(self.circuits))
 
-    # Getters and Setters
-    # Set the reciever of the onion messages port
-    def setRecieverIP(self, recieverIP):
-        self.recieverIP = recieverIP
+    # A relay forgets a circuit key once the circuit is older than its lifetime or has carried its quota of cells
+    def circuitExpired(self, circuit, now=None):
+        if now is None:
+            now = time.time()
+        return now - circuit['created'] >= self.circuitLifetime or circuit['messages'] >= self.circuitMaxMessages
 
-    # Set the reciever of the onion messages port
-    def setRecieverPort(self, recieverPort):
-        self.recieverPort = recieverPort
+    # Drop the keys of every expired circuit. Senders that go quiet never send the cell that would expire them in router
+    def expireCircuits(self):
+        now = time.time()
+        for circuitID in [circuitID for circuitID, circuit in self.circuits.items() if self.circuitExpired(circuit, now)]:
+            del self.circuits[circuitID]
 
-    # Set the reciever of the onion messages publickey
-    def setRecieverPublicKey(self, recieverPublicKey):
-        self.recieverPublicKey = recieverPublicKey
 
-    # Bread and butter of displaying incoming messages. Use a logger to write to the GUI window across threads. Replace the CMD bit also before displaying the original message to user
+    # Bread and butter of displaying incoming messages. Replace the CMD bit before handing the original message to whoever is displaying it
     def messageRecieved(self, data):
         self.debuggingWindow.info("Receiving a message")
         data = data.replace('==MSG==', '')
-        # Writes message to the chat window using a global logger
-        chatA = logging.getLogger("2")
-        chatA.info(data)
\ No newline at end of file
+        self.eventBus.publish(EventBus.MESSAGE_RECEIVED, data)
+
+
+# The onion router of the default node
+onionRouter = OR()
@@ -0,0 +1,148 @@
+'''
+    File name: OnionCell.py
+    Author: Jamie Clarke
+    Date last modified: 18/03/2019
+    Python Version: 3.7
+'''
+
+import base64
+import hashlib
+import hmac
+import os
+import struct
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+"""
+
+Onion cell builds and peels the fixed size cells carried by ONION messages. Every cell is exactly CELL_SIZE bytes at
+every hop, so neither the size of a cell nor how much it shrinks gives away how far it is from the recipient
+
+Each layer is encrypted with AES-128 in counter mode so a layer is the same size as its plain text. A relay XORs its
+key stream over the whole cell, reads its HEADER_SIZE byte routing header from the front and forwards the rest with
+HEADER_SIZE random bytes appended. The sender builds the layers so the next hop's layer starts exactly where the
+routing header ended
+
+Layer layout:
+    digest -    16 byte truncated HMAC-SHA256 over the sequence number and the rest of the header, so a relay
+                can tell its header was not modified and the recipient can tell the message was not
+    FWD -       cmd, next circuit ID, next port, length of the next IP, next IP padded to 44 bytes
+    MSG -       cmd, message length, message bytes. MSGPART marks a fragment with more to follow
+
+Circuit keys are Fernet keys. As in Fernet the first half signs and the second half encrypts
+
+"""
+
+CELL_SIZE = 1024
+DIGEST_SIZE = 16
+IP_SIZE = 44
+
+# Layer commands
+FWD = 1
+MSG = 2
+MSGPART = 3
+
+ROUTE = struct.Struct('!BQHB' + str(IP_SIZE) + 's')
+MESSAGE = struct.Struct('!BH')
+SEQUENCE = struct.Struct('!I')
+HEADER_SIZE = DIGEST_SIZE + ROUTE.size
+
+
+# Split a Fernet key into the HMAC key and the AES key
+def layerKeys(key):
+    raw = base64.urlsafe_b64decode(key)
+    return raw[:16], raw[16:]
+
+
+# XOR the hop's key stream over data. The sequence number is the nonce so no key stream is used twice on a circuit
+def crypt(encryptionKey, sequence, data):
+    nonce = sequence.to_bytes(8, 'big') + bytes(8)
+    return Cipher(algorithms.AES(encryptionKey), modes.CTR(nonce), backend=default_backend()).encryptor().update(data)
+
+
+def digest(signingKey, sequence, data):
+    return hmac.new(signingKey, SEQUENCE.pack(sequence) + data, hashlib.sha256).digest()[:DIGEST_SIZE]
+
+
+# Largest message that fits in one cell on a circuit with the given number of hops
+def capacity(hops):
+    return CELL_SIZE - HEADER_SIZE * (hops - 1) - DIGEST_SIZE - MESSAGE.size
+
+
+"""
+build()
+
+Wraps one message fragment in a layer for every hop of a circuit, the recipient's layer first working back to the
+first relay. The message must fit in capacity(len(hops)) bytes and every hop's IP in IP_SIZE bytes, a ValueError is
+raised otherwise
+
+Arguments
+hops (list): Takes the user records of the circuit's hops, the recipient last
+keys (list): Takes the Fernet key shared with each hop
+circuitIDs (list): Takes the circuit ID each hop knows the circuit by
+sequence (int): Takes the sequence number of the cell
+message (bytes): Takes the message fragment for the recipient
+more (bool): Set when more fragments of the same message follow
+
+"""
+
+
+def build(hops, keys, circuitIDs, sequence, message, more=False):
+    if len(message) > capacity(len(hops)):
+        raise ValueError("Message of " + str(len(message)) + " bytes does not fit in a cell")
+
+    # This layer is intended for the last hop/recipitent
+    signingKey, encryptionKey = layerKeys(keys[-1])
+    body = MESSAGE.pack(MSGPART if more else MSG, len(message)) + message
+    size = CELL_SIZE - HEADER_SIZE * (len(hops) - 1)
+    layer = digest(signingKey, sequence, body) + body
+    layer = crypt(encryptionKey, sequence, layer + os.urandom(size - len(layer)))
+
+    # Each relay is told where to forward the cell and which circuit ID the next hop knows us by
+    for hop in range(len(hops) - 2, -1, -1):
+        nextHop = hops[hop + 1]
+        ip = nextHop['ip'].encode('utf-8')
+        # struct would silently truncate the IP and the relay would forward to a corrupt address
+        if len(ip) > IP_SIZE:
+            raise ValueError("IP of " + str(len(ip)) + " bytes does not fit in a routing header")
+        signingKey, encryptionKey = layerKeys(keys[hop])
+        route = ROUTE.pack(FWD, circuitIDs[hop + 1], int(nextHop['port']), len(ip), ip)
+        layer = crypt(encryptionKey, sequence, digest(signingKey, sequence, route) + route + layer)
+    return layer
+
+
+"""
+peel()
+
+Removes one layer from a cell. Returns the layer's command, the routing header or message, and for FWD the cell to
+forward. A ValueError is raised for a cell of the wrong size or a layer whose digest does not match
+
+Arguments
+key (bytes): Takes the Fernet key shared with the sender
+sequence (int): Takes the sequence number from the ONION message
+cell (bytes): Takes the encrypted cell
+
+"""
+
+
+def peel(key, sequence, cell):
+    if len(cell) != CELL_SIZE:
+        raise ValueError("Cell of " + str(len(cell)) + " bytes, expected " + str(CELL_SIZE))
+    signingKey, encryptionKey = layerKeys(key)
+    plain = crypt(encryptionKey, sequence, cell)
+    sealed, body = plain[:DIGEST_SIZE], plain[DIGEST_SIZE:]
+
+    if body[0] == FWD:
+        route = body[:ROUTE.size]
+        if not hmac.compare_digest(sealed, digest(signingKey, sequence, route)):
+            raise ValueError("Layer digest does not match")
+        cmd, circuitID, port, ipLength, ip = ROUTE.unpack(route)
+        header = {"circid": circuitID, "port": port, "ip": ip[:ipLength].decode('utf-8')}
+        return cmd, header, plain[HEADER_SIZE:] + os.urandom(HEADER_SIZE)
+
+    cmd, length = MESSAGE.unpack_from(body, 0)
+    message = body[:MESSAGE.size + length]
+    if cmd not in (MSG, MSGPART) or not hmac.compare_digest(sealed, digest(signingKey, sequence, message)):
+        raise ValueError("Layer digest does not match")
+    return cmd, message[MESSAGE.size:], None
@@ -0,0 +1,124 @@
+'''
+    File name: PathSelection.py
+    Author: Jamie Clarke
+    Date last modified: 18/03/2019
+    Python Version: 3.7
+'''
+
+import logging
+import random
+
+from Networking.FailureDetector import failureDetector
+
+
+class PathSelector():
+    """
+
+    Path selector picks the relays of an onion circuit from every node this node knows about, its successor,
+    predecessor and fingers, rather than always using its two neighbours. Relays are drawn at random without
+    replacement, weighted towards peers with a low measured latency and plenty of advertised capacity. Peers that
+    were picked recently are weighted down so circuits spread over the ring instead of piling onto the fastest node.
+    Peers the failure detector suspects are never picked, the rest are weighted down by their suspicion
+
+    Attributes:
+        relays -            Number of relays in a circuit, the recipient is added after them
+        minRelays -         Fewest relays a circuit may be built through, a circuit with none would go straight to the
+                            recipient and hide nothing
+        defaultLatency -    Seconds assumed for a peer whose latency has not been measured
+        defaultCapacity -   Spare circuits assumed for a peer that has not advertised its capacity
+        smoothing -         Weight of a new latency sample in the moving average
+        usageDecay -        Recent use of every peer is multiplied by this before each selection
+        peers -             Maps (ip, port) to the latency, capacity and recent use of a peer
+        failureDetector -   Tells which peers have stopped answering pings and how suspicious the rest are
+
+    """
+
+    relays = 2
+    minRelays = 1
+    defaultLatency = 0.2
+    defaultCapacity = 100
+    smoothing = 0.3
+    usageDecay = 0.5
+
+    def __init__(self, failureDetector=failureDetector):
+        self.peers = {}
+        self.random = random.Random()
+        self.failureDetector = failureDetector
+
+    @staticmethod
+    def peerKey(peer):
+        return (peer['ip'], str(peer['port']))
+
+    def stats(self, peer):
+        key = self.peerKey(peer)
+        if key not in self.peers:
+            self.peers[key] = {"latency": self.defaultLatency, "capacity": self.defaultCapacity, "uses": 0.0}
+        return self.peers[key]
+
+    # Exponentially weighted moving average of the round trip to a peer
+    def recordLatency(self, peer, seconds):
+        stats = self.stats(peer)
+        stats['latency'] = (1 - self.smoothing) * stats['latency'] + self.smoothing * seconds
+
+    def recordCapacity(self, peer, capacity):
+        self.stats(peer)['capacity'] = capacity
+
+    # Every distinct node in our routing table except ourselves
+    @staticmethod
+    def knownPeers(peerList):
+        candidates = [peerList['successor'], peerList['predecessor']]
+        candidates += [finger for index, finger in peerList.get('fingers', [])]
+        own = peerList['nodeid']['nodeid']
+        peers = {}
+        for peer in candidates:
+            if isinstance(peer, dict) and peer.get('nodeid', '') not in ('', own):
+                peers[peer['nodeid']] = peer
+        return list(peers.values())
+
+    def weight(self, peer):
+        stats = self.stats(peer)
+        suspicion = self.failureDetector.suspicion(peer)
+        return (stats['capacity'] + 1) / (max(stats['latency'], 0.001) * (1 + stats['uses']) * (1 + suspicion))
+
+    """
+    choose()
+
+    Picks the relays for a circuit. A shorter path is returned when we know fewer peers than requested, callers refuse
+    to build a circuit through fewer than minRelays of them
+
+    Arguments
+    peerList (dict): Takes the contents of DHT.json
+    count (int): Takes the number of relays wanted, relays by default
+    exclude (list): Takes users that must not relay the circuit, such as the recipient
+
+    """
+
+    def choose(self, peerList, count=None, exclude=()):
+        if count is None:
+            count = self.relays
+        excluded = {self.peerKey(peer) for peer in exclude}
+        candidates = [peer for peer in self.knownPeers(peerList)
+                      if self.peerKey(peer) not in excluded and not self.failureDetector.suspects(peer)]
+
+        for stats in self.peers.values():
+            stats['uses'] *= self.usageDecay
+
+        chosen = []
+        while candidates and len(chosen) < count:
+            weights = [self.weight(peer) for peer in candidates]
+            point = self.random.uniform(0, sum(weights))
+            for position, weight in enumerate(weights):
+                point -= weight
+                if point <= 0:
+                    break
+            peer = candidates.pop(position)
+            self.stats(peer)['uses'] += 1
+            chosen.append(peer)
+
+        if len(chosen) < count:
+            logging.warning("Only " + str(len(chosen)) + " relays known, wanted " + str(count))
+        return chosen
+
+
+# The selector of the default node
+pathSelector = PathSelector()
@@ -0,0 +1,77 @@
+'''
+    File name: RequestRoute.py
+    Author: Jamie Clarke
+    Date last modified: 21/04/2019
+    Python Version: 3.7
+'''
+
+import hashlib
+import os
+
+"""
+
+Request route is the routing header carried by every DHT request that is forwarded around the ring, REGISTER, SEARCH
+and FINDFINGER. It bounds what a request can cost when it cannot be answered, a lookup for a user who does not exist
+or a join that arrives while the ring is changing, so the request cannot bounce between nodes forever
+
+Route fields:
+    rid -       Random 64 bit request ID, a node that has already handled a request ID drops the request
+    hops -      Hops the request may still take, the node holding the last hop answers NOTFOUND instead of forwarding
+    seen -      Bloom filter of the node IDs that have forwarded the request, SEEN_SIZE bytes. A request is never
+                forwarded to a node already in it, a false positive only ends the request early
+
+"""
+
+FIELDS = ('rid', 'hops', 'seen')
+MAX_HOPS = 32
+SEEN_SIZE = 64
+SEEN_HASHES = 3
+
+
+# The route of a request this node starts
+def new():
+    return {'rid': int.from_bytes(os.urandom(8), 'big'), 'hops': MAX_HOPS, 'seen': bytes(SEEN_SIZE)}
+
+
+# Separate the route from the fields of a decoded request
+def split(fields):
+    request = {name: value for name, value in fields.items() if name not in FIELDS}
+    return request, {name: fields[name] for name in FIELDS}
+
+
+# Bit positions a node ID sets in the seen filter
+def positions(nodeid):
+    digest = hashlib.sha256(nodeid.encode('utf-8')).digest()
+    return [int.from_bytes(digest[index * 4:index * 4 + 4], 'big') % (SEEN_SIZE * 8) for index in range(SEEN_HASHES)]
+
+
+def addSeen(seen, nodeid):
+    seen = bytearray(seen)
+    for position in positions(nodeid):
+        seen[position // 8] |= 1 << (position % 8)
+    return bytes(seen)
+
+
+def wasSeen(seen, nodeid):
+    return all(seen[position // 8] & (1 << (position % 8)) for position in positions(nodeid))
+
+
+"""
+forwarded()
+
+Returns the route a request takes to its next hop, with one hop used and this node added to the seen filter, or None
+if the request has used its hop budget or the next hop has already forwarded it
+
+Arguments
+route (dict): Takes the route the request arrived with
+nodeid (string): Takes the node ID of the node forwarding the request
+nextHop (string): Takes the node ID of the node the request would be forwarded to
+
+"""
+
+
+def forwarded(route, nodeid, nextHop):
+    seen = addSeen(route['seen'], nodeid)
+    if route['hops'] <= 1 or wasSeen(seen, nextHop):
+        return None
+    return {'rid': route['rid'], 'hops': route['hops'] - 1, 'seen': seen}
@@ -0,0 +1,128 @@
+'''
+    File name: RoutingState.py
+    Author: Jamie Clarke
+    Date last modified: 18/03/2019
+    Python Version: 3.7
+'''
+
+import json
+import logging
+import os
+from pathlib import Path
+
+from twisted.internet import reactor
+
+from Models.FingerTable import FingerTable
+from Utils import EventBus
+from Utils.EventBus import eventBus
+
+
+class RoutingState():
+    """
+
+    Routing state holds the one finger table every module on this node reads and updates. DHT.json is read once when
+    the table is first needed and is then only written. Changes are coalesced into write-behind snapshots, at most one
+    every writeDelay seconds, so handling a request never waits on the disk. Each snapshot is written to a temporary
+    file, synced and renamed over DHT.json so a crash never leaves a half written routing table behind
+
+    Attributes:
+        path -          File the routing table is persisted to
+        writeDelay -    Smallest gap in seconds between two snapshots
+        fingerTable -   The authoritative finger table, loaded on first use
+        dirty -         Set when the table has changed since the last snapshot
+        changes -       Changes recorded since the node started
+        writes -        Snapshots written since the node started
+
+    """
+
+    path = "DHT.json"
+    writeDelay = 1.0
+
+    def __init__(self, reactor=reactor, path=path, eventBus=eventBus):
+        self.reactor = reactor
+        self.path = path
+        self.eventBus = eventBus
+        self.fingerTable = None
+        self.dirty = False
+        self.writeCall = None
+        self.lastWrite = None
+        self.changes = 0
+        self.writes = 0
+        self.shutdownTrigger = None
+
+    # The finger table, read from disk the first time it is needed
+    def table(self):
+        if self.fingerTable is None:
+            self.fingerTable = self.load()
+        return self.fingerTable
+
+    # True once this node has routing information, either in memory or from a previous run
+    def isInitialized(self):
+        return self.fingerTable is not None or Path(self.path).is_file()
+
+    def load(self):
+        fingerTable = FingerTable()
+        if not Path(self.path).is_file():
+            return fingerTable
+
+        # Read in the contents of DHT.json and convert to JSON format
+        with open(self.path, "r") as f:
+            contents = f.read()
+        dhtfile = json.loads(contents)
+
+        fingerTable.successor = dhtfile['successor']
+        # Older DHT.json files were written before successor lists existed
+        fingerTable.successors = dhtfile.get('successors', [])
+        fingerTable.predecessor = dhtfile['predecessor']
+        fingerTable.nodeid = dhtfile['nodeid']
+        # Older DHT.json files were written before finger tables existed
+        if 'fingers' in dhtfile:
+            fingerTable.loadFingers(dhtfile['fingers'])
+        return fingerTable
+
+    # Make a finger table the authoritative one, used when a whole table arrives from another node
+    def replace(self, fingerTable):
+        self.fingerTable = fingerTable
+        self.changed()
+
+    # Record a change and tell subscribers about it. A snapshot is scheduled unless one is already waiting
+    def changed(self):
+        self.changes += 1
+        self.dirty = True
+        self.eventBus.publish(EventBus.ROUTING_CHANGED, self.table())
+        if self.writeCall is not None and self.writeCall.active():
+            return
+        if self.shutdownTrigger is None:
+            self.shutdownTrigger = self.reactor.addSystemEventTrigger('before', 'shutdown', self.flush)
+        delay = 0
+        if self.lastWrite is not None:
+            delay = max(0, self.lastWrite + self.writeDelay - self.reactor.seconds())
+        self.writeCall = self.reactor.callLater(delay, self.flush)
+
+    # Write a snapshot now if anything has changed since the last one
+    def flush(self):
+        if self.writeCall is not None and self.writeCall.active():
+            self.writeCall.cancel()
+        self.writeCall = None
+        if not self.dirty:
+            return
+
+        snapshot = json.dumps(self.table().toDict())
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as f:
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+
+        self.dirty = False
+        self.lastWrite = self.reactor.seconds()
+        self.writes += 1
+        logging.debug("Routing state snapshot " + str(self.writes) + " written after " + str(self.changes) + " changes")
+
+    def statistics(self):
+        return {"changes": self.changes, "writes": self.writes, "dirty": self.dirty}
+
+
+# The routing state of the default node
+routingState = RoutingState()
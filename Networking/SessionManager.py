@@ -0,0 +1,241 @@
+'''
+    File name: SessionManager.py
+    Author: Jamie Clarke
+    Date last modified: 21/04/2019
+    Python Version: 3.7
+'''
+
+import json
+import logging
+import os
+from collections import OrderedDict
+from pathlib import Path
+
+from twisted.internet.defer import Deferred, fail, succeed
+
+from Client.MessageFactory import MessageFactory
+from Models.Session import Session
+from Networking.CircuitPool import circuitPool
+from Networking.ConnectionPool import connectionPool
+from Networking.OR import CircuitBuildError, onionRouter
+from Networking.RoutingState import routingState
+from Utils import EventBus
+from Utils.EventBus import eventBus
+
+
+class SessionManager():
+    """
+
+    Session manager keeps a session, with its own circuit and keys, for every messaging partner we are talking to,
+    indexed by the partner's node ID. Switching to a partner we already have a session with reuses its circuit, only a
+    partner without a live circuit has one built. The partner records are kept in sessions.json so partners do not have
+    to be searched for again after a restart, circuits are always built afresh
+
+    Attributes:
+        path -          File the partner records are kept in, inside the node's data directory
+        maxSessions -   Number of sessions kept, the least recently used idle session is closed to make room
+        sessions -      Sessions by partner node ID, least recently used first. Loaded from file on first use
+        current -       Node ID of the partner messages are sent to when no partner is named
+
+    """
+
+    path = "sessions.json"
+    maxSessions = 500
+
+    def __init__(self, onionRouter=onionRouter, routingState=routingState, circuitPool=circuitPool, eventBus=eventBus,
+                 dataDir=".", connectionPool=connectionPool):
+        self.onionRouter = onionRouter
+        self.routingState = routingState
+        self.circuitPool = circuitPool
+        self.eventBus = eventBus
+        self.connectionPool = connectionPool
+        self.path = os.path.join(dataDir, self.path)
+        self.sessions = None
+        self.current = None
+
+    # The sessions are read from file the first time they are needed
+    def table(self):
+        if self.sessions is None:
+            self.sessions = OrderedDict()
+            if Path(self.path).is_file():
+                with open(self.path, "r") as f:
+                    contents = json.loads(f.read())
+                for partner in contents['partners']:
+                    self.sessions[partner['nodeid']] = Session(partner)
+                self.current = contents['current']
+        return self.sessions
+
+    def save(self):
+        contents = {"current": self.current, "partners": [session.partner for session in self.table().values()]}
+        with open(self.path, "w+") as f:
+            f.write(json.dumps(contents))
+
+    def get(self, partnerID=None):
+        return self.table().get(partnerID if partnerID is not None else self.current)
+
+    """
+    open()
+
+    Makes a partner the current messaging partner, opening a session for them if we do not have one. A circuit is only
+    built if the session has no live circuit and no build running. Returns a Deferred that fires with the session once
+    its circuit is established
+
+    Arguments
+    partner (user): Takes the user record of the messaging partner
+
+    """
+
+    def open(self, partner):
+        sessions = self.table()
+        session = sessions.get(partner['nodeid'])
+        if session is None:
+            session = Session(partner)
+            sessions[session.partnerID()] = session
+            self.evict()
+        else:
+            # The partner may have moved since we last spoke to them
+            session.partner = partner
+        self.current = session.partnerID()
+        self.save()
+        return self.select(self.current)
+
+    # Switch to a partner we already have a session with. Returns a Deferred that fires with the session once its circuit is established
+    def select(self, partnerID):
+        session = self.table()[partnerID]
+        self.sessions.move_to_end(partnerID)
+        self.current = partnerID
+        session.touch()
+        self.eventBus.publish(EventBus.SESSION_SELECTED, session)
+        if session.isReady():
+            return succeed(session)
+        # Every caller gets its own Deferred, callers waiting on the same build share the circuit it produces
+        waiting = Deferred()
+        session.waiting.append(waiting)
+        if session.building is None:
+            self.build(session)
+        return waiting
+
+    """
+    build()
+
+    Builds a new circuit for a session. A warm circuit from the circuit pool only needs the partner's key, otherwise
+    the circuit is built from scratch. A CIRCUIT_CHANGED event is published once the build finishes either way, the
+    build fails straight away when too few relays are available
+
+    Arguments
+    session (Session): Takes the session that needs a circuit
+
+    """
+
+    def build(self, session):
+        logging.info("ONION ROUTING START")
+        partner = session.partnerHop()
+        circuit = self.circuitPool.take(exclude=[partner])
+        if circuit is not None:
+            building = self.onionRouter.attachRecipient(circuit, partner)
+        else:
+            try:
+                circuit = self.onionRouter.constructRoute(self.routingState.table().toDict(), partner)
+                building = self.onionRouter.exchangeKeys(circuit)
+            except CircuitBuildError:
+                circuit = session.circuit
+                building = fail()
+        session.circuit = circuit
+        session.building = building
+        building.addCallbacks(self.circuitBuilt, self.circuitNotBuilt, callbackArgs=(session,), errbackArgs=(session,))
+        logging.info("ONION ROUTING END")
+        return building
+
+    def circuitBuilt(self, circuit, session):
+        session.building = None
+        waiting, session.waiting = session.waiting, []
+        self.eventBus.publish(EventBus.CIRCUIT_CHANGED, session, True)
+        for d in waiting:
+            d.callback(session)
+
+    def circuitNotBuilt(self, failure, session):
+        session.building = None
+        waiting, session.waiting = session.waiting, []
+        logging.error("Circuit to " + session.partner['user'] + " failed " + failure.getErrorMessage())
+        self.eventBus.publish(EventBus.CIRCUIT_CHANGED, session, False)
+        for d in waiting:
+            d.errback(failure)
+
+    """
+    send()
+
+    Onion encrypts a message and sends its cells to the first hop of the circuit to a messaging partner. A new circuit
+    is built for the session once its circuit has expired. If the circuit expired while the session sat idle, or its
+    last build failed, a new circuit is built and the message is sent once it is established. Returns a Deferred that
+    fires with the session once the message has been sent. A ValueError is raised if there is no session with the partner
+
+    Arguments
+    message (string): Takes the message in plaintext
+    partnerID (string): Takes the node ID of the messaging partner, None for the current partner
+
+    """
+
+    def send(self, message, partnerID=None):
+        session = self.get(partnerID)
+        if session is None:
+            raise ValueError("No session with a messaging partner, search for one first")
+        if session.isReady():
+            return succeed(self.sendCells(session, message))
+
+        waiting = Deferred()
+        session.waiting.append(waiting)
+        if session.building is None:
+            logging.info("No usable circuit to " + session.partner['user'] + ", building a new one before sending")
+            self.build(session)
+        return waiting.addCallback(self.sendCells, message)
+
+    def sendCells(self, session, message):
+        circuit = session.circuit
+        encryptedMessages = self.onionRouter.encryptMsgForOnionRouting(circuit, message)
+        logging.info("Sending Message in " + str(len(encryptedMessages)) + " cells")
+
+        # Send the onion cells to the first hop of the circuit over the connection pool
+        for onionMessage in encryptedMessages:
+            self.connectionPool.send(circuit.hops[0]['ip'], int(circuit.hops[0]['port']), MessageFactory(onionMessage))
+        session.sent += 1
+        session.touch()
+        self.sessions.move_to_end(session.partnerID())
+
+        # The circuit is kept for the next message, only build a fresh one once it has expired
+        if circuit.isExpired():
+            logging.info("Onion circuit to " + session.partner['user'] + " expired, building a new one")
+            self.build(session)
+        return session
+
+    # A relay of our circuits has left the ring, sessions whose circuit passes through it get a new circuit straight away
+    def relayLeft(self, node):
+        for session in self.table().values():
+            if session.circuit is None or session.building is not None:
+                continue
+            if any((hop['ip'], str(hop['port'])) == (node['ip'], str(node['port'])) for hop in session.circuit.hops[:-1]):
+                logging.info("A relay of the circuit to " + session.partner['user'] + " left the ring, rebuilding it")
+                self.build(session)
+
+    def close(self, partnerID):
+        if self.table().pop(partnerID, None) is not None:
+            if self.current == partnerID:
+                self.current = None
+            self.save()
+
+    # Close the least recently used sessions that are not building a circuit until we are back within maxSessions
+    def evict(self):
+        for partnerID, session in list(self.sessions.items()):
+            if len(self.sessions) <= self.maxSessions:
+                break
+            if session.building is None:
+                logging.info("Closing the idle session with " + session.partner['user'])
+                del self.sessions[partnerID]
+
+    def statistics(self):
+        sessions = self.table().values()
+        return {"sessions": len(sessions), "ready": sum(session.isReady() for session in sessions),
+                "building": sum(session.building is not None for session in sessions), "current": self.current}
+
+
+# The sessions of the default node
+sessionManager = SessionManager()
@@ -0,0 +1,181 @@
+'''
+    File name: Stabilizer.py
+    Author: Jamie Clarke
+    Date last modified: 21/04/2019
+    Python Version: 3.7
+'''
+
+import logging
+import random
+from collections import deque
+
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+
+from Utils import EventBus
+
+
+class Stabilizer():
+    """
+
+    Stabilizer runs the ring maintenance of a node, stabilization with our successor, which also notifies it of us,
+    fix-fingers and the predecessor check. A LoopingCall ticks every tickInterval seconds and runs each task once it is
+    due. Every period is jittered so the nodes of a ring do not all stabilize at once, and shortened while the ring is
+    changing so joins and failures are repaired quickly, then lengthened again once the ring is quiet.
+
+    The stabilizer also measures convergence, the time from a change to our successor list or predecessor, caused by a
+    join or a failure, until a stabilization round completes without changing either
+
+    Attributes:
+        tickInterval -      Seconds between two checks for due tasks
+        jitter -            Fraction each period is randomly lengthened or shortened by
+        churnWindow -       Seconds a change to the ring counts towards the churn rate
+        minScale -          Smallest fraction of its base interval a period is shortened to under churn
+        maxScale -          Largest multiple of its base interval a period is lengthened to on a quiet ring
+        convergencesKept -  Number of convergence times kept for the statistics
+        dhtAlgorithms -     The algorithms of the node the maintenance runs for
+        tasks -             Maps a task name to its function, base interval and the time it is next due
+        runs -              Number of times each task has run
+        churn -             Times of the ring changes within churnWindow
+        ring -              Our predecessor and successor list as of the last routing change
+        changedAt -         Time of the first ring change not yet converged, None when the ring has converged
+        convergences -      Times in seconds the ring took to converge after a change, most recent last
+        loop -              The LoopingCall while the stabilizer runs
+
+    """
+
+    tickInterval = 1
+    jitter = 0.2
+    churnWindow = 120
+    minScale = 0.25
+    maxScale = 2.0
+    convergencesKept = 100
+
+    def __init__(self, dhtAlgorithms, eventBus, reactor=reactor):
+        self.dhtAlgorithms = dhtAlgorithms
+        self.reactor = reactor
+        self.tasks = {"stabilize": [self.stabilize, dhtAlgorithms.stabilizeInterval, None],
+                      "fixFingers": [dhtAlgorithms.fixFingers, dhtAlgorithms.fixFingersInterval, None],
+                      "checkPredecessor": [dhtAlgorithms.checkPredecessor, dhtAlgorithms.checkPredecessorInterval, None]}
+        self.runs = {name: 0 for name in self.tasks}
+        self.churn = deque()
+        self.ring = None
+        self.changedAt = None
+        self.convergences = deque(maxlen=self.convergencesKept)
+        self.loop = None
+        eventBus.subscribe(EventBus.ROUTING_CHANGED, self.routingChanged)
+
+    def start(self):
+        now = self.reactor.seconds()
+        if self.dhtAlgorithms.dht.routingState.isInitialized():
+            self.ring = self.ringOf(self.dhtAlgorithms.dht.routingState.table())
+        for name, task in self.tasks.items():
+            task[2] = now + self.period(name)
+        self.loop = LoopingCall(self.tick)
+        self.loop.clock = self.reactor
+        self.loop.start(self.tickInterval, now=False)
+
+    def stop(self):
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+        self.loop = None
+
+    # Run every task that is due and schedule its next run
+    def tick(self):
+        now = self.reactor.seconds()
+        for name, task in self.tasks.items():
+            if task[2] is not None and task[2] <= now:
+                task[2] = now + self.period(name)
+                self.runs[name] += 1
+                try:
+                    task[0]()
+                except Exception:
+                    logging.exception("Ring maintenance task " + name + " failed")
+
+    """
+    scale() & period()
+
+    scale returns the multiple of its base interval every period is currently stretched to. A quiet ring is maintained
+    at maxScale, each change within churnWindow shortens the periods further down to minScale. period returns the next
+    period of a task with jitter applied
+
+    Arguments
+    name (string): Takes the name of the task
+
+    """
+
+    def scale(self):
+        now = self.reactor.seconds()
+        while self.churn and self.churn[0] <= now - self.churnWindow:
+            self.churn.popleft()
+        if not self.churn:
+            return self.maxScale
+        return max(self.minScale, 1.0 / len(self.churn))
+
+    def period(self, name):
+        return self.tasks[name][1] * self.scale() * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    # Our predecessor and the node IDs of our successor list, the part of the routing state a join or failure changes
+    def ringOf(self, fingerTable):
+        return (fingerTable.predecessor['nodeid'], tuple(node['nodeid'] for node in fingerTable.successorList()))
+
+    # Called on every routing change, finger updates do not change the ring and are not counted as churn
+    def routingChanged(self, fingerTable):
+        ring = self.ringOf(fingerTable)
+        if ring == self.ring:
+            return
+        previous, self.ring = self.ring, ring
+        if previous is None:
+            return
+
+        now = self.reactor.seconds()
+        self.churn.append(now)
+        if self.changedAt is None:
+            self.changedAt = now
+        # Stabilize sooner while the ring is changing
+        stabilize = self.tasks["stabilize"]
+        if stabilize[2] is not None:
+            stabilize[2] = min(stabilize[2], now + self.period("stabilize"))
+
+    """
+    stabilize() & stabilized()
+
+    Runs a stabilization round. If the round completes without changing the ring after a change that happened before
+    the round started, the ring has converged and the time since the change is recorded
+
+    Arguments
+    result: Takes the result of the round, unused
+    started (float): Takes the time the round started
+    ring (tuple): Takes the ring as it was when the round started
+
+    """
+
+    def stabilize(self):
+        if self.dhtAlgorithms.dht.routingState.isInitialized():
+            self.ring = self.ringOf(self.dhtAlgorithms.dht.routingState.table())
+        reply = self.dhtAlgorithms.stabilize()
+        if reply is not None:
+            reply.addCallback(self.stabilized, self.reactor.seconds(), self.ring)
+            reply.addErrback(self.stabilizeFailed)
+        return reply
+
+    def stabilized(self, result, started, ring):
+        if self.changedAt is None or self.changedAt >= started:
+            return
+        if self.ringOf(self.dhtAlgorithms.dht.routingState.table()) != ring:
+            return
+        self.convergences.append(self.reactor.seconds() - self.changedAt)
+        logging.info("Ring converged " + str(round(self.convergences[-1], 2)) + " seconds after it changed")
+        self.changedAt = None
+
+    def stabilizeFailed(self, failure):
+        logging.error("Stabilization round failed " + failure.getErrorMessage())
+
+    def statistics(self):
+        convergences = list(self.convergences)
+        return {"periods": {name: task[1] * self.scale() for name, task in self.tasks.items()},
+                "runs": dict(self.runs), "churn": len(self.churn), "converging": self.changedAt is not None,
+                "convergences": len(convergences),
+                "lastConvergence": convergences[-1] if convergences else None,
+                "meanConvergence": sum(convergences) / len(convergences) if convergences else None,
+                "maxConvergence": max(convergences) if convergences else None}
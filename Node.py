@@ -1,25 +1,46 @@
 from __future__ import print_function
 
-from twisted.internet import reactor, protocol
+import argparse
+import os
 
-from Client import Client
-from Server.Server import Server
+from twisted.internet import reactor
+
+from Networking.NodeContext import NodeContext, defaultNode
 
 '''
     File name: Node.py
     Author: Jamie Clarke
-    Date last modified: 04/04/2019
+    Date last modified: 21/04/2019
     Python Version: 3.7
 '''
 
 def main():
-    """Main method creates two processes that run on the event loop,
-     the server and the client"""
-    factory = protocol.ServerFactory()
-    factory.protocol = Server
-    # Listen on port 10000 over TCP
-    reactor.listenTCP(8000, factory)
-    reactor.callLater(0, Client.Client)
+    """Main method creates the processes that run on the event loop, the server and either the client
+     or, for headless nodes, the local control socket"""
+    parser = argparse.ArgumentParser(description="Run a node of the onion routed chat network")
+    parser.add_argument("--port", type=int, default=8000, help="TCP port the server listens on, further nodes use the ports after it")
+    parser.add_argument("--headless", action="store_true",
+                        help="Run without the Tk client, the node is driven through the control socket")
+    parser.add_argument("--control", default="control.sock", help="Unix socket the control API of a headless node listens on")
+    parser.add_argument("--nodes", type=int, default=1, help="Number of headless nodes hosted by this process")
+    parser.add_argument("--data-dir", help="Directory holding a data directory per node, node0, node1 and so on")
+    arguments = parser.parse_args()
+
+    if arguments.data_dir is None and arguments.nodes == 1:
+        node = defaultNode
+        node.start(arguments.port, arguments.control if arguments.headless else None)
+    elif not arguments.headless:
+        parser.error("--nodes and --data-dir host headless nodes, add --headless")
+    else:
+        # Every node keeps its files and control socket in its own data directory
+        for index in range(arguments.nodes):
+            node = NodeContext(os.path.join(arguments.data_dir or ".", "node" + str(index)))
+            node.start(arguments.port + index, node.path(arguments.control))
+
+    # The client module builds the Tk window, a headless node never imports it
+    if not arguments.headless:
+        from Client import Client
+        reactor.callLater(0, Client.Client)
     reactor.run()
 
 
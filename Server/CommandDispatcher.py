@@ -0,0 +1,94 @@
+'''
+    File name: CommandDispatcher.py
+    Author: Jamie Clarke
+    Date last modified: 20/03/2019
+    Python Version: 3.7
+'''
+
+import logging
+import time
+
+from Networking import MessageCodec
+
+
+class CommandDispatcher():
+    """
+
+    Command dispatcher maps message types to the methods that handle them. The message type is read from the fixed
+    header of each message so picking a handler costs one dictionary lookup no matter how large the message is.
+    Any module can register a handler for its own message types
+
+    Attributes:
+        handlers -          Maps a message type to a handler taking (protocol, fields)
+        counts -            Number of messages handled per message type
+        totalTime -         Seconds spent in each handler per message type
+        maxTime -           Slowest single call of each handler per message type
+        dropped -           Messages that could not be decoded or had no handler
+
+    """
+
+    def __init__(self):
+        self.handlers = {}
+        self.counts = {}
+        self.totalTime = {}
+        self.maxTime = {}
+        self.dropped = 0
+
+    # Register a handler for a message type, a later registration replaces an earlier one
+    def register(self, msgType, handler):
+        self.handlers[msgType] = handler
+        self.counts.setdefault(msgType, 0)
+        self.totalTime.setdefault(msgType, 0.0)
+        self.maxTime.setdefault(msgType, 0.0)
+
+    """
+    dispatch()
+
+    Decodes a message, looks up the handler for its type and calls it with the protocol the message arrived on.
+    The time taken by the handler is recorded against the message type
+
+    Arguments
+    protocol (Protocol): The connection the message arrived on, handlers use it to reply
+    data (bytes): Takes an encoded message
+
+    """
+
+    def dispatch(self, protocol, data):
+        try:
+            msgType, fields = MessageCodec.decode(data)
+        except ValueError as error:
+            logging.error("Dropping malformed message: " + str(error))
+            self.dropped += 1
+            return
+
+        handler = self.handlers.get(msgType)
+        if handler is None:
+            logging.error("No handler for message type " + MessageCodec.NAMES[msgType])
+            self.dropped += 1
+            return
+
+        start = time.perf_counter()
+        try:
+            handler(protocol, fields)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.counts[msgType] += 1
+            self.totalTime[msgType] += elapsed
+            self.maxTime[msgType] = max(self.maxTime[msgType], elapsed)
+
+    # Per command counters and timings keyed by message name, useful for debugging a busy node
+    def statistics(self):
+        stats = {}
+        for msgType in self.handlers:
+            count = self.counts[msgType]
+            stats[MessageCodec.NAMES[msgType]] = {
+                "count": count,
+                "totalTime": self.totalTime[msgType],
+                "averageTime": self.totalTime[msgType] / count if count else 0.0,
+                "maxTime": self.maxTime[msgType],
+            }
+        return stats
+
+
+# The dispatcher shared by every server connection on this node
+dispatcher = CommandDispatcher()
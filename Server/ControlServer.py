@@ -0,0 +1,112 @@
+'''
+    File name: ControlServer.py
+    Author: Jamie Clarke
+    Date last modified: 21/04/2019
+    Python Version: 3.7
+'''
+
+import inspect
+import json
+import logging
+
+from twisted.internet import protocol
+from twisted.internet.defer import maybeDeferred
+from twisted.protocols.basic import LineOnlyReceiver
+
+
+# JSON-RPC 2.0 error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+
+class ControlProtocol(LineOnlyReceiver):
+    """
+
+    Control protocol serves JSON-RPC 2.0 on the local control socket of a headless node, one request or response per
+    line. Requests are answered with the controller's operations so a script can create or join a network, search for
+    messaging partners, send a message to any of them, list or close sessions and read the node's status. Operations
+    that wait on the network answer once their Deferred fires, so responses can come back in a different order to their
+    requests and carry the request's id
+
+    Attributes:
+        methods -       Maps an RPC method name to the name of the controller method answering it
+        delimiter -     Requests and responses are separated by a newline
+        MAX_LENGTH -    Longest request line accepted
+
+    """
+
+    methods = {"create": "createNetwork", "join": "join", "search": "search", "send": "send", "status": "status",
+               "sessions": "sessions", "close": "close", "leave": "leave"}
+    delimiter = b"\n"
+    MAX_LENGTH = 64 * 1024
+
+    def __init__(self, controller):
+        self.controller = controller
+
+    def lineReceived(self, line):
+        try:
+            request = json.loads(line.decode('utf-8'))
+        except ValueError as error:
+            self.sendError(None, PARSE_ERROR, "Parse error " + str(error))
+            return
+        if not isinstance(request, dict) or not isinstance(request.get('method'), str):
+            self.sendError(None, INVALID_REQUEST, "Invalid request")
+            return
+
+        requestID = request.get('id')
+        method = self.methods.get(request['method'])
+        if method is None:
+            self.sendError(requestID, METHOD_NOT_FOUND, "Method not found " + request['method'])
+            return
+
+        # Parameters are given by name or by position and are checked against the controller method before it is called,
+        # so a TypeError raised inside the method is reported as an internal error rather than as bad parameters
+        params = request.get('params', [])
+        handler = getattr(self.controller, method)
+        try:
+            if isinstance(params, dict):
+                arguments = inspect.signature(handler).bind(**params)
+            else:
+                arguments = inspect.signature(handler).bind(*params)
+        except TypeError as error:
+            self.sendError(requestID, INVALID_PARAMS, str(error))
+            return
+        answering = maybeDeferred(handler, *arguments.args, **arguments.kwargs)
+        answering.addCallbacks(self.sendResult, self.requestFailed, callbackArgs=(requestID,), errbackArgs=(requestID,))
+
+    def sendResult(self, result, requestID):
+        self.sendResponse({"jsonrpc": "2.0", "id": requestID, "result": result})
+
+    def requestFailed(self, failure, requestID):
+        logging.error("Control request failed " + failure.getErrorMessage())
+        self.sendError(requestID, INTERNAL_ERROR, failure.getErrorMessage())
+
+    def sendError(self, requestID, code, message):
+        self.sendResponse({"jsonrpc": "2.0", "id": requestID, "error": {"code": code, "message": message}})
+
+    def sendResponse(self, response):
+        if self.transport is not None and self.connected:
+            self.sendLine(json.dumps(response).encode('utf-8'))
+
+    def lineLengthExceeded(self, line):
+        logging.error("Dropping control connection, request of " + str(len(line)) + " bytes is too long")
+        self.transport.loseConnection()
+
+
+class ControlFactory(protocol.ServerFactory):
+    """
+
+    Builds a control protocol for every script connecting to the control socket of a node
+
+    """
+
+    def __init__(self, controller):
+        self.controller = controller
+
+    def buildProtocol(self, addr):
+        controlProtocol = ControlProtocol(self.controller)
+        controlProtocol.factory = self
+        return controlProtocol
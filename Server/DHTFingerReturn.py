@@ -0,0 +1,20 @@
+'''
+    File name: DHTFingerReturn.py
+    Author: Jamie Clarke
+    Date last modified: 18/03/2019
+    Python Version: 3.7
+'''
+
+import logging
+
+from Networking import MessageCodec
+from Networking.ConnectionPool import PooledMessage
+
+
+class DHTFingerReturn(PooledMessage):
+    # Message type the payload is encoded as
+    msgType = MessageCodec.FINGERRETURN
+
+    # Called by the connection pool once the message has been written
+    def sent(self):
+        logging.info("Returning the node responsible for finger " + str(self.data['index']))
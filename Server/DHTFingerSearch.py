@@ -0,0 +1,26 @@
+'''
+    File name: DHTFingerSearch.py
+    Author: Jamie Clarke
+    Date last modified: 18/03/2019
+    Python Version: 3.7
+'''
+
+import logging
+
+from Networking import MessageCodec
+from Networking.ConnectionPool import PooledMessage
+
+
+class DHTFingerSearch(PooledMessage):
+    """
+
+    DHT Finger Search asks another node to find the successor of a position on the ring. Used by the fix-fingers pass
+
+    """
+
+    # Message type the payload is encoded as
+    msgType = MessageCodec.FINDFINGER
+
+    # Called by the connection pool once the message has been written
+    def sent(self):
+        logging.info("Forwarding a finger lookup for finger " + str(self.data['index']))
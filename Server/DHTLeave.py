@@ -0,0 +1,27 @@
+'''
+    File name: DHTLeave.py
+    Author: Jamie Clarke
+    Date last modified: 21/04/2019
+    Python Version: 3.7
+'''
+
+import logging
+
+from Networking import MessageCodec
+from Networking.ConnectionPool import PooledMessage
+
+
+class DHTLeave(PooledMessage):
+    """
+    DHT Leave tells one of our neighbours that we are leaving the ring, with our predecessor, successor list and the
+    user records we have cached so it can splice the ring together. The neighbour answers with LEFT on the same
+    connection. The message is sent over the connection pool
+    """
+
+    # Message type the payload is encoded as
+    msgType = MessageCodec.LEAVE
+    expectsReply = True
+
+    # Called by the connection pool once the message has been written
+    def sent(self):
+        logging.info("Telling a neighbour we are leaving the ring")
@@ -0,0 +1,20 @@
+'''
+    File name: DHTNotFound.py
+    Author: Jamie Clarke
+    Date last modified: 21/04/2019
+    Python Version: 3.7
+'''
+
+import logging
+
+from Networking import MessageCodec
+from Networking.ConnectionPool import PooledMessage
+
+
+class DHTNotFound(PooledMessage):
+    # Message type the payload is encoded as
+    msgType = MessageCodec.NOTFOUND
+
+    # Called by the connection pool once the message has been written
+    def sent(self):
+        logging.info("Telling the originator request " + str(self.data['rid']) + " could not be answered")
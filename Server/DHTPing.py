@@ -0,0 +1,26 @@
+'''
+    File name: DHTPing.py
+    Author: Jamie Clarke
+    Date last modified: 21/04/2019
+    Python Version: 3.7
+'''
+
+import logging
+
+from Networking import MessageCodec
+from Networking.ConnectionPool import PooledMessage
+
+
+class DHTPing(PooledMessage):
+    """
+    DHT Ping checks that a node is still alive, the node answers with a PONG on the same connection. The message is
+    sent over the connection pool
+    """
+
+    # Message type the payload is encoded as
+    msgType = MessageCodec.PING
+    expectsReply = True
+
+    # Called by the connection pool once the message has been written
+    def sent(self):
+        logging.debug("Checking a node is alive")
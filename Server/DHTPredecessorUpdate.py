@@ -7,35 +7,14 @@
 
 import logging
 
-from twisted.internet.protocol import ClientFactory, Protocol
+from Networking import MessageCodec
+from Networking.ConnectionPool import PooledMessage
 
 
-class DHTPredecessorUpdateProtocol(Protocol):
-
-    def connectionMade(self):
-        # Grab the message that is being stored in the factory class
-        data = self.factory.data
-
-        # Append our network command to the message
-        msgCMD = "==UPDATEPREDECESSOR=="
-
-        # Convert our message to string and then convert the string to bytes
-        msg = msgCMD + str(data)
-        messageToSend = bytes(msg, 'utf-8')
-
-        # Write our message over the established TCP transport
-        self.transport.write(messageToSend)
+class DHTPredecessorUpdate(PooledMessage):
+    # Message type the payload is encoded as
+    msgType = MessageCodec.UPDATEPREDECESSOR
 
+    # Called by the connection pool once the message has been written
+    def sent(self):
         logging.info("Sending a DHT update to our predecessor")
-
-    def dataReceived(self, data):
-        logging.info("DHT has been updated")
-
-
-class DHTPredecessorUpdate(ClientFactory):
-    # Instantiate the protocol
-    protocol = DHTPredecessorUpdateProtocol
-
-    # On initialize of the factory class data passed is stored to a local variable
-    def __init__(self, data):
-        self.data = data
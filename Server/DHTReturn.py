@@ -4,33 +4,17 @@
     Date last modified: 18/03/2019
     Python Version: 3.7
 '''
-import logging
-
-from twisted.internet.protocol import ClientFactory, Protocol
 
+import logging
 
-class DHTReturnProtocol(Protocol):
-
-    def connectionMade(self):
-        # Grab the message that is being stored in the factory class
-        data = self.factory.data
+from Networking import MessageCodec
+from Networking.ConnectionPool import PooledMessage
 
-        # Append our network command to the message
-        msgCMD = "==REGISTERRETURN=="
 
-        # Convert our message to string and then convert the string to bytes
-        msg = msgCMD + str(data)
-        messageToSend = bytes(msg, 'utf-8')
+class DHTReturn(PooledMessage):
+    # Message type the payload is encoded as
+    msgType = MessageCodec.REGISTERRETURN
 
-        # Write our message over the established TCP transport
-        self.transport.write(messageToSend)
+    # Called by the connection pool once the message has been written
+    def sent(self):
         logging.info("Sending DHT information back to the person who requested")
-
-
-class DHTReturn(ClientFactory):
-    # Instantiate the protocol
-    protocol = DHTReturnProtocol
-
-    # On initialize of the factory class data passed is stored to a local variable
-    def __init__(self, data):
-        self.data = data
@@ -0,0 +1,26 @@
+'''
+    File name: DHTStabilize.py
+    Author: Jamie Clarke
+    Date last modified: 21/04/2019
+    Python Version: 3.7
+'''
+
+import logging
+
+from Networking import MessageCodec
+from Networking.ConnectionPool import PooledMessage
+
+
+class DHTStabilize(PooledMessage):
+    """
+    DHT Stabilize carries our user record to our successor, which answers on the same connection with its predecessor
+    and successor list. The message is sent over the connection pool
+    """
+
+    # Message type the payload is encoded as
+    msgType = MessageCodec.STABILIZE
+    expectsReply = True
+
+    # Called by the connection pool once the message has been written
+    def sent(self):
+        logging.info("Asking our successor for its successor list")
@@ -4,16 +4,19 @@
     Date last modified: 20/03/2019
     Python Version: 3.7
 '''
-import ast
-import json
 import logging
+from collections import deque
 
 from twisted.internet import protocol
+from twisted.internet.defer import succeed
 
-from Encryption.AsymmetricEncryption import AsymmetricEncryption
+from Networking import MessageCodec, RequestRoute
 from Networking.DHTAlgorithm import DHTAlgoirthm
-from Networking.OR import OR
-from Utils import StateChecks
+from Networking.FramedProtocol import FramedProtocol
+from Networking.OR import onionRouter
+from Server.CommandDispatcher import dispatcher
+from Utils import EventBus, StateChecks
+from Utils.EventBus import eventBus
 
 # Configure the logger
 logging.basicConfig(
@@ -26,138 +29,213 @@ logging.basicConfig(
 logger = logging.getLogger(),
 
 """
-Server class handles incoming requests over the network
+Server class handles incoming requests over the network. Messages are length prefixed so a peer can pipeline many of them over one pooled connection.
+The pool matches replies to requests in the order it sent them, so every reply is queued on the connection and only written once the replies to
+earlier requests have been written, even when an earlier reply is still waiting on the crypto pool
 Attributes:
     debuggingWindow -       Allows loggging to be displayed in the tkinter UI to the user
+    dispatcher -            Maps each message type to the method that handles it
     dhtAlgorithms -         Instantiates DHT Algorithms used for handling DHT network requests
     initialChecks -         Utility library that determines that state of server on launch
     onionRouter -           Instantiates an onion router for routing requests
+    eventBus -              Tells the rest of the node about state changes caused by incoming requests
+    replies -               Replies of this connection in request order, each one a flag set once it is ready and its message
+These belong to the default node, a ServerFactory replaces them with the ones of the node it serves
 """
 
-class Server(protocol.Protocol):
+class Server(FramedProtocol):
     # Instantiations and creation of debugging logger
     debuggingWindow = logging.getLogger("1")
+    dispatcher = dispatcher
     dhtAlgorithms = DHTAlgoirthm()
     initialChecks = StateChecks
-    onionRouter = OR()
+    onionRouter = onionRouter
+    eventBus = eventBus
 
     logging.info("Server has been initialized!")
 
+    def connectionMade(self):
+        self.replies = deque()
+
     # Determine if a DHT has been initialized previously on this PC
     if (initialChecks.checkDHTInitialized()):
         dhtAlgorithms.dht.loadDHTInformation()
 
-    # The core of the server module. Callback for when data is recieved. Determines which network command is present and executes the associated method
-    def dataReceived(self, data):
+    # The core of the server module. Callback for when a whole length prefixed message is recieved. The dispatcher reads the message type from the header and calls the associated method
+    def stringReceived(self, data):
         logging.info("Node connecting")
-        debuggingWindow = logging.getLogger("1")
-        debuggingWindow.info("Incoming Data")
-        data = data.decode('utf-8')
-        logging.info(data)
-
-        # Determine which network command is present from the protocol
-        if "==REGISTER==" in data:
-            # A request has been recieved to bootstrap a new node into the network. Perform a search to determine if this request can be satified by the local node
-            debuggingWindow.info("Node registered")
-            self.dhtAlgorithms.DHTPositionSearch(data)
-
-        elif "==CREATE==" in data:
-            # Call onionrouter to save this AES key. Register the current node as a onion router
-
-            debuggingWindow.info("Recieved a symmetric key")
-            transport = self.transport.getPeer().host
-            self.onionRouter.recieveORKey(data, transport)
-
-            # Send ACK
-            reply = "==KEYRECIEVED=="
-            self.transport.write(reply.encode('utf=8'))
-
-
-        elif "==UPDATESUCCESSOR==" in data:
-            # A network stabilisation request has notified us that our successor has changed. The new successor is included within the data variable
-            debuggingWindow.info("Another node is updating our successor")
-            # Remove the network command from the message
-            data = data.replace('==UPDATESUCCESSOR==', '')
-            data = data.replace('\'', '"')
-            data = json.loads(data)
-
-            # Use DHT algorithms instantiation of the DHT class to update the successor
-            self.dhtAlgorithms.dht.updateSuccessor(data)
-
-
-        elif "==UPDATEPREDECESSOR==" in data:
-            # A network stabilisation request has notified us that our predecessor has changed. The new predecessor is included within the data variable
-            debuggingWindow.info("Another node is updating our predecessor")
-            # Remove the network command from the message
-            data = data.replace('==UPDATEPREDECESSOR==', '')
-            data = data.replace('\'', '"')
-            data = json.loads(data)
-
-            # Use DHT algorithms instantiation of the DHT class to update the predecessor
-            self.dhtAlgorithms.dht.updatePredecessor(data)
-
-
-        elif "==REGISTERRETURN==" in data:
-            # The bootstrapping process has been completed. A node on the DHT successfully postioned the node and has returned a copy of the local nodes routing table
-            debuggingWindow.info("DHT RETURN FROM A LONG RANGE NODE")
-            # Replace the network command
-            data = data.replace('==REGISTERRETURN==', '')
-            data = data.replace('\'', '"')
-            data = json.loads(data)
-            # Load the received network information into our local DHT class
-            self.dhtAlgorithms.dht.DHTPackageFromExternalNode(data)
-
-
-
-        elif "==SEARCHRETURN==" in data:
-            # A search for a users contact information on the network has been returned. You are now capable of messaging that user
-            debuggingWindow.info(
-                "A node has found the user from your search and has returned it to you. Messaging now enabled")
-            # Replace the network commmand
-            data = data.replace("==SEARCHRETURN==", '')
-            data = data.replace('\'', '"')
-            data = json.loads(data)
-            # Outsource the configuration process of establishing a messaging session with our messaging partner to the DHT class
-            self.dhtAlgorithms.dht.DHTSearchReturn(data)
-
-        elif "==SEARCH==" in data:
-            # A request has been recieved to search our local storage for a SHA256 value
-            debuggingWindow.info("REQUEST RECEIVED FOR A SEARCH OF OUR STORAGE")
-            data = data.replace("==SEARCH==", '')
-
-            self.dhtAlgorithms.DHTInformationSearch(data)
-
-        # If no networking command is present then this implies it is an onion circuit message
-        else:
-            debuggingWindow.info("Onion Networking")
-            asymmetricEncryption = AsymmetricEncryption()
-            reencoded = {}
-            reencoded['CMD'] = "None"
-
-            # Try RSA decryption
-            try:
-                reencoded = ast.literal_eval(data)
-                reencoded['CMD'] = asymmetricEncryption.decrypt("t", reencoded['CMD'])
-                reencoded['CMD'] = reencoded['CMD'].decode('utf-8')
-
-            # Message is not encoded with RSA, means it an onion message
-            except:
-                # Return the reencoded variable back to its initial state
-                reencoded = {}
-                reencoded['CMD'] = "None"
-                logging.info("Not encrypted with RSA")
-
-            # Check if the encrypted message is a RSA encrypted onion key
-
-            if "==CREATE==" in reencoded['CMD']:
-                debuggingWindow.info("Recieved a symmetric key")
-                transport = self.transport.getPeer().host
-                self.onionRouter.recieveORKey(reencoded, transport)
-
-                # Send ACK
-                reply = "==KEYRECIEVED=="
-                self.transport.write(reply.encode('utf=8'))
-
-            # Message is not encrypted with RSA means it must be an AES onion message
-            else:
-                self.onionRouter.router(data)
+        self.debuggingWindow.info("Incoming Data")
+        self.dispatcher.dispatch(self, data)
+
+    """
+    queueReply(), replyReady() & replyFailed()
+
+    queueReply takes the place of the reply to a request in the connection's reply queue. Replies are written from the
+    front of the queue as soon as they are ready, so a PONG answered straight away never overtakes a KEYRECIEVED still
+    waiting on its RSA decrypt. A reply that fails drops the connection, the pool fails every request still waiting on it
+
+    Arguments
+    reply (Deferred): Takes a Deferred that fires with the encoded reply
+    message (bytes): Takes the encoded reply
+    entry (list): Takes the place of the reply in the queue
+
+    """
+
+    def queueReply(self, reply):
+        entry = [False, None]
+        self.replies.append(entry)
+        reply.addCallbacks(self.replyReady, self.replyFailed, callbackArgs=(entry,), errbackArgs=(entry,))
+
+    def replyReady(self, message, entry):
+        entry[0], entry[1] = True, message
+        while self.replies and self.replies[0][0]:
+            self.sendString(self.replies.popleft()[1])
+
+    def replyFailed(self, failure, entry):
+        logging.error("Could not answer request " + str(failure.getErrorMessage()))
+        self.replies.clear()
+        self.transport.loseConnection()
+
+    """
+    Message handlers
+
+    Each method below handles one message type and is registered with the dispatcher at the bottom of this file.
+    They take the decoded message fields as a dictionary
+
+    """
+
+    def registerReceived(self, data):
+        # A request has been recieved to bootstrap a new node into the network. Perform a search to determine if this request can be satified by the local node
+        self.debuggingWindow.info("Node registered")
+        incomingNode, route = RequestRoute.split(data)
+        self.dhtAlgorithms.DHTPositionSearch(incomingNode, route)
+
+    def createReceived(self, data):
+        # Call onionrouter to save this AES key. Register the current node as a onion router
+        self.debuggingWindow.info("Recieved a symmetric key")
+        transport = self.transport.getPeer().host
+        # Send ACK once the key has been decrypted and stored, so no onion cell can arrive ahead of its key
+        # If the key cannot be decrypted no ACK is sent, the sender's key exchange fails when the connection is closed
+        self.queueReply(self.onionRouter.recieveORKey(data, transport).addCallback(self.keyStored))
+
+    def keyStored(self, result):
+        return MessageCodec.encode(MessageCodec.KEYRECIEVED, {'capacity': self.onionRouter.spareCapacity()})
+
+    def create2Received(self, data):
+        # An X25519 circuit handshake, cheap enough to answer on the reactor thread
+        self.debuggingWindow.info("Recieved a circuit handshake")
+        transport = self.transport.getPeer().host
+        try:
+            serverPublic = self.onionRouter.recieveHandshake(data, transport)
+        except (OSError, ValueError) as error:
+            logging.error("Could not answer circuit handshake " + str(error))
+            self.transport.loseConnection()
+            return
+        self.queueReply(succeed(MessageCodec.encode(MessageCodec.CREATED2, {'handshake': serverPublic, 'capacity': self.onionRouter.spareCapacity()})))
+
+    def updateSuccessorReceived(self, data):
+        # A network stabilisation request has notified us that our successor has changed. The new successor is included within the data variable
+        self.debuggingWindow.info("Another node is updating our successor")
+        # Use DHT algorithms instantiation of the DHT class to update the successor
+        self.dhtAlgorithms.dht.updateSuccessor(data)
+
+    def updatePredecessorReceived(self, data):
+        # A network stabilisation request has notified us that our predecessor has changed. The new predecessor is included within the data variable
+        self.debuggingWindow.info("Another node is updating our predecessor")
+        # Use DHT algorithms instantiation of the DHT class to update the predecessor
+        self.dhtAlgorithms.dht.updatePredecessor(data)
+
+    def registerReturnReceived(self, data):
+        # The bootstrapping process has been completed. A node on the DHT successfully postioned the node and has returned a copy of the local nodes routing table
+        self.debuggingWindow.info("DHT RETURN FROM A LONG RANGE NODE")
+        # Load the received network information into our local DHT class
+        self.dhtAlgorithms.dht.DHTPackageFromExternalNode(data)
+        # Populate the whole finger table now that we know where we sit in the ring
+        self.dhtAlgorithms.fixFingers(self.dhtAlgorithms.dht.fingerTable.fingerCount)
+
+    def findFingerReceived(self, data):
+        # Another node is fixing its fingers and wants the successor of a position on the ring
+        self.debuggingWindow.info("Finger lookup received")
+        self.dhtAlgorithms.DHTFingerSearch(*RequestRoute.split(data))
+
+    def fingerReturnReceived(self, data):
+        # A finger lookup we started has been answered
+        self.debuggingWindow.info("Finger lookup returned")
+        self.dhtAlgorithms.DHTFingerReturn(data)
+
+    def searchReturnReceived(self, data):
+        # A search for a users contact information on the network has been returned. You are now capable of messaging that user
+        self.debuggingWindow.info(
+            "A node has found the user from your search and has returned it to you. Messaging now enabled")
+        self.eventBus.publish(EventBus.PARTNER_FOUND, data)
+        # Outsource the configuration process of establishing a messaging session with our messaging partner to the DHT class
+        self.dhtAlgorithms.dht.DHTSearchReturn(data)
+
+    def searchReceived(self, data):
+        # A request has been recieved to search our local storage for a SHA256 value
+        self.debuggingWindow.info("REQUEST RECEIVED FOR A SEARCH OF OUR STORAGE")
+        self.dhtAlgorithms.DHTInformationSearch(*RequestRoute.split(data))
+
+    def stabilizeReceived(self, data):
+        # Our predecessor is checking that we are alive, answer with our predecessor and successor list
+        self.debuggingWindow.info("Stabilization request received")
+        self.queueReply(succeed(MessageCodec.encode(MessageCodec.SUCCESSORS, self.dhtAlgorithms.stabilizeReceived(data))))
+
+    def pingReceived(self, data):
+        # Another node is checking that we are alive
+        self.queueReply(succeed(MessageCodec.encode(MessageCodec.PONG, {})))
+
+    def leaveReceived(self, data):
+        # A neighbour is leaving the ring, splice it out and acknowledge so it can exit
+        self.debuggingWindow.info("A neighbour is leaving the ring")
+        self.dhtAlgorithms.leaveReceived(data)
+        self.queueReply(succeed(MessageCodec.encode(MessageCodec.LEFT, {})))
+
+    def notFoundReceived(self, data):
+        # A request we started used its hop budget or looped without being answered
+        self.debuggingWindow.info("A request could not be answered by the network")
+        self.dhtAlgorithms.requestNotFound(data)
+
+    def onionReceived(self, data):
+        # An AES encrypted onion message, peel our layer and forward or display it
+        self.debuggingWindow.info("Onion Networking")
+        self.onionRouter.router(data['circid'], data['seq'], data['cell'])
+
+
+class ServerFactory(protocol.ServerFactory):
+    """
+
+    Builds the server protocol for a node. Every connection is handed the node's DHT algorithms, onion router and event
+    bus so many nodes can listen on different ports of the same process without sharing routing or circuit state
+
+    """
+
+    protocol = Server
+
+    def __init__(self, node):
+        self.node = node
+
+    def buildProtocol(self, addr):
+        server = protocol.ServerFactory.buildProtocol(self, addr)
+        server.dhtAlgorithms = self.node.dhtAlgorithms
+        server.onionRouter = self.node.onionRouter
+        server.eventBus = self.node.eventBus
+        return server
+
+
+# Register the server's handlers, other modules register their own message types the same way
+dispatcher.register(MessageCodec.REGISTER, Server.registerReceived)
+dispatcher.register(MessageCodec.CREATE, Server.createReceived)
+dispatcher.register(MessageCodec.CREATE2, Server.create2Received)
+dispatcher.register(MessageCodec.UPDATESUCCESSOR, Server.updateSuccessorReceived)
+dispatcher.register(MessageCodec.UPDATEPREDECESSOR, Server.updatePredecessorReceived)
+dispatcher.register(MessageCodec.REGISTERRETURN, Server.registerReturnReceived)
+dispatcher.register(MessageCodec.FINDFINGER, Server.findFingerReceived)
+dispatcher.register(MessageCodec.FINGERRETURN, Server.fingerReturnReceived)
+dispatcher.register(MessageCodec.SEARCHRETURN, Server.searchReturnReceived)
+dispatcher.register(MessageCodec.SEARCH, Server.searchReceived)
+dispatcher.register(MessageCodec.ONION, Server.onionReceived)
+dispatcher.register(MessageCodec.NOTFOUND, Server.notFoundReceived)
+dispatcher.register(MessageCodec.STABILIZE, Server.stabilizeReceived)
+dispatcher.register(MessageCodec.PING, Server.pingReceived)
+dispatcher.register(MessageCodec.LEAVE, Server.leaveReceived)
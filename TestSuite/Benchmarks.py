@@ -0,0 +1,96 @@
+'''
+    File name: Benchmarks.py
+    Author: Jamie Clarke
+    Date last modified: 18/03/2019
+    Python Version: 3.7
+'''
+
+import ast
+import json
+import sys
+import timeit
+
+sys.path.append("..")
+
+from cryptography.fernet import Fernet
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+
+from Encryption.AsymmetricEncryption import AsymmetricEncryption
+from Encryption.CircuitHandshake import CircuitHandshake
+from Encryption.Keyring import Keyring
+from Networking import MessageCodec, RequestRoute
+
+"""
+
+Micro benchmarks for hot paths on a node. Run from the TestSuite directory with python Benchmarks.py
+
+"""
+
+USER = {"ip": "192.168.0.10", "port": "8000", "user": "Alice",
+        "nodeid": "3bc51062973c458d5a6f2d8d64a023246354ad7e064b1e4e009ec8a0699a3043",
+        "publickey": "-----BEGIN PUBLIC KEY-----\n" + "A" * 730 + "\n-----END PUBLIC KEY-----\n"}
+# Requests forwarded around the ring carry a route
+ROUTE = RequestRoute.new()
+REGISTER = dict(USER, **ROUTE)
+SEARCH = dict({"username": USER['nodeid'], "ip": "192.168.0.10", "port": "8000"}, **ROUTE)
+
+
+# Print operations per second for a function run the given number of times
+def report(name, function, number=20000):
+    seconds = min(timeit.repeat(function, number=number, repeat=3))
+    print("{0:<45} {1:>12,.0f} ops/s".format(name, number / seconds))
+
+
+# Compare the binary codec against the str(dict) based wire format it replaced
+def benchmarkCodec():
+    legacyRegister = bytes("==REGISTER==" + str(USER), 'utf-8')
+    legacySearch = bytes("==SEARCH==" + str(SEARCH), 'utf-8')
+    binaryRegister = MessageCodec.encode(MessageCodec.REGISTER, REGISTER)
+    binarySearch = MessageCodec.encode(MessageCodec.SEARCH, SEARCH)
+
+    print("REGISTER is " + str(len(legacyRegister)) + " bytes as str(dict), " + str(len(binaryRegister)) + " bytes binary")
+    print("SEARCH is " + str(len(legacySearch)) + " bytes as str(dict), " + str(len(binarySearch)) + " bytes binary")
+
+    report("REGISTER encode str(dict)", lambda: bytes("==REGISTER==" + str(USER), 'utf-8'))
+    report("REGISTER encode binary", lambda: MessageCodec.encode(MessageCodec.REGISTER, REGISTER))
+    report("REGISTER decode quote replace + json.loads",
+           lambda: json.loads(legacyRegister.decode('utf-8').replace('==REGISTER==', '').replace('\'', '"')))
+    report("REGISTER decode binary", lambda: MessageCodec.decode(binaryRegister))
+    report("SEARCH encode str(dict)", lambda: bytes("==SEARCH==" + str(SEARCH), 'utf-8'))
+    report("SEARCH encode binary", lambda: MessageCodec.encode(MessageCodec.SEARCH, SEARCH))
+    report("SEARCH decode ast.literal_eval",
+           lambda: ast.literal_eval(legacySearch.decode('utf-8').replace('==SEARCH==', '')))
+    report("SEARCH decode binary", lambda: MessageCodec.decode(binarySearch))
+
+
+# Compare the per hop circuit handshakes. RSA encrypts a Fernet key to the hop which decrypts it, X25519 runs both
+# sides of the CREATE2/CREATED2 exchange
+def benchmarkHandshake():
+    # Keys are only held in a private keyring so running the benchmark does not overwrite the key files
+    asymmetricEncryption = AsymmetricEncryption()
+    asymmetricEncryption.keyring = Keyring()
+    asymmetricEncryption.keyring.setPrivateKey(rsa.generate_private_key(public_exponent=65537, key_size=4096, backend=default_backend()))
+    publicKey = asymmetricEncryption.getPublicKey().decode("utf-8")
+    circuitKey = Fernet.generate_key()
+
+    handshake = CircuitHandshake()
+    identity = X25519PrivateKey.generate()
+    identityPublic = identity.public_key()
+
+    def rsaHandshake():
+        asymmetricEncryption.decrypt(None, asymmetricEncryption.encrypt(publicKey, circuitKey))
+
+    def x25519Handshake():
+        ephemeral, clientPublic = handshake.clientStart()
+        serverPublic, key = handshake.server(identity, clientPublic, 1)
+        handshake.clientFinish(ephemeral, identityPublic, serverPublic, 1)
+
+    report("Circuit handshake RSA-4096 OAEP", rsaHandshake, 50)
+    report("Circuit handshake X25519 + HKDF", x25519Handshake, 2000)
+
+
+if __name__ == '__main__':
+    benchmarkCodec()
+    benchmarkHandshake()
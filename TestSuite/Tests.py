@@ -1,17 +1,51 @@
 import os
+import shutil
+import tempfile
+import time
 from pathlib import Path
 
 import Networking
 from Client import Client
 from Encryption.AsymmetricEncryption import AsymmetricEncryption
+from Encryption.CircuitHandshake import CircuitHandshake
+from Encryption.CryptoPool import CryptoPool, CryptoPoolFull
+from Encryption.Keyring import Keyring
 from Encryption.SymmetricEncryption import SymmetricEncryption
 from Models.User import User
 import json
 from unittest import TestCase
 
-from Networking.OR import OR
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PublicKey
+
+from twisted.internet.defer import Deferred, fail, succeed
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+from twisted.internet.testing import MemoryReactorClock, StringTransport
+
+from Client.MessageFactory import MessageFactory
+from Models.Circuit import Circuit
+from Models.FingerTable import FingerTable
+from Networking import MessageCodec, OnionCell, RequestRoute
+from Networking.CircuitPool import CircuitPool
+from Networking.FailureDetector import FailureDetector
+from Networking.ConnectionPool import ConnectionPool, connectionPool
+from Networking.FramedProtocol import FramedProtocol
+from Networking.LookupCache import LookupCache
+from Networking.NodeContext import NodeContext
+from Networking.OR import OR, CircuitBuildError
+from Networking.PathSelection import PathSelector
+from Networking.RoutingState import RoutingState
+from Networking.SessionManager import SessionManager
+from Networking.Stabilizer import Stabilizer
+from Server.CommandDispatcher import CommandDispatcher
+from Server.ControlServer import ControlProtocol, INTERNAL_ERROR, INVALID_PARAMS, METHOD_NOT_FOUND, PARSE_ERROR
+from Server.Server import Server
+from Networking import DHTAlgorithm
 from Networking.DHT import DHT
-from Utils.StateChecks import checkDHTInitialized, checkSessionExists
+from Utils import EventBus
+from Utils.EventBus import eventBus
+from Utils.StateChecks import checkDHTInitialized
 from Utils.Utils import Utils
 
 
@@ -50,6 +84,190 @@ class TestDHT(TestCase):
 
 
 
+class TestRoutingState(TestCase):
+    def setUp(self):
+        self.clock = MemoryReactorClock()
+        self.state = RoutingState(reactor=self.clock)
+        self.state.path = "RoutingStateTest.json"
+        self.state.writeDelay = 5
+
+    def tearDown(self):
+        if os.path.exists(self.state.path):
+            os.remove(self.state.path)
+
+    def test_changesCoalesced(self):
+        self.state.table().nodeid = {"nodeid": "Trudy"}
+        self.state.changed()
+        self.state.changed()
+        self.assertFalse(os.path.exists(self.state.path))
+
+        self.clock.advance(0)
+        self.assertEqual(self.state.writes, 1)
+        self.state.table().successor = {"nodeid": "Bob"}
+        self.state.changed()
+        self.state.changed()
+
+        # A second snapshot waits out the write delay and carries both changes
+        self.clock.advance(4)
+        self.assertEqual(self.state.writes, 1)
+        self.clock.advance(1)
+        self.assertEqual(self.state.statistics(), {"changes": 4, "writes": 2, "dirty": False})
+        self.assertFalse(os.path.exists(self.state.path + ".tmp"))
+
+        reloaded = RoutingState(reactor=self.clock)
+        reloaded.path = self.state.path
+        self.assertEqual(reloaded.table().successor, {"nodeid": "Bob"})
+
+    def test_changePublished(self):
+        published = []
+        eventBus.subscribe(EventBus.ROUTING_CHANGED, published.append)
+        self.addCleanup(eventBus.unsubscribe, EventBus.ROUTING_CHANGED, published.append)
+        self.state.table().predecessor = {"nodeid": "Alice"}
+        self.state.changed()
+        self.assertEqual(published, [self.state.table()])
+
+    def test_flushWithoutChanges(self):
+        self.state.flush()
+        self.assertFalse(os.path.exists(self.state.path))
+        self.assertFalse(self.state.isInitialized())
+
+
+class TestEventBus(TestCase):
+    def setUp(self):
+        self.bus = EventBus.EventBus()
+        self.calls = []
+
+    def failing(self, *args):
+        raise RuntimeError("subscriber failed")
+
+    def test_publish(self):
+        self.bus.subscribe(EventBus.CIRCUIT_CHANGED, lambda circuit, established: self.calls.append(("first", established)))
+        self.bus.subscribe(EventBus.CIRCUIT_CHANGED, self.failing)
+        self.bus.subscribe(EventBus.CIRCUIT_CHANGED, lambda circuit, established: self.calls.append(("last", established)))
+        self.bus.publish(EventBus.CIRCUIT_CHANGED, None, True)
+        self.bus.publish(EventBus.MESSAGE_RECEIVED, "nobody listening")
+        self.assertEqual(self.calls, [("first", True), ("last", True)])
+        self.assertEqual(self.bus.statistics()['published'], {EventBus.CIRCUIT_CHANGED: 1, EventBus.MESSAGE_RECEIVED: 1})
+
+    def test_unsubscribe(self):
+        self.bus.subscribe(EventBus.MESSAGE_RECEIVED, self.calls.append)
+        self.bus.unsubscribe(EventBus.MESSAGE_RECEIVED, self.calls.append)
+        self.bus.unsubscribe(EventBus.PARTNER_FOUND, self.calls.append)
+        self.bus.publish(EventBus.MESSAGE_RECEIVED, "hello")
+        self.assertEqual(self.calls, [])
+
+
+# Stands in for the controller so control requests can be answered without a network
+class FakeController():
+    def __init__(self):
+        self.joining = Deferred()
+
+    def status(self):
+        return {"nodeid": "Trudy"}
+
+    def search(self, username):
+        raise ValueError("No other node to search, join a network first")
+
+    def join(self, bootstrapIP, bootstrapPort, ip, port, username):
+        return self.joining
+
+
+class TestControlServer(TestCase):
+    def setUp(self):
+        self.controller = FakeController()
+        self.protocol = ControlProtocol(self.controller)
+        self.transport = StringTransport()
+        self.protocol.makeConnection(self.transport)
+
+    def request(self, request):
+        self.protocol.dataReceived(json.dumps(request).encode('utf-8') + b"\n")
+
+    def responses(self):
+        lines = self.transport.value().splitlines()
+        self.transport.clear()
+        return [json.loads(line.decode('utf-8')) for line in lines]
+
+    def test_status(self):
+        self.request({"jsonrpc": "2.0", "id": 1, "method": "status"})
+        self.assertEqual(self.responses(), [{"jsonrpc": "2.0", "id": 1, "result": {"nodeid": "Trudy"}}])
+
+    def test_deferredResult(self):
+        self.request({"jsonrpc": "2.0", "id": 2, "method": "join",
+                      "params": {"bootstrapIP": "127.0.0.1", "bootstrapPort": 8000, "ip": "127.0.0.1", "port": "8001", "username": "Bob"}})
+        self.assertEqual(self.responses(), [])
+        self.controller.joining.callback({"user": "Bob"})
+        self.assertEqual(self.responses()[0]["result"], {"user": "Bob"})
+
+    def test_errors(self):
+        self.protocol.dataReceived(b"not json\n")
+        self.request({"jsonrpc": "2.0", "id": 3, "method": "shutdown"})
+        self.request({"jsonrpc": "2.0", "id": 4, "method": "search", "params": ["Alice"]})
+        self.request({"jsonrpc": "2.0", "id": 5, "method": "search", "params": {"name": "Alice"}})
+        self.request({"jsonrpc": "2.0", "id": 6, "method": "status", "params": [1]})
+        codes = [(response["id"], response["error"]["code"]) for response in self.responses()]
+        self.assertEqual(codes, [(None, PARSE_ERROR), (3, METHOD_NOT_FOUND), (4, INTERNAL_ERROR), (5, INVALID_PARAMS),
+                                 (6, INVALID_PARAMS)])
+
+    def test_internalTypeError(self):
+        # A TypeError raised inside the controller is a bug in the node, not bad parameters
+        self.controller.status = lambda: None['nodeid']
+        self.request({"jsonrpc": "2.0", "id": 7, "method": "status"})
+        self.assertEqual(self.responses()[0]["error"]["code"], INTERNAL_ERROR)
+
+
+class TriggerReactorClock(MemoryReactorClock):
+    """
+
+    MemoryReactorClock cannot remove system event triggers, this one hands out a trigger ID and removes the trigger
+    it names
+
+    """
+
+    def addSystemEventTrigger(self, phase, eventType, callable, *args, **kw):
+        MemoryReactorClock.addSystemEventTrigger(self, phase, eventType, callable, *args, **kw)
+        return (phase, eventType, (callable, args, kw))
+
+    def removeSystemEventTrigger(self, triggerID):
+        phase, eventType, trigger = triggerID
+        self.triggers[phase][eventType].remove(trigger)
+
+
+# Test that nodes hosted by one process keep their state and files apart
+class TestNodeContext(TestCase):
+    def setUp(self):
+        self.clock = TriggerReactorClock()
+        self.dataDir = tempfile.mkdtemp()
+        self.nodes = [NodeContext(os.path.join(self.dataDir, "node" + str(index)), self.clock) for index in range(2)]
+
+    def tearDown(self):
+        shutil.rmtree(self.dataDir)
+
+    def test_separateState(self):
+        first, second = self.nodes
+        first.dht.updateSuccessor({"nodeid": "Bob"})
+        first.onionRouter.storeORKey(Fernet.generate_key(), 8, "localhost")
+        self.assertEqual(second.routingState.table().successor['nodeid'], '')
+        self.assertEqual((len(first.onionRouter.circuits), len(second.onionRouter.circuits)), (1, 0))
+        self.assertTrue(first.keyring is not second.keyring and first.eventBus is not second.eventBus)
+        self.assertEqual(first.asymmetricEncryption.keyring.path("privatekey"), os.path.join(self.dataDir, "node0", "privatekey"))
+
+    def test_startStop(self):
+        for index, node in enumerate(self.nodes):
+            node.start(9000 + index)
+        self.assertEqual([port[0] for port in self.clock.tcpServers], [9000, 9001])
+        self.nodes[0].dht.updatePredecessor({"nodeid": "Alice"})
+        self.nodes[0].stop()
+        # A stopped node no longer leaves the ring at shutdown or listens to the shared connection pool
+        triggers = [trigger[0] for trigger in self.clock.triggers['before']['shutdown']]
+        self.assertTrue(self.nodes[0].shutdown not in triggers and self.nodes[1].shutdown in triggers)
+        self.assertNotIn(self.nodes[0].dht.connectionFailed, connectionPool.unreachableListeners)
+        self.assertNotIn(self.nodes[0].lookupCache.connectionFailed, connectionPool.failureListeners)
+        self.assertIn(self.nodes[1].dht.heardFrom, connectionPool.contactListeners)
+        self.assertTrue(Path(self.nodes[0].path("DHT.json")).is_file())
+        self.assertFalse(Path(self.nodes[1].path("DHT.json")).is_file())
+        self.nodes[1].stop()
+
+
 class TestAsymmetricEncryption(TestCase):
     dht = DHT()
 
@@ -62,6 +280,11 @@ class TestAsymmetricEncryption(TestCase):
         self.peers = self.peers.read()
         self.peers = json.loads(self.peers)
 
+    # generate_keys also writes our identity key, which no test reads back
+    def tearDown(self):
+        if os.path.exists("identitykey"):
+            os.remove("identitykey")
+
     # Ensure that a public and private key pair are generated
     def test_generate_keys(self):
         self.asymmetricEncryption.generate_keys()
@@ -92,6 +315,30 @@ class TestAsymmetricEncryption(TestCase):
 
         self.assertTrue(initialText == plaintextDecrypted)
 
+    # Peer public keys are parsed once and the least recently used key is evicted
+    def test_keyringCache(self):
+        keyring = Keyring()
+        keyring.maxPublicKeys = 1
+        self.asymmetricEncryption.generate_keys()
+        pem = self.asymmetricEncryption.getPublicKey()
+        self.assertTrue(keyring.publicKey(pem) is keyring.publicKey(pem))
+        keyring.publicKey(pem.replace(b"\n", b"\r\n"))
+        self.assertTrue(keyring.statistics() == {"publicKeys": 1, "hits": 1, "misses": 2})
+
+    # Both sides of the X25519 handshake derive the same circuit key, and the identity key is found in the published record
+    def test_circuitHandshake(self):
+        self.asymmetricEncryption.generate_keys()
+        keyring = self.asymmetricEncryption.keyring
+        identity = keyring.publicKey(self.asymmetricEncryption.getPublicRecord(), X25519PublicKey)
+        self.assertTrue(keyring.publicKey(self.asymmetricEncryption.getPublicKey(), X25519PublicKey) is None)
+
+        handshake = CircuitHandshake()
+        ephemeral, clientPublic = handshake.clientStart()
+        serverPublic, serverKey = handshake.server(keyring.identityKey(), clientPublic, 7)
+        clientKey = handshake.clientFinish(ephemeral, identity, serverPublic, 7)
+        self.assertTrue(clientKey == serverKey)
+        self.assertTrue(Fernet(clientKey).decrypt(Fernet(serverKey).encrypt(b"cell")) == b"cell")
+
 
 # Test the utility class
 class TestUtils(TestCase):
@@ -124,3 +371,848 @@ class TestSymmetricEncryption(TestCase):
         key3 = self.symmetricEncryption.createKeys()
         self.assertTrue(key1 != key2 != key3)
 
+
+# Test finger table arithmetic on the identifier circle
+class TestFingerTable(TestCase):
+    def setUp(self):
+        self.fingerTable = FingerTable()
+        self.fingerTable.nodeid = {"ip": "localhost", "port": "8000", "user": "Alice", "nodeid": "0" * 63 + "1", "publickey": ""}
+
+    def node(self, nodeid):
+        return {"ip": "localhost", "port": "8001", "user": nodeid, "nodeid": nodeid, "publickey": ""}
+
+    def test_fingerStart(self):
+        self.assertTrue(self.fingerTable.fingerStart(0) == 2)
+        self.assertTrue(self.fingerTable.fingerStartID(255) == "8" + "0" * 62 + "1")
+
+    def test_closestPrecedingFinger(self):
+        near = self.node("1" + "0" * 63)
+        far = self.node("8" + "0" * 63)
+        self.fingerTable.setFinger(0, near)
+        self.fingerTable.setFinger(255, far)
+        self.assertTrue(self.fingerTable.closestPrecedingFinger("9" + "0" * 63) == far)
+        self.assertTrue(self.fingerTable.closestPrecedingFinger("2" + "0" * 63) == near)
+        self.assertTrue(self.fingerTable.closestPrecedingFinger("0" * 64) == far)
+
+    def test_compactFingers(self):
+        self.fingerTable.setFinger(0, self.node("1" + "0" * 63))
+        self.fingerTable.setFinger(255, self.node("8" + "0" * 63))
+        runs = self.fingerTable.compactFingers()
+        copy = FingerTable()
+        copy.loadFingers(runs)
+        self.assertTrue(len(runs) == 3)
+        self.assertTrue(copy.fingers == self.fingerTable.fingers)
+
+
+# Test that outbound messages share pooled connections
+class TestConnectionPool(TestCase):
+    def setUp(self):
+        self.reactor = MemoryReactorClock()
+        self.pool = ConnectionPool(self.reactor)
+
+    def connect(self, index):
+        transport = StringTransport()
+        self.reactor.tcpClients[index][2].buildProtocol(None).makeConnection(transport)
+        return transport
+
+    def test_send(self):
+        self.pool.send("localhost", "8000", MessageFactory(b"first"))
+        self.pool.send("localhost", 8000, MessageFactory(b"second"))
+        self.assertTrue(len(self.reactor.tcpClients) == 1)
+        transport = self.connect(0)
+        self.pool.send("localhost", 8000, MessageFactory(b"third"))
+        self.assertTrue(len(self.reactor.tcpClients) == 1)
+        self.assertTrue(transport.value() == b"\x00\x00\x00\x05first\x00\x00\x00\x06second\x00\x00\x00\x05third")
+
+    def test_pipelinedReplies(self):
+        first = self.pool.send("localhost", 8000, MessageFactory(b"first", expectsReply=True))
+        second = self.pool.send("localhost", 8000, MessageFactory(b"second", expectsReply=True))
+        self.connect(0)
+        protocol = self.pool.peers[("localhost", 8000)].connections[0]
+        replies = []
+        first.addCallback(replies.append)
+        second.addCallback(replies.append)
+        protocol.dataReceived(b"\x00\x00\x00\x03one\x00\x00\x00")
+        protocol.dataReceived(b"\x03two")
+        self.assertTrue(replies == [b"one", b"two"])
+
+    def test_idleEviction(self):
+        self.pool.send("localhost", 8000, MessageFactory(b"first"))
+        transport = self.connect(0)
+        self.reactor.advance(self.pool.idleTimeout + 1)
+        self.assertTrue(transport.disconnecting)
+
+    def test_reconnectBackoff(self):
+        self.pool.send("localhost", 8000, MessageFactory(b"first"))
+        self.reactor.tcpClients[0][2].clientConnectionFailed(None, None)
+        self.assertTrue(len(self.reactor.tcpClients) == 1)
+        self.reactor.advance(self.pool.initialDelay * 2)
+        self.assertTrue(len(self.reactor.tcpClients) == 2)
+        transport = self.connect(1)
+        self.assertTrue(transport.value() == b"\x00\x00\x00\x05first")
+
+    def test_unreachableAfterMaxRetries(self):
+        unreachable, contacted = [], []
+        self.pool.addUnreachableListener(unreachable.append)
+        self.pool.addContactListener(contacted.append)
+        self.pool.send("localhost", 8000, MessageFactory(b"first", expectsReply=True)).addErrback(lambda failure: None)
+        for attempt in range(self.pool.maxRetries):
+            self.reactor.tcpClients[attempt][2].clientConnectionFailed(None, None)
+            self.reactor.advance(self.pool.maxDelay * 2)
+        self.assertTrue(unreachable == [])
+        self.reactor.tcpClients[-1][2].clientConnectionFailed(None, None)
+        self.assertTrue(unreachable == [("localhost", 8000)])
+
+        reply = self.pool.send("localhost", 8000, MessageFactory(b"second", expectsReply=True))
+        self.connect(-1)
+        self.pool.peers[("localhost", 8000)].connections[0].dataReceived(b"\x00\x00\x00\x03one")
+        self.assertTrue(contacted == [("localhost", 8000)])
+
+
+# Test that framed messages are reassembled and oversized frames are refused
+class TestFramedProtocol(TestCase):
+    def setUp(self):
+        self.received = []
+        self.protocol = FramedProtocol()
+        self.protocol.stringReceived = self.received.append
+        self.transport = StringTransport()
+        self.protocol.makeConnection(self.transport)
+
+    def test_partialReads(self):
+        self.protocol.dataReceived(b"\x00\x00")
+        self.protocol.dataReceived(b"\x00\x05hel")
+        self.assertTrue(self.received == [])
+        self.protocol.dataReceived(b"lo\x00\x00\x00\x02hi")
+        self.assertTrue(self.received == [b"hello", b"hi"])
+
+    def test_lengthLimitExceeded(self):
+        self.protocol.dataReceived(b"\x7f\xff\xff\xff")
+        self.assertTrue(self.received == [])
+        self.assertTrue(self.transport.disconnecting)
+
+
+# Test that every field survives the binary codec, including usernames that broke the old quote replacing parser
+class TestMessageCodec(TestCase):
+    user = {"ip": "localhost", "port": "8000", "user": "O'Brien \"Bob\"",
+            "nodeid": "cd9fb1e148ccd8442e5aa74904cc73bf6fb54d1d54d333bd596aa9bb4bb4e961",
+            "publickey": "-----BEGIN PUBLIC KEY-----\n"}
+
+    def test_encodeUser(self):
+        register = dict(self.user, **RequestRoute.new())
+        encoded = MessageCodec.encode(MessageCodec.REGISTER, register)
+        self.assertTrue(MessageCodec.decode(encoded) == (MessageCodec.REGISTER, register))
+        self.assertTrue(RequestRoute.split(register)[0] == self.user)
+
+    def test_encodeSearch(self):
+        search = dict({"username": self.user['nodeid'], "ip": "localhost", "port": "8000"}, **RequestRoute.new())
+        encoded = MessageCodec.encode(MessageCodec.SEARCH, search)
+        self.assertTrue(MessageCodec.messageType(encoded) == MessageCodec.SEARCH)
+        self.assertTrue(MessageCodec.decode(encoded)[1] == search)
+
+    def test_decodeInvalid(self):
+        encoded = MessageCodec.encode(MessageCodec.ONION, {"circid": 1, "seq": 1, "cell": b"payload"})
+        self.assertRaises(ValueError, MessageCodec.decode, encoded[:-1])
+        self.assertRaises(ValueError, MessageCodec.decode, bytes([MessageCodec.VERSION + 1]) + encoded[1:])
+
+
+class RingNodes():
+    """
+
+    Ring nodes builds the DHT algorithms of nodes in a test ring. The test case stands in for the connection pool and
+    records every message sent, each node's routing state is kept in a temporary directory removed after the test
+
+    """
+
+    def setUpRing(self, clock):
+        self.clock = clock
+        self.sent = []
+        self.dataDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dataDir)
+
+    def send(self, ip, port, message):
+        self.sent.append((port, message))
+        return message.reply
+
+    # The DHT algorithms of a node whose routing table holds the given neighbours
+    def ringNode(self, own, predecessor, successor, following=(), eventBus=None):
+        fingerTable = FingerTable()
+        fingerTable.nodeid = own
+        fingerTable.predecessor = predecessor
+        fingerTable.setSuccessor(successor, following)
+        fingerTable.resetFingers(successor)
+        routing = RoutingState(self.clock, os.path.join(self.dataDir, own['user'] + "DHT.json"),
+                               eventBus if eventBus is not None else EventBus.EventBus())
+        routing.replace(fingerTable)
+        algorithms = DHTAlgorithm.DHTAlgoirthm(DHT(routing, lookupCache=LookupCache(self.clock)), self)
+        algorithms.reactor = self.clock
+        return algorithms
+
+
+# Test that forwarded requests stop after their hop budget, never revisit a node and are only handled once
+class TestRequestRoute(RingNodes, TestCase):
+    def setUp(self):
+        self.setUpRing(MemoryReactorClock())
+        utils = Utils()
+        alice = {"ip": "localhost", "port": "8000", "user": "Alice", "nodeid": utils.generateID("Alice")}
+        bob = {"ip": "localhost", "port": "8001", "user": "Bob", "nodeid": utils.generateID("Bob")}
+        self.algorithms = self.ringNode(alice, bob, bob)
+        self.fingerTable = self.algorithms.dht.routingState.table()
+        self.search = {"username": utils.generateID("Nobody"), "ip": "localhost", "port": "8002"}
+
+    def test_forwarded(self):
+        self.algorithms.DHTInformationSearch(self.search, RequestRoute.new())
+        port, message = self.sent[0]
+        self.assertEqual((port, message.msgType, message.data['hops']), (8001, MessageCodec.SEARCH, RequestRoute.MAX_HOPS - 1))
+        self.assertTrue(RequestRoute.wasSeen(message.data['seen'], self.fingerTable.nodeid['nodeid']))
+
+    def test_hopBudgetUsed(self):
+        self.algorithms.DHTInformationSearch(self.search, dict(RequestRoute.new(), hops=1))
+        port, message = self.sent[0]
+        self.assertEqual((port, message.msgType, message.data['target']), (8002, MessageCodec.NOTFOUND, self.search['username']))
+
+    def test_loopDetected(self):
+        route = RequestRoute.new()
+        route['seen'] = RequestRoute.addSeen(route['seen'], self.fingerTable.successor['nodeid'])
+        self.algorithms.DHTInformationSearch(self.search, route)
+        self.assertEqual([message.msgType for port, message in self.sent], [MessageCodec.NOTFOUND])
+
+    def test_duplicateDropped(self):
+        route = RequestRoute.new()
+        self.algorithms.DHTInformationSearch(self.search, route)
+        self.algorithms.DHTInformationSearch(self.search, route)
+        self.assertEqual((len(self.sent), self.algorithms.duplicatesDropped), (1, 1))
+
+
+# Test that the successor list keeps the ring together when our successor stops answering
+class TestSuccessorList(RingNodes, TestCase):
+    def setUp(self):
+        self.setUpRing(MemoryReactorClock())
+        utils = Utils()
+        # Sort the nodes by ID so each one follows the last round the ring
+        self.nodes = sorted(({"ip": "localhost", "port": str(8000 + index), "user": name, "nodeid": utils.generateID(name),
+                              "publickey": ""} for index, name in enumerate(("Alice", "Bob", "Carol", "Dave", "Eve"))),
+                            key=lambda node: node['nodeid'])
+        own, successor, second, third, predecessor = self.nodes
+        self.algorithms = self.ringNode(own, predecessor, successor, [second, third])
+        self.fingerTable = self.algorithms.dht.routingState.table()
+
+    def test_removeSuccessor(self):
+        own, successor, second, third, predecessor = self.nodes
+        self.assertTrue(self.fingerTable.removeNode(successor['nodeid']))
+        self.assertEqual(self.fingerTable.successorList(), [second, third])
+        self.assertEqual(self.fingerTable.fingers[0], second)
+        self.assertFalse(self.fingerTable.removeNode(successor['nodeid']))
+
+    def test_stabilizeTimeout(self):
+        own, successor, second, third, predecessor = self.nodes
+        self.algorithms.stabilize()
+        self.clock.advance(self.algorithms.stabilizeTimeout)
+        # The next node of the successor list takes over and is asked straight away
+        self.assertEqual([port for port, message in self.sent], [int(successor['port']), int(second['port'])])
+        self.assertEqual(self.fingerTable.successor, second)
+        self.assertTrue(self.algorithms.dht.hasFailed(successor))
+
+    def test_successorsReturned(self):
+        own, successor, second, third, predecessor = self.nodes
+        self.algorithms.stabilize()
+        reply = MessageCodec.encode(MessageCodec.SUCCESSORS, {'predecessor': own, 'successors': [second, third, predecessor]})
+        self.sent[0][1].reply.callback(reply)
+        self.assertEqual(self.fingerTable.successorList(), [successor, second, third, predecessor])
+        # A node has joined between us and our successor
+        joined = dict(own, user="Joined", nodeid="%064x" % (self.fingerTable.idToInt(own['nodeid']) + 1))
+        self.algorithms.stabilize()
+        reply = MessageCodec.encode(MessageCodec.SUCCESSORS, {'predecessor': joined, 'successors': [second, third]})
+        self.sent[1][1].reply.callback(reply)
+        self.assertEqual(self.fingerTable.successor['user'], "Joined")
+
+    def test_failedNodeReadopted(self):
+        own, successor, second, third, predecessor = self.nodes
+        dht = self.algorithms.dht
+        address = (successor['ip'], int(successor['port']))
+        dht.nodeFailed(successor)
+        self.assertTrue(dht.hasFailed(successor))
+        # Any reply from the node clears it
+        dht.heardFrom(address)
+        self.assertFalse(dht.hasFailed(successor))
+        # Otherwise the entry expires and the node can be adopted again when our successor reports it
+        dht.nodeFailed(successor)
+        self.clock.advance(dht.failedTTL)
+        dht.successorsReturned(second, successor, [third])
+        self.assertEqual(self.fingerTable.successor, successor)
+
+    def test_stabilizeReceived(self):
+        own, successor, second, third, predecessor = self.nodes
+        self.algorithms.dht.nodeFailed(predecessor)
+        answer = self.algorithms.stabilizeReceived(third)
+        self.assertEqual(self.fingerTable.predecessor, third)
+        self.assertEqual(MessageCodec.decode(MessageCodec.encode(MessageCodec.SUCCESSORS, answer))[1]['successors'],
+                         [successor, second, third])
+
+
+# Test that ring maintenance speeds up under churn and measures how long the ring takes to converge
+class TestStabilizer(RingNodes, TestCase):
+    def setUp(self):
+        self.setUpRing(MemoryReactorClock())
+        self.own = {"ip": "localhost", "port": "8000", "user": "Alice", "nodeid": "%064x" % 1, "publickey": ""}
+        self.successor = {"ip": "localhost", "port": "8001", "user": "Bob", "nodeid": "%064x" % 100, "publickey": ""}
+        bus = EventBus.EventBus()
+        self.algorithms = self.ringNode(self.own, self.successor, self.successor, eventBus=bus)
+        self.stabilizer = Stabilizer(self.algorithms, bus, self.clock)
+        self.stabilizer.jitter = 0
+
+    def tearDown(self):
+        self.stabilizer.stop()
+
+    def test_periodsAdaptToChurn(self):
+        self.stabilizer.start()
+        self.assertEqual(self.stabilizer.period("stabilize"), self.algorithms.stabilizeInterval * Stabilizer.maxScale)
+        joined = dict(self.own, user="Carol", nodeid="%064x" % 50)
+        for _ in range(4):
+            self.algorithms.dht.updateSuccessor(joined)
+            self.algorithms.dht.updateSuccessor(self.successor)
+        self.assertEqual(self.stabilizer.period("stabilize"), self.algorithms.stabilizeInterval * Stabilizer.minScale)
+        # Changes older than the churn window no longer count
+        self.clock.advance(Stabilizer.churnWindow)
+        self.assertEqual(self.stabilizer.scale(), Stabilizer.maxScale)
+
+    def test_convergence(self):
+        self.stabilizer.start()
+        self.algorithms.dht.updateSuccessor(dict(self.own, user="Carol", nodeid="%064x" % 50))
+        self.clock.advance(5)
+        self.stabilizer.stabilize()
+        reply = MessageCodec.encode(MessageCodec.SUCCESSORS, {'predecessor': self.own, 'successors': [self.successor]})
+        self.sent[-1][1].reply.callback(reply)
+        statistics = self.stabilizer.statistics()
+        self.assertEqual((statistics["convergences"], statistics["lastConvergence"], statistics["converging"]), (1, 5, False))
+
+    def test_checkPredecessorTimeout(self):
+        self.stabilizer.start()
+        self.stabilizer.tasks["checkPredecessor"][2] = 0
+        self.clock.advance(Stabilizer.tickInterval)
+        self.assertEqual([message.msgType for port, message in self.sent], [MessageCodec.PING])
+        self.clock.advance(self.algorithms.stabilizeTimeout)
+        self.assertTrue(self.algorithms.dht.hasFailed(self.successor))
+        self.assertEqual(self.stabilizer.runs["checkPredecessor"], 1)
+
+
+# Test that peers which stop answering pings are suspected within a bounded time and avoided
+class TestFailureDetector(RingNodes, TestCase):
+    def setUp(self):
+        self.setUpRing(MemoryReactorClock())
+        self.own = {"ip": "localhost", "port": "8000", "user": "Alice", "nodeid": "%064x" % 1, "publickey": ""}
+        self.successor = {"ip": "localhost", "port": "8001", "user": "Bob", "nodeid": "%064x" % 100, "publickey": ""}
+        self.predecessor = {"ip": "localhost", "port": "8002", "user": "Carol", "nodeid": "%064x" % 200, "publickey": ""}
+        self.dht = self.ringNode(self.own, self.predecessor, self.successor).dht
+        self.peerList = self.dht.routingState.table().toDict()
+        self.detector = FailureDetector(self.dht.routingState, self.clock, self)
+        self.dht.failureDetector = self.detector
+        self.suspected = []
+        self.detector.addSuspicionListener(self.suspected.append)
+
+    # Answer every outstanding ping to a port after the given round trip
+    def answer(self, port, rtt=0.1):
+        self.clock.advance(rtt)
+        for sentTo, message in self.sent:
+            if sentTo == port and not message.reply.called:
+                message.reply.callback(MessageCodec.encode(MessageCodec.PONG, {}))
+
+    def test_silentPeerSuspected(self):
+        for _ in range(5):
+            self.detector.heartbeat()
+            self.answer(8001)
+            self.answer(8002)
+            self.clock.advance(FailureDetector.heartbeatInterval - 0.2)
+        self.assertEqual((self.detector.suspected, self.detector.phi(("localhost", 8001)) < 1), (set(), True))
+
+        # Bob stops answering and is suspected once his phi passes the threshold, well before maxSilence
+        for _ in range(10):
+            self.detector.heartbeat()
+            self.answer(8002)
+            self.clock.advance(FailureDetector.heartbeatInterval - 0.1)
+        self.assertEqual(self.suspected, [("localhost", 8001)])
+        self.assertTrue(self.detector.silence(("localhost", 8001)) < FailureDetector.maxSilence)
+        self.assertEqual([peer['user'] for peer in PathSelector(self.detector).choose(self.peerList, 2)], ["Carol"])
+
+        # An answer clears the suspicion
+        self.detector.heartbeat()
+        self.answer(8001)
+        self.assertFalse(self.detector.isSuspected(("localhost", 8001)))
+
+    def test_neverAnsweredSuspected(self):
+        while self.clock.seconds() < FailureDetector.maxSilence:
+            self.detector.heartbeat()
+            self.answer(8002)
+            self.clock.advance(FailureDetector.heartbeatInterval)
+        self.detector.heartbeat()
+        self.assertEqual(self.suspected, [("localhost", 8001)])
+        self.assertTrue(self.detector.timeouts > 0)
+
+    def test_adaptiveTimeout(self):
+        self.assertEqual(self.detector.timeout(("localhost", 8001)), FailureDetector.maxTimeout)
+        for _ in range(5):
+            self.detector.heartbeat()
+            self.answer(8001, 0.05)
+            self.clock.advance(FailureDetector.heartbeatInterval)
+        self.assertEqual(self.detector.timeout(("localhost", 8001)), FailureDetector.minTimeout)
+
+    def test_suspectedNodeDropped(self):
+        dht = self.dht
+        self.detector.suspected.add(("localhost", 8001))
+        dht.nodeSuspected(("localhost", 8001))
+        self.assertEqual(self.detector.routingState.table().successor, self.predecessor)
+        # Bob is skipped while he is suspected but is not failed, he can be adopted again once suspicion clears
+        self.assertEqual((dht.hasFailed(self.successor), dht.failed), (True, {}))
+        self.detector.suspected.discard(("localhost", 8001))
+        self.assertFalse(dht.hasFailed(self.successor))
+
+
+# Test that a node leaving the ring splices its neighbours together and hands over its cached records
+class TestLeave(RingNodes, TestCase):
+    def setUp(self):
+        self.setUpRing(MemoryReactorClock())
+        self.alice = {"ip": "localhost", "port": "8000", "user": "Alice", "nodeid": "%064x" % 1, "publickey": ""}
+        self.bob = {"ip": "localhost", "port": "8001", "user": "Bob", "nodeid": "%064x" % 100, "publickey": ""}
+        self.carol = {"ip": "localhost", "port": "8002", "user": "Carol", "nodeid": "%064x" % 200, "publickey": ""}
+
+    def test_leave(self):
+        bob = self.ringNode(self.bob, self.alice, self.carol, [self.alice])
+        bob.dht.lookupCache.put({"ip": "localhost", "port": "8003", "user": "Dave", "nodeid": "%064x" % 300, "publickey": ""})
+        acknowledged = []
+        bob.leave().addCallback(acknowledged.append)
+        # Our successor is handed the cached records, both neighbours learn who follows us
+        self.assertEqual([(port, [user['user'] for user in message.data['records']]) for port, message in self.sent],
+                         [(8002, ["Dave"]), (8000, [])])
+        self.assertEqual([user['user'] for user in self.sent[0][1].data['successors']], ["Carol", "Alice"])
+        self.sent[0][1].reply.callback(MessageCodec.encode(MessageCodec.LEFT, {}))
+        self.clock.advance(DHTAlgorithm.DHTAlgoirthm.stabilizeTimeout)
+        self.assertEqual(acknowledged, [1])
+
+    def test_leaveReceived(self):
+        leaving = MessageCodec.decode(MessageCodec.encode(MessageCodec.LEAVE, {
+            'node': self.bob, 'predecessor': self.alice, 'successors': [self.carol, self.alice],
+            'records': [dict(self.carol, user="Dave", nodeid="%064x" % 300)]}))[1]
+
+        # Bob's predecessor now follows straight on to Carol
+        alice = self.ringNode(self.alice, self.carol, self.bob, [self.carol])
+        alice.leaveReceived(leaving)
+        self.assertEqual(alice.dht.routingState.table().successorList(), [self.carol])
+        self.assertEqual(alice.dht.routingState.table().fingers[0], self.carol)
+
+        # Bob's successor takes Alice as its predecessor and Bob's cached records
+        carol = self.ringNode(self.carol, self.bob, self.alice, [self.bob])
+        carol.leaveReceived(leaving)
+        fingerTable = carol.dht.routingState.table()
+        self.assertEqual((fingerTable.predecessor, fingerTable.successorList()), (self.alice, [self.alice]))
+        self.assertEqual(carol.dht.lookupCache.get("%064x" % 300)['user'], "Dave")
+
+
+# Test that replies are written in the order of the requests, whatever order they become ready in
+class TestServerReplies(TestCase):
+    def setUp(self):
+        self.decrypting = Deferred()
+        self.server = Server()
+        self.server.onionRouter = self
+        self.transport = StringTransport()
+        self.server.makeConnection(self.transport)
+
+    def recieveORKey(self, data, transport):
+        return self.decrypting
+
+    def spareCapacity(self):
+        return 3
+
+    # Message types of the frames written so far
+    def written(self):
+        data, types = self.transport.value(), []
+        while data:
+            length = int.from_bytes(data[:4], 'big')
+            types.append(MessageCodec.decode(data[4:4 + length])[0])
+            data = data[4 + length:]
+        return types
+
+    def test_repliesInRequestOrder(self):
+        self.server.createReceived({'circid': 1, 'key': b"key"})
+        self.server.pingReceived({})
+        # The PONG is ready first but waits behind the KEYRECIEVED
+        self.assertEqual(self.written(), [])
+        self.decrypting.callback(None)
+        self.assertEqual(self.written(), [MessageCodec.KEYRECIEVED, MessageCodec.PONG])
+
+    def test_failedReplyDropsConnection(self):
+        self.server.createReceived({'circid': 1, 'key': b"key"})
+        self.server.pingReceived({})
+        self.decrypting.errback(ValueError("bad key"))
+        self.assertEqual((self.written(), self.transport.disconnecting), ([], True))
+
+
+# Test that messages reach the handler registered for their type and are counted
+class TestCommandDispatcher(TestCase):
+    def setUp(self):
+        self.dispatcher = CommandDispatcher()
+        self.handled = []
+        self.dispatcher.register(MessageCodec.ONION, lambda protocol, fields: self.handled.append(fields['cell']))
+
+    def test_dispatch(self):
+        # A ciphertext containing an old style command marker must still be routed by its header
+        self.dispatcher.dispatch(None, MessageCodec.encode(MessageCodec.ONION, {"circid": 1, "seq": 1, "cell": b"==SEARCH=="}))
+        self.assertTrue(self.handled == [b"==SEARCH=="])
+        self.assertTrue(self.dispatcher.statistics()["ONION"]["count"] == 1)
+
+    def test_dispatchUnhandled(self):
+        self.dispatcher.dispatch(None, MessageCodec.encode(MessageCodec.KEYRECIEVED, {'capacity': 10}))
+        self.dispatcher.dispatch(None, b"\x01")
+        self.assertTrue(self.handled == [])
+        self.assertTrue(self.dispatcher.dropped == 2)
+
+
+# Test that relays find the circuit key from the circuit ID on the cell
+class TestOnionRouter(TestCase):
+    def setUp(self):
+        self.onionrouter = OR()
+        self.received = []
+        self.onionrouter.messageRecieved = self.received.append
+        self.key = Fernet.generate_key()
+        self.cell = self.makeCell(1)
+
+    def makeCell(self, sequence):
+        return OnionCell.build([{"ip": "localhost", "port": "8000"}], [self.key], [8], sequence, "==MSG==ALICE: hi".encode('utf-8'))
+
+    def makeCircuit(self, key):
+        return {"ip": "localhost", "key": key, "created": time.time(), "messages": 0, "sequence": 0, "window": 1,
+                "delivered": 0, "fragments": {}}
+
+    def test_router(self):
+        self.onionrouter.circuits[7] = self.makeCircuit(Fernet.generate_key())
+        self.onionrouter.circuits[8] = self.makeCircuit(self.key)
+        self.onionrouter.router(8, 1, self.cell)
+        self.onionrouter.router(8, 2, self.makeCell(2))
+        self.assertTrue(self.received == ["==MSG==ALICE: hi", "==MSG==ALICE: hi"])
+        self.assertTrue(self.onionrouter.circuits[8]["messages"] == 2)
+
+    def test_routerUnknownCircuit(self):
+        self.onionrouter.circuits[8] = self.makeCircuit(self.key)
+        self.onionrouter.router(9, 1, self.cell)
+        self.assertTrue(self.received == [])
+
+    def test_routerReplay(self):
+        self.onionrouter.circuits[8] = self.makeCircuit(self.key)
+        self.onionrouter.router(8, 1, self.cell)
+        # The same cell again, and the same cell with a rewritten header sequence, are both dropped
+        self.onionrouter.router(8, 1, self.cell)
+        self.onionrouter.router(8, 5, self.cell)
+        self.assertTrue(len(self.received) == 1)
+
+    def test_routerOutOfOrder(self):
+        # The pool can carry the cells of one circuit over different connections, so the second may arrive first
+        self.onionrouter.circuits[8] = self.makeCircuit(self.key)
+        hop = [{"ip": "localhost", "port": "8000"}]
+        first = OnionCell.build(hop, [self.key], [8], 1, b"==MSG==ALICE: one ", more=True)
+        second = OnionCell.build(hop, [self.key], [8], 2, b"two")
+        self.onionrouter.router(8, 2, second)
+        self.assertTrue(self.received == [])
+        self.onionrouter.router(8, 1, first)
+        self.onionrouter.router(8, 1, first)
+        self.assertTrue(self.received == ["==MSG==ALICE: one two"])
+        self.assertTrue(self.onionrouter.circuits[8]["messages"] == 2)
+
+    def test_routerLostCell(self):
+        self.onionrouter.circuits[8] = self.makeCircuit(self.key)
+        self.onionrouter.replayWindow = 2
+        # Cell 1 never arrives, cell 2 may have been the rest of its message and is dropped with it once cell 1 is
+        # out of the replay window, the message in cell 3 is delivered
+        self.onionrouter.router(8, 2, self.makeCell(2))
+        self.assertTrue(self.received == [])
+        self.onionrouter.router(8, 3, self.makeCell(3))
+        self.assertTrue(self.received == ["==MSG==ALICE: hi"])
+        self.assertTrue(self.onionrouter.isReplay(self.onionrouter.circuits[8], 1))
+
+    def test_routerExpiredCircuit(self):
+        self.onionrouter.circuits[8] = self.makeCircuit(self.key)
+        self.onionrouter.circuits[8]["created"] -= OR.circuitLifetime
+        self.onionrouter.router(8, 1, self.cell)
+        self.assertTrue(self.received == [])
+        self.assertTrue(8 not in self.onionrouter.circuits)
+
+
+# Test that cells keep the same size at every hop and that each hop only reads its own layer
+class TestOnionCell(TestCase):
+    def setUp(self):
+        self.hops = [{"ip": "10.0.0.1", "port": "8001"}, {"ip": "10.0.0.2", "port": "8002"}, {"ip": "10.0.0.3", "port": "8003"}]
+        self.keys = [Fernet.generate_key() for hop in self.hops]
+        self.circuitIDs = [11, 12, 13]
+
+    def test_peel(self):
+        cell = OnionCell.build(self.hops, self.keys, self.circuitIDs, 4, b"hello")
+        cmd, header, cell = OnionCell.peel(self.keys[0], 4, cell)
+        self.assertTrue(cmd == OnionCell.FWD and header == {"circid": 12, "port": 8002, "ip": "10.0.0.2"})
+        self.assertTrue(len(cell) == OnionCell.CELL_SIZE)
+        cmd, header, cell = OnionCell.peel(self.keys[1], 4, cell)
+        self.assertTrue(cmd == OnionCell.FWD and header["circid"] == 13)
+        self.assertTrue(OnionCell.peel(self.keys[2], 4, cell)[:2] == (OnionCell.MSG, b"hello"))
+
+    def test_peelTampered(self):
+        cell = bytearray(OnionCell.build(self.hops, self.keys, self.circuitIDs, 4, b"hello"))
+        cell[30] ^= 1
+        self.assertRaises(ValueError, OnionCell.peel, self.keys[0], 4, bytes(cell))
+        self.assertRaises(ValueError, OnionCell.peel, self.keys[0], 5, OnionCell.build(self.hops, self.keys, self.circuitIDs, 4, b"hello"))
+        self.assertRaises(ValueError, OnionCell.build, self.hops, self.keys, self.circuitIDs, 4, b"x" * (OnionCell.capacity(3) + 1))
+
+    def test_ipTooLong(self):
+        self.hops[1]['ip'] = "relay." * 8 + "example"
+        self.assertRaises(ValueError, OnionCell.build, self.hops, self.keys, self.circuitIDs, 4, b"hello")
+        self.hops[1]['ip'] = "a" * OnionCell.IP_SIZE
+        cmd, route, forward = OnionCell.peel(self.keys[0], 4, OnionCell.build(self.hops, self.keys, self.circuitIDs, 4, b"hello"))
+        self.assertEqual(route['ip'], "a" * OnionCell.IP_SIZE)
+
+
+# Test that a circuit is reused until it runs out of lifetime or messages
+class TestCircuit(TestCase):
+    def test_isExpired(self):
+        circuit = Circuit([{}, {}, {}], [b"", b"", b""], [1, 2, 3])
+        self.assertFalse(circuit.isExpired())
+        self.assertTrue(circuit.nextSequence() == 1)
+        self.assertTrue(circuit.isExpired(circuit.created + Circuit.lifetime))
+        circuit.sequence = Circuit.maxMessages
+        self.assertTrue(circuit.isExpired())
+
+
+# Test that warm circuits are only handed out once both relays hold their keys
+class TestCircuitPool(TestCase):
+    def setUp(self):
+        self.onionrouter = OR()
+        self.pool = CircuitPool(self.onionrouter)
+        self.peers = {"nodeid": {"ip": "localhost", "port": "8000", "nodeid": "a0"},
+                      "successor": {"ip": "localhost", "port": "8001", "nodeid": "b0"},
+                      "predecessor": {"ip": "localhost", "port": "8002", "nodeid": "c0"}}
+
+    def test_take(self):
+        self.onionrouter.exchangeKey = lambda circuit, index: succeed(MessageCodec.encode(MessageCodec.KEYRECIEVED, {'capacity': 10}))
+        self.pool.build(self.peers)
+        circuit = self.pool.take()
+        self.assertTrue(len(circuit.hops) == 2 and circuit.isEstablished())
+        self.assertTrue(self.pool.take() is None)
+        self.assertTrue(self.pool.statistics()["hits"] == 1 and self.pool.statistics()["misses"] == 1)
+
+    def test_buildTimeout(self):
+        self.onionrouter.reactor = Clock()
+        self.onionrouter.exchangeKey = lambda circuit, index: Deferred()
+        circuit = Circuit([{"ip": "localhost", "port": "8001"}], [b""], [1])
+        errors = []
+        self.onionrouter.establish(circuit, [0]).addErrback(lambda failure: errors.append(failure.type))
+        self.onionrouter.reactor.advance(OR.circuitBuildTimeout)
+        self.assertTrue(errors == [CircuitBuildError])
+
+    def test_establishLatency(self):
+        self.onionrouter.exchangeKey = lambda circuit, index: succeed(MessageCodec.encode(MessageCodec.KEYRECIEVED, {'capacity': 10}))
+        circuit = Circuit([{"ip": "localhost", "port": "8001"}, {"ip": "localhost", "port": "8002"}], [b"", b""], [1, 2])
+        established = []
+        self.onionrouter.establish(circuit, [0, 1]).addCallback(established.append)
+        self.assertTrue(established == [circuit] and sorted(circuit.latencies) == [0, 1])
+
+    def test_buildFailed(self):
+        self.onionrouter.exchangeKey = lambda circuit, index: fail(ConnectionError("relay down"))
+        self.pool.build(self.peers)
+        self.assertTrue(self.pool.statistics()["ready"] == 0 and self.pool.statistics()["building"] == 0)
+
+    def test_noRelays(self):
+        alone = dict(self.peers, successor=self.peers["nodeid"], predecessor=self.peers["nodeid"])
+        self.assertFalse(self.pool.build(alone))
+        self.assertTrue(self.pool.statistics()["building"] == 0)
+        # A circuit without relays is never handed out
+        self.pool.ready.append(Circuit([], [], []))
+        self.assertTrue(self.pool.take() is None)
+
+
+# Test that every messaging partner keeps its own circuit and switching between them does not rebuild one
+class TestSessionManager(TestCase):
+    def setUp(self):
+        self.exchanges = []
+        self.onionrouter = OR(eventBus=EventBus.EventBus())
+        self.onionrouter.exchangeKey = self.exchangeKey
+        fingerTable = FingerTable()
+        fingerTable.successor = {"ip": "localhost", "port": "8001", "nodeid": "b0", "user": "Relay"}
+        self.dataDir = tempfile.mkdtemp()
+        routing = RoutingState(MemoryReactorClock(), os.path.join(self.dataDir, "DHT.json"), self.onionrouter.eventBus)
+        routing.replace(fingerTable)
+        self.pool = ConnectionPool(MemoryReactorClock())
+        self.manager = SessionManager(self.onionrouter, routing, CircuitPool(self.onionrouter, routing), self.onionrouter.eventBus,
+                                      self.dataDir, self.pool)
+        self.changes = []
+        self.onionrouter.eventBus.subscribe(EventBus.CIRCUIT_CHANGED, lambda session, established: self.changes.append(established))
+
+    def tearDown(self):
+        shutil.rmtree(self.dataDir)
+
+    def exchangeKey(self, circuit, index):
+        self.exchanges.append(circuit.hops[index]['port'])
+        return succeed(MessageCodec.encode(MessageCodec.KEYRECIEVED, {'capacity': 10}))
+
+    def partner(self, name, port):
+        return {"ip": "localhost", "port": port, "user": name, "nodeid": name + "id", "publickey": ""}
+
+    def test_sessionsIndependent(self):
+        bob = []
+        self.manager.open(self.partner("Bob", "8100")).addCallback(bob.append)
+        self.manager.open(self.partner("Carol", "8200"))
+        self.assertTrue(bob[0].isReady() and self.manager.get().partner['user'] == "Carol")
+        self.assertTrue(bob[0].circuit is not self.manager.get("Carolid").circuit)
+        built = len(self.exchanges)
+
+        # Switching back to Bob reuses his circuit
+        switched = []
+        self.manager.select("Bobid").addCallback(switched.append)
+        self.assertEqual((switched, len(self.exchanges), self.manager.current), (bob, built, "Bobid"))
+        self.assertEqual(self.changes, [True, True])
+
+    def test_evictAndReload(self):
+        self.manager.maxSessions = 2
+        for name, port in (("Bob", "8100"), ("Carol", "8200"), ("Dave", "8300")):
+            self.manager.open(self.partner(name, port))
+        self.assertEqual(list(self.manager.table()), ["Carolid", "Daveid"])
+
+        reloaded = SessionManager(self.onionrouter, self.manager.routingState, self.manager.circuitPool, dataDir=self.dataDir)
+        self.assertEqual((list(reloaded.table()), reloaded.current), (["Carolid", "Daveid"], "Daveid"))
+        self.assertFalse(reloaded.get().isReady())
+
+    def test_buildFailed(self):
+        self.onionrouter.exchangeKey = lambda circuit, index: fail(ConnectionError("relay down"))
+        errors = []
+        self.manager.open(self.partner("Bob", "8100")).addErrback(lambda failure: errors.append(failure.type))
+        self.assertEqual((errors, self.changes), ([CircuitBuildError], [False]))
+        # The session is kept, sending tries another circuit and fails with it
+        self.manager.send("Hello").addErrback(lambda failure: errors.append(failure.type))
+        self.assertEqual((errors, self.changes), ([CircuitBuildError] * 2, [False, False]))
+        self.manager.close("Bobid")
+        self.assertRaises(ValueError, self.manager.send, "Hello")
+
+    def test_sendAfterExpiry(self):
+        sessions = []
+        self.manager.open(self.partner("Bob", "8100")).addCallback(sessions.append)
+        expired = sessions[0].circuit
+        # The circuit reaches its lifetime while the session is idle
+        expired.created -= Circuit.lifetime
+        built = len(self.exchanges)
+        sent = []
+        self.manager.send("Hello").addCallback(sent.append)
+        self.assertEqual((sent, sessions[0].sent), (sessions, 1))
+        self.assertTrue(sessions[0].circuit is not expired and len(self.exchanges) > built)
+        self.assertEqual(len(self.pool.peers), 1)
+
+    def test_tooFewRelays(self):
+        # Our only relay is the partner itself, no circuit is built straight to it
+        errors = []
+        self.manager.open(self.partner("Relay", "8001")).addErrback(lambda failure: errors.append(failure.type))
+        self.assertEqual((errors, self.changes, self.exchanges), ([CircuitBuildError], [False], []))
+
+
+# Test that search results expire, misses are remembered and unreachable users are dropped
+class TestLookupCache(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.pool = ConnectionPool(self.clock)
+        self.cache = LookupCache(self.clock)
+        self.pool.addFailureListener(self.cache.connectionFailed)
+        self.bob = {"ip": "localhost", "port": "8001", "user": "Bob", "nodeid": "b0"}
+
+    def test_ttl(self):
+        self.cache.put(self.bob)
+        self.assertEqual(self.cache.get("b0"), self.bob)
+        self.clock.advance(LookupCache.ttl)
+        self.assertTrue(self.cache.get("b0") is None)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_negative(self):
+        self.cache.expect("b0")
+        self.clock.advance(LookupCache.searchTimeout)
+        self.assertTrue(self.cache.isMissing("b0") and self.cache.get("b0") is None)
+        self.clock.advance(LookupCache.negativeTTL)
+        self.assertFalse(self.cache.isMissing("b0"))
+
+        # An answer that arrives in time cancels the timeout
+        self.cache.expect("b0")
+        self.cache.put(self.bob)
+        self.clock.advance(LookupCache.searchTimeout)
+        self.assertEqual((self.cache.get("b0"), self.cache.pending), (self.bob, {}))
+
+    def test_leastRecentlyUsedEvicted(self):
+        self.cache.maxEntries = 2
+        for nodeid in ("a0", "b0", "c0"):
+            self.cache.put(dict(self.bob, nodeid=nodeid))
+            self.cache.get("a0")
+        self.assertEqual(list(self.cache.entries), ["c0", "a0"])
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_invalidatedOnConnectionFailure(self):
+        self.cache.put(self.bob)
+        self.cache.put(dict(self.bob, port="8002", nodeid="c0"))
+        self.pool.connectionFailed(("localhost", 8001))
+        self.assertEqual((list(self.cache.entries), self.cache.invalidations), (["c0"], 1))
+
+
+# Runs crypto pool work as soon as it is queued so results can be checked without worker threads
+class ImmediateThreadPool():
+    def __init__(self):
+        self.waiting = []
+
+    def callInThreadWithCallback(self, onResult, function):
+        self.waiting.append((onResult, function))
+
+    def runAll(self):
+        while self.waiting:
+            onResult, function = self.waiting.pop(0)
+            try:
+                onResult(True, function())
+            except Exception:
+                onResult(False, Failure())
+
+
+class ImmediateReactor():
+    def callFromThread(self, function, *args):
+        function(*args)
+
+
+# Test that RSA work is queued off the reactor thread and counted
+class TestCryptoPool(TestCase):
+    def setUp(self):
+        self.threadpool = ImmediateThreadPool()
+        self.pool = CryptoPool(ImmediateReactor(), self.threadpool)
+
+    def test_run(self):
+        results = []
+        self.pool.run(sum, [1, 2]).addCallback(results.append)
+        self.pool.run(int, "not a number").addErrback(lambda failure: results.append(failure.type))
+        self.assertTrue(self.pool.statistics()["queued"] == 2 and results == [])
+        self.threadpool.runAll()
+        self.assertTrue(results == [3, ValueError])
+        self.assertTrue(self.pool.statistics()["completed"] == 2 and self.pool.statistics()["maxQueueDepth"] == 2)
+
+    def test_queueFull(self):
+        self.pool.maxQueued = 1
+        errors = []
+        self.pool.run(sum, [1])
+        self.pool.run(sum, [2]).addErrback(lambda failure: errors.append(failure.type))
+        self.assertTrue(errors == [CryptoPoolFull] and self.pool.statistics()["rejected"] == 1)
+
+
+# Test that relays are drawn from the whole routing table and weighted towards fast peers
+class TestPathSelector(TestCase):
+    def setUp(self):
+        self.selector = PathSelector()
+        self.selector.random.seed(1)
+        self.peer = lambda name, port: {"ip": "localhost", "port": port, "nodeid": name}
+        self.peers = {"nodeid": self.peer("a0", "8000"), "successor": self.peer("b0", "8001"),
+                      "predecessor": self.peer("c0", "8002"),
+                      "fingers": [[0, self.peer("b0", "8001")], [200, self.peer("d0", "8003")], [250, self.peer("a0", "8000")]]}
+
+    def test_choose(self):
+        self.assertTrue(len(PathSelector.knownPeers(self.peers)) == 3)
+        relays = self.selector.choose(self.peers, 3, exclude=[self.peer("c0", "8002")])
+        self.assertTrue(sorted(relay["nodeid"] for relay in relays) == ["b0", "d0"])
+
+    def test_chooseWeighted(self):
+        self.selector.recordLatency(self.peer("b0", "8001"), 0.001)
+        for peer in (self.peer("c0", "8002"), self.peer("d0", "8003")):
+            for sample in range(10):
+                self.selector.recordLatency(peer, 5)
+        chosen = [self.selector.choose(self.peers, 1)[0]["nodeid"] for attempt in range(100)]
+        self.assertTrue(chosen.count("b0") > 80)
@@ -0,0 +1,68 @@
+'''
+    File name: EventBus.py
+    Author: Jamie Clarke
+    Date last modified: 18/03/2019
+    Python Version: 3.7
+'''
+
+import logging
+
+# Events published on this node and the arguments subscribers are called with
+ROUTING_CHANGED = "routingChanged"      # fingerTable, after our successor, predecessor or a finger changes
+CIRCUIT_CHANGED = "circuitChanged"      # session, established, once the build of a session's circuit finishes
+PARTNER_FOUND = "partnerFound"          # user, when a search for a messaging partner is answered
+SESSION_SELECTED = "sessionSelected"    # session, when the current messaging partner changes or is searched for again
+MESSAGE_RECEIVED = "messageReceived"    # message, when an onion message addressed to us has been peeled
+
+
+class EventBus():
+    """
+
+    Event bus lets the DHT, onion router and server tell the rest of the node about state changes the moment they
+    happen, so the UI never has to poll files for them. Subscribers are called synchronously on the reactor thread in
+    the order they subscribed. A subscriber that raises is logged and skipped so it cannot break the handler that
+    published the event
+
+    Attributes:
+        subscribers -   Maps an event name to the callables subscribed to it
+        published -     Maps an event name to the number of times it has been published
+
+    """
+
+    def __init__(self):
+        self.subscribers = {}
+        self.published = {}
+
+    def subscribe(self, event, subscriber):
+        self.subscribers.setdefault(event, []).append(subscriber)
+
+    def unsubscribe(self, event, subscriber):
+        if subscriber in self.subscribers.get(event, []):
+            self.subscribers[event].remove(subscriber)
+
+    """
+    publish()
+
+    Calls every subscriber of an event with the given arguments
+
+    Arguments
+    event (string): Takes the name of the event
+    args: Takes the arguments passed on to each subscriber
+
+    """
+
+    def publish(self, event, *args):
+        self.published[event] = self.published.get(event, 0) + 1
+        for subscriber in list(self.subscribers.get(event, [])):
+            try:
+                subscriber(*args)
+            except Exception:
+                logging.exception("Subscriber to " + event + " failed")
+
+    def statistics(self):
+        return {"subscribers": {event: len(subscribers) for event, subscribers in self.subscribers.items()},
+                "published": dict(self.published)}
+
+
+# The event bus of the default node
+eventBus = EventBus()
@@ -1,4 +0,0 @@
-# Useful global for tracking acknoledgements from circuit key exchanges
-class Globals():
-    circuitTracker = 0
-    circuitEstablished = False
\ No newline at end of file
@@ -20,10 +20,3 @@ def checkDHTInitialized():
         return True
     else:
         return False
-
-def checkSessionExists():
-    my_file = Path("messagingPartner.json")
-    if (my_file.is_file()):
-        return True
-    else:
-        return False